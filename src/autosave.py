@@ -0,0 +1,429 @@
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+from colours import Colours
+from config import *
+from metrics import metrics
+
+
+# the canvas is saved as a snapshot of its tiles plus an append-only log of
+# every operation since. both carry an epoch: a new snapshot bumps it and starts
+# a fresh log, and a log is only replayed onto the snapshot of the same epoch,
+# so a crash part way through switching over never applies anything twice
+LOG_MAGIC = b"ACOP"
+SNAPSHOT_MAGIC = b"ACSN"
+# version 2 added layers. version 1 files, with a single layer, are still
+# restored, and rewritten as a version 2 snapshot straight away
+VERSION = 2
+LOG_HEADER = struct.Struct("<4sHI10x")  # magic, version, epoch
+RECORD = struct.Struct("<BII")  # op, payload length, crc32 of payload
+# magic, version, epoch, tile size, colour, layers, active layer, ink bounds, has ink
+SNAPSHOT_HEADER = struct.Struct("<4sHIHBBB4i?14x")
+SNAPSHOT_LAYER = struct.Struct("<16sB?I")  # name, opacity, visible, tiles
+SNAPSHOT_TILE = struct.Struct("<iiI")  # ty, tx, compressed length
+
+OP_STROKE, OP_CLEAR, OP_RESTORE, OP_COLOUR, OP_TOOL, OP_END, OP_LAYER, OP_ACTIVE = range(1, 9)
+STROKE = struct.Struct("<BH3BBBiI")  # tool, thickness, colour, alpha, layer, hand id (-1 for none), point count
+RECT = struct.Struct("<4i")
+RESTORE = struct.Struct("<B4i")  # layer, rect
+PEN_SETTING = struct.Struct("<iB")  # hand id (-1 for every pen), colour index or tool
+HAND = struct.Struct("<i")
+LAYER = struct.Struct("<B16sB?")  # index, name, opacity, visible
+ACTIVE = struct.Struct("<B")
+
+# version 1 layouts
+SNAPSHOT_HEADER_V1 = struct.Struct("<4sHIHBI4i?15x")  # magic, version, epoch, tile size, colour, tiles, ink bounds, has ink
+STROKE_V1 = struct.Struct("<BH3BI")  # tool, thickness, colour, point count
+
+COLOUR_NAMES = [colour.name for colour in Colours]
+ALL_PENS = -1
+NO_HAND = -1
+
+# queue item telling the writer to stop
+STOP = None
+
+
+def read_log(path):
+    # (epoch, version, records, valid length). reading stops at the first torn
+    # or corrupt record, which is where a crash cut the log off
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < LOG_HEADER.size:
+        return None, VERSION, [], 0
+
+    magic, version, epoch = LOG_HEADER.unpack_from(data)
+    if magic != LOG_MAGIC or version not in (1, VERSION):
+        raise ValueError(f"{path} is not an AirCanvas operation log")
+
+    records = []
+    offset = LOG_HEADER.size
+    while offset + RECORD.size <= len(data):
+        op, length, crc = RECORD.unpack_from(data, offset)
+        payload = data[offset + RECORD.size:offset + RECORD.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        records.append((op, payload))
+        offset += RECORD.size + length
+    return epoch, version, records, offset
+
+
+def read_snapshot(path):
+    # (epoch, header fields, layers), each layer a dict with its settings,
+    # {key: tile buffer} and the same tiles still compressed
+    with open(path, "rb") as f:
+        data = f.read()
+
+    magic, version = struct.unpack_from("<4sH", data)
+    if magic != SNAPSHOT_MAGIC or version not in (1, VERSION):
+        raise ValueError(f"{path} is not an AirCanvas snapshot")
+
+    if version == 1:
+        _, _, epoch, tile_size, colour, count, *bounds, has_ink = SNAPSHOT_HEADER_V1.unpack_from(data)
+        offset = SNAPSHOT_HEADER_V1.size
+        layer_count, active = 1, 0
+    else:
+        _, _, epoch, tile_size, colour, layer_count, active, *bounds, has_ink = SNAPSHOT_HEADER.unpack_from(data)
+        offset = SNAPSHOT_HEADER.size
+
+    layers = []
+    for _ in range(layer_count):
+        layer = {"name": None, "opacity": 255, "visible": True}
+        if version > 1:
+            name, layer["opacity"], layer["visible"], count = SNAPSHOT_LAYER.unpack_from(data, offset)
+            layer["name"] = name.rstrip(b"\0").decode(errors="replace")
+            offset += SNAPSHOT_LAYER.size
+
+        tiles = layer["tiles"] = {}
+        compressed = layer["compressed"] = {}
+        for _ in range(count):
+            ty, tx, length = SNAPSHOT_TILE.unpack_from(data, offset)
+            offset += SNAPSHOT_TILE.size
+            compressed[(ty, tx)] = data[offset:offset + length]
+            tiles[(ty, tx)] = np.frombuffer(zlib.decompress(compressed[(ty, tx)]), dtype=np.uint8)
+            offset += length
+        layers.append(layer)
+
+    info = {
+        "version": version,
+        "tile_size": tile_size,
+        "colour": COLOUR_NAMES[colour],
+        "active": active,
+        "ink_bounds": tuple(bounds) if has_ink else None,
+    }
+    return epoch, info, layers
+
+
+class Autosave(threading.Thread):
+    # journals canvas operations to disk on its own thread. the canvas calls the
+    # log_* methods, which only put the operation on a queue, so the render loop
+    # never waits on the disk. encoding, compression and writes happen here
+    def __init__(
+        self,
+        directory=AUTOSAVE_DIR,
+        flush_interval=AUTOSAVE_FLUSH_INTERVAL,
+        fsync_interval=AUTOSAVE_FSYNC_INTERVAL,
+        snapshot_interval=AUTOSAVE_SNAPSHOT_INTERVAL,
+        snapshot_records=AUTOSAVE_SNAPSHOT_RECORDS,
+        buffer_bytes=AUTOSAVE_BUFFER_BYTES,
+    ):
+        super().__init__(name="autosave", daemon=True)
+        self.directory = directory
+        self.log_path = os.path.join(directory, "canvas.log")
+        self.snapshot_path = os.path.join(directory, "canvas.snapshot")
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_records = snapshot_records
+        self.buffer_bytes = buffer_bytes
+
+        self.queue = queue.SimpleQueue()
+        self.epoch = 0
+        self.log = None
+        # records queued since the last snapshot, only touched by the render thread
+        self.records = 0
+        self.last_snapshot = time.monotonic()
+        # (layer, key) -> compressed tile as in the last snapshot written. tiles
+        # that haven't changed since are written from here, so a snapshot only
+        # copies the tiles drawn on in between. writer thread only, once started
+        self.saved_tiles = {}
+        os.makedirs(directory, exist_ok=True)
+
+    # render thread side
+
+    def log_stroke(self, path, tool, colour, thickness, alpha, layer, hand_id):
+        hand_id = NO_HAND if hand_id is None else hand_id
+        self._put(OP_STROKE, (path, tool.value, colour, thickness, alpha, layer, hand_id))
+
+    def log_end(self, hand_id):
+        self._put(OP_END, (hand_id,))
+
+    def log_clear(self):
+        self._put(OP_CLEAR, ())
+
+    def log_restore(self, rect, pixels, mask, layer):
+        self._put(OP_RESTORE, (rect, pixels, mask, layer))
+
+    def log_layer(self, index, layer):
+        self._put(OP_LAYER, (index, layer.name, round(layer.opacity * 255), layer.visible))
+
+    def log_active(self, index):
+        self._put(OP_ACTIVE, (index,))
+
+    def log_colour(self, colour_name, hand_id=None):
+        self._put(OP_COLOUR, (ALL_PENS if hand_id is None else hand_id, COLOUR_NAMES.index(colour_name)))
+
+    def log_tool(self, tool, hand_id):
+        self._put(OP_TOOL, (hand_id, tool.value))
+
+    def _put(self, op, args):
+        self.queue.put((op, args))
+        self.records += 1
+
+    def maybe_snapshot(self, canvas):
+        # called once per frame, snapshots once enough has been logged
+        if not self.records:
+            return
+        due = time.monotonic() - self.last_snapshot >= self.snapshot_interval
+        if due or self.records >= self.snapshot_records:
+            self.snapshot(canvas)
+
+    def snapshot(self, canvas):
+        # copies of the tiles changed since the last snapshot are taken here so
+        # they match the log position exactly, compressing and writing them is
+        # left to the writer thread
+        self.queue.put(("snapshot", self._snapshot_args(canvas, canvas.pop_dirty_tiles("autosave"))))
+        self.records = 0
+        self.last_snapshot = time.monotonic()
+
+    def _snapshot_args(self, canvas, changed=None):
+        # each layer's tiles, a copy for those in changed (every tile when it's
+        # None) and None for those the last snapshot already holds
+        with metrics.timer("autosave_snapshot"):
+            layers = []
+            for layer in canvas.layers:
+                if changed is None:
+                    tiles = layer.tiles.export()
+                else:
+                    tiles = dict.fromkeys(layer.tiles.keys())
+                    tiles.update(layer.tiles.export(changed))
+                layers.append((layer.name, round(layer.opacity * 255), layer.visible, tiles))
+        return layers, canvas.layers.active, canvas.layers.tile_size, canvas.default_colour_name, canvas.ink_bounds
+
+    def restore(self, canvas):
+        # load the latest snapshot and replay the log written after it. returns
+        # the number of log records applied
+        journal, canvas.journal = canvas.journal, None
+        try:
+            replayed, upgrade = self._restore(canvas)
+        finally:
+            canvas.journal = journal
+
+        if upgrade:
+            # never append to an old format log, fold it into a new snapshot now
+            self._write_snapshot(*self._snapshot_args(canvas))
+            self.log.close()
+            self.log = None
+        return replayed
+
+    def _restore(self, canvas):
+        # (records replayed, whether the files were in an old format)
+        from drawing import Tools
+
+        snapshot_epoch = None
+        upgrade = False
+        if os.path.exists(self.snapshot_path):
+            snapshot_epoch, info, layers = read_snapshot(self.snapshot_path)
+            if info["tile_size"] != canvas.layers.tile_size:
+                raise ValueError(f"{self.snapshot_path} was saved with a different tile size")
+            for index, layer in enumerate(layers):
+                if index >= len(canvas.layers):
+                    canvas.add_layer(layer["name"])
+                elif layer["name"]:
+                    canvas.layers[index].name = layer["name"]
+                canvas.set_layer_opacity(layer["opacity"] / 255, index)
+                canvas.set_layer_visible(layer["visible"], index)
+                for key, buffer in layer["tiles"].items():
+                    canvas.layers[index].tiles.load(key, buffer)
+            canvas.layers.stale.update(canvas.layers.keys())
+            self.saved_tiles = {
+                (index, key): data for index, layer in enumerate(layers) for key, data in layer["compressed"].items()
+            }
+            canvas.select_layer(info["active"])
+            canvas.ink_bounds = info["ink_bounds"]
+            canvas.set_colour(info["colour"])
+            self.epoch = snapshot_epoch
+            upgrade = info["version"] != VERSION
+
+        if not os.path.exists(self.log_path):
+            return 0, upgrade
+        log_epoch, version, records, _ = read_log(self.log_path)
+        if log_epoch is None or (snapshot_epoch is not None and log_epoch != snapshot_epoch):
+            return 0, upgrade
+        self.epoch = log_epoch
+        upgrade = upgrade or version != VERSION
+
+        for op, payload in records:
+            if op == OP_STROKE:
+                if version == 1:
+                    tool, thickness, b, g, r, count = STROKE_V1.unpack_from(payload)
+                    alpha, layer, hand_id, offset = 255, 0, NO_HAND, STROKE_V1.size
+                else:
+                    tool, thickness, b, g, r, alpha, layer, hand_id, count = STROKE.unpack_from(payload)
+                    offset = STROKE.size
+                path = np.frombuffer(payload, dtype="<i4", offset=offset, count=count * 2).reshape(-1, 2)
+                canvas.draw_path(
+                    path, thickness, (b, g, r), alpha, tool == Tools.ERASER.value,
+                    None if hand_id == NO_HAND else hand_id, layer,
+                )
+            elif op == OP_END:
+                hand_id, = HAND.unpack(payload)
+                canvas.end_stroke(hand_id)
+            elif op == OP_CLEAR:
+                canvas.clear()
+            elif op == OP_RESTORE:
+                if version == 1:
+                    layer, (x0, y0, x1, y1), offset = 0, RECT.unpack_from(payload), RECT.size
+                else:
+                    layer, x0, y0, x1, y1 = RESTORE.unpack_from(payload)
+                    offset = RESTORE.size
+                data = np.frombuffer(zlib.decompress(payload[offset:]), dtype=np.uint8)
+                size = (y1 - y0) * (x1 - x0)
+                pixels = data[:size * 3].reshape(y1 - y0, x1 - x0, 3)
+                mask = data[size * 3:].reshape(y1 - y0, x1 - x0)
+                canvas.restore((x0, y0, x1, y1), pixels, mask, layer)
+            elif op == OP_COLOUR:
+                hand_id, colour = PEN_SETTING.unpack(payload)
+                canvas.set_colour(COLOUR_NAMES[colour], None if hand_id == ALL_PENS else hand_id)
+            elif op == OP_TOOL:
+                hand_id, tool = PEN_SETTING.unpack(payload)
+                canvas.set_tool(Tools(tool), hand_id)
+            elif op == OP_LAYER:
+                index, name, opacity, visible = LAYER.unpack(payload)
+                name = name.rstrip(b"\0").decode(errors="replace")
+                while len(canvas.layers) <= index:
+                    canvas.add_layer(name)
+                canvas.layers[index].name = name
+                canvas.set_layer_opacity(opacity / 255, index)
+                canvas.set_layer_visible(visible, index)
+            elif op == OP_ACTIVE:
+                index, = ACTIVE.unpack(payload)
+                canvas.select_layer(index)
+        return len(records), upgrade
+
+    def close(self):
+        # write out everything queued, then fsync
+        self.queue.put(STOP)
+        if self.is_alive():
+            self.join(timeout=SHUTDOWN_TIMEOUT)
+
+    # writer thread side
+
+    def run(self):
+        self._open_log()
+        last_flush = last_fsync = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = ()
+            if item is STOP:
+                break
+            if item:
+                self._write(*item)
+
+            now = time.monotonic()
+            if now - last_flush >= self.flush_interval:
+                self.log.flush()
+                last_flush = now
+            if self.fsync_interval is not None and now - last_fsync >= self.fsync_interval:
+                self._sync()
+                last_fsync = now
+
+        self._sync()
+        self.log.close()
+
+    def _open_log(self):
+        # keep appending to a log that belongs to the current snapshot, cutting
+        # off any torn record at its end. otherwise start a new one
+        if os.path.exists(self.log_path):
+            epoch, version, _, valid = read_log(self.log_path)
+            if epoch == self.epoch and version == VERSION:
+                with open(self.log_path, "r+b") as f:
+                    f.truncate(valid)
+                self.log = open(self.log_path, "ab", buffering=self.buffer_bytes)
+                return
+        self._new_log()
+
+    def _new_log(self):
+        if self.log is not None:
+            self.log.close()
+        self.log = open(self.log_path, "wb", buffering=self.buffer_bytes)
+        self.log.write(LOG_HEADER.pack(LOG_MAGIC, VERSION, self.epoch))
+        self._sync()
+
+    def _sync(self):
+        self.log.flush()
+        os.fsync(self.log.fileno())
+
+    def _write(self, op, args):
+        if op == "snapshot":
+            self._write_snapshot(*args)
+            return
+
+        if op == OP_STROKE:
+            path, tool, colour, thickness, alpha, layer, hand_id = args
+            payload = STROKE.pack(tool, thickness, *colour, alpha, layer, hand_id, len(path)) + path.astype("<i4").tobytes()
+        elif op == OP_CLEAR:
+            payload = b""
+        elif op == OP_RESTORE:
+            rect, pixels, mask, layer = args
+            payload = RESTORE.pack(layer, *rect) + zlib.compress(pixels.tobytes() + mask.tobytes(), 1)
+        elif op == OP_END:
+            payload = HAND.pack(*args)
+        elif op == OP_LAYER:
+            index, name, opacity, visible = args
+            payload = LAYER.pack(index, name.encode()[:16], opacity, visible)
+        elif op == OP_ACTIVE:
+            payload = ACTIVE.pack(*args)
+        else:
+            payload = PEN_SETTING.pack(*args)
+
+        self.log.write(RECORD.pack(op, len(payload), zlib.crc32(payload)))
+        self.log.write(payload)
+        metrics.count("autosave_records")
+
+    def _write_snapshot(self, layers, active, tile_size, colour_name, ink_bounds):
+        # written beside the old one and renamed over it, then the log restarts
+        # under the new epoch
+        start = time.perf_counter()
+        epoch = self.epoch + 1
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC, VERSION, epoch, tile_size, COLOUR_NAMES.index(colour_name),
+                len(layers), active, *(ink_bounds or (0, 0, 0, 0)), ink_bounds is not None,
+            ))
+            saved = {}
+            for index, (name, opacity, visible, tiles) in enumerate(layers):
+                f.write(SNAPSHOT_LAYER.pack(name.encode()[:16], opacity, visible, len(tiles)))
+                for (ty, tx), buffer in tiles.items():
+                    if buffer is None:
+                        data = self.saved_tiles[(index, (ty, tx))]
+                    else:
+                        data = zlib.compress(buffer.tobytes(), 1)
+                    saved[(index, (ty, tx))] = data
+                    f.write(SNAPSHOT_TILE.pack(ty, tx, len(data)))
+                    f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+        self.saved_tiles = saved
+        self.epoch = epoch
+        self._new_log()
+        metrics.observe("autosave_snapshot_write", (time.perf_counter() - start) * 1000)
@@ -0,0 +1,199 @@
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import time
+
+import cv2
+from config import *
+from processor import FrameProcessor
+
+
+PROGRESS_EVERY = 30  # frames between progress messages from a worker
+
+# per-worker state, set up once by init_worker
+worker_tracker = None
+worker_progress = None
+
+
+def init_worker(progress_queue):
+    global worker_tracker, worker_progress
+    # imported here so the parent process never loads mediapipe
+    from hand_tracker import HandTracker
+
+    # one process per core already, so keep OpenCV from spawning its own threads
+    cv2.setNumThreads(1)
+    worker_tracker = HandTracker()
+    worker_progress = progress_queue
+
+
+def output_paths(video_path, output_dir):
+    stem = os.path.splitext(os.path.basename(video_path))[0]
+    return (
+        os.path.join(output_dir, f"{stem}_composite.mp4"),
+        os.path.join(output_dir, f"{stem}_canvas.png"),
+    )
+
+
+def render_video(video_path, output_dir, flip=FLIP_CAMERA, draw_landmarks=False, codec="mp4v"):
+    start_time = time.perf_counter()
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video: {video_path}")
+
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or CAMERA_FPS
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    # write under temporary names, only renamed once complete so an interrupted
+    # job never leaves output that looks finished
+    video_out, canvas_out = output_paths(video_path, output_dir)
+    video_tmp = video_out + ".part.mp4"
+    canvas_tmp = canvas_out + ".part.png"
+    writer = cv2.VideoWriter(video_tmp, cv2.VideoWriter_fourcc(*codec), fps, (width, height))
+
+    worker_tracker.reset()
+    processor = FrameProcessor(width, height)
+    buffer = None
+    frames = 0
+    try:
+        while True:
+            # decode into the same buffer every frame and flip it in place
+            success, frame = cap.read(buffer)
+            if not success:
+                break
+            buffer = frame
+            if flip:
+                cv2.flip(frame, 1, dst=frame)
+
+            frame = worker_tracker.find_hands(frame, draw=draw_landmarks, timestamp=frames / fps)
+            frame, _ = processor.process(frame, worker_tracker.get_tracked_hands(8))
+            writer.write(frame)
+
+            frames += 1
+            if frames % PROGRESS_EVERY == 0:
+                worker_progress.put((video_path, frames, total))
+    finally:
+        cap.release()
+        writer.release()
+
+    cv2.imwrite(canvas_tmp, processor.canvas.render())
+    os.replace(video_tmp, video_out)
+    os.replace(canvas_tmp, canvas_out)
+
+    elapsed = time.perf_counter() - start_time
+    return {
+        "status": "done",
+        "frames": frames,
+        "seconds": elapsed,
+        "video": video_out,
+        "canvas": canvas_out,
+    }
+
+
+def run_job(video_path, output_dir, flip, draw_landmarks, codec):
+    # errors come back as results so one bad file doesn't stop the batch
+    try:
+        return video_path, render_video(video_path, output_dir, flip, draw_landmarks, codec)
+    except Exception as e:
+        return video_path, {"status": "failed", "error": str(e)}
+
+
+class JobState:
+    # completed jobs are recorded in a json file so a rerun skips them
+    def __init__(self, path):
+        self.path = path
+        self.jobs = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.jobs = json.load(f)
+
+    def is_done(self, video_path):
+        return self.jobs.get(os.path.abspath(video_path), {}).get("status") == "done"
+
+    def record(self, video_path, result):
+        self.jobs[os.path.abspath(video_path)] = result
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.jobs, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def render_all(videos, output_dir, workers=None, flip=FLIP_CAMERA, draw_landmarks=False, codec="mp4v", state_path=None):
+    os.makedirs(output_dir, exist_ok=True)
+    state = JobState(state_path or os.path.join(output_dir, "jobs.json"))
+
+    pending = [video for video in videos if not state.is_done(video)]
+    skipped = len(videos) - len(pending)
+    if skipped:
+        print(f"Skipping {skipped} already rendered video(s)")
+    if not pending:
+        return state.jobs
+
+    workers = min(workers or os.cpu_count() or 1, len(pending))
+    print(f"Rendering {len(pending)} video(s) on {workers} worker(s)")
+
+    start_time = time.perf_counter()
+    progress_queue = multiprocessing.Manager().Queue()
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(progress_queue,)) as pool:
+        results = [
+            pool.apply_async(run_job, (video, output_dir, flip, draw_landmarks, codec))
+            for video in pending
+        ]
+
+        recorded = set()
+        total_frames = 0
+        while len(recorded) < len(results):
+            try:
+                video, frames, total = progress_queue.get(timeout=0.5)
+                total_text = f"/{total}" if total > 0 else ""
+                print(f"  {os.path.basename(video)}: {frames}{total_text} frames")
+            except queue.Empty:
+                pass
+
+            for i, result in enumerate(results):
+                if result.ready() and i not in recorded:
+                    recorded.add(i)
+                    completed = len(recorded)
+                    video, outcome = result.get()
+                    state.record(video, outcome)
+                    if outcome["status"] == "done":
+                        total_frames += outcome["frames"]
+                        print(
+                            f"[{completed}/{len(results)}] {video}: {outcome['frames']} frames "
+                            f"in {outcome['seconds']:.1f}s"
+                        )
+                    else:
+                        print(f"[{completed}/{len(results)}] {video} failed: {outcome['error']}")
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Rendered {total_frames} frames in {elapsed:.1f}s ({total_frames / elapsed:.1f} fps overall)")
+    return state.jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render recorded AirCanvas sessions to video and PNG without a GUI")
+    parser.add_argument("videos", nargs="+", help="recorded session videos")
+    parser.add_argument("-o", "--output-dir", default="renders", help="where rendered files are written")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--state", default=None, help="job state file (default: <output-dir>/jobs.json)")
+    parser.add_argument("--no-flip", action="store_true", help="don't mirror frames (e.g. already-flipped recordings)")
+    parser.add_argument("--draw-landmarks", action="store_true", help="draw the tracked hand onto the output video")
+    parser.add_argument("--codec", default="mp4v", help="fourcc of the output video")
+    args = parser.parse_args()
+
+    render_all(
+        args.videos,
+        args.output_dir,
+        workers=args.workers,
+        flip=FLIP_CAMERA and not args.no_flip,
+        draw_landmarks=args.draw_landmarks,
+        codec=args.codec,
+        state_path=args.state,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import queue
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+
+from metrics import metrics
+
+
+@dataclass
+class CommandEvent:
+    text: str
+    source: str = "voice"
+    # when the speech ended and when the recogniser produced text (perf_counter)
+    heard_at: float = field(default_factory=time.perf_counter)
+    recognised_at: float = field(default_factory=time.perf_counter)
+
+
+class CommandBus:
+    # thread-safe hand-off from recognisers to the render loop, which drains it
+    # once per frame without ever blocking
+    def __init__(self):
+        self.events = queue.SimpleQueue()
+        self.recognising = threading.Event()
+
+    def publish(self, event: CommandEvent):
+        self.events.put(event)
+
+    def drain(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+
+class CommandRegistry:
+    # maps spoken phrases to actions. matching is on whole words, longest phrase
+    # first, so "redo" never triggers "red" and "start recording" beats "start"
+    def __init__(self):
+        self.commands = {}
+        self.longest = 1
+        self.last_latency_ms = None
+
+    def register(self, phrases, action, name=None):
+        if isinstance(phrases, str):
+            phrases = [phrases]
+        for phrase in phrases:
+            words = tuple(tokenise(phrase))
+            self.commands[words] = (name or phrase, action)
+            self.longest = max(self.longest, len(words))
+
+    def phrases(self):
+        return [" ".join(words) for words in self.commands]
+
+    def match(self, text):
+        words = tokenise(text)
+        for start in range(len(words)):
+            for length in range(min(self.longest, len(words) - start), 0, -1):
+                command = self.commands.get(tuple(words[start:start + length]))
+                if command is not None:
+                    return command
+        return None
+
+    def dispatch(self, event: CommandEvent):
+        # runs the matching action, returns its name or None if nothing matched
+        command = self.match(event.text)
+        if command is None:
+            return None
+
+        name, action = command
+        action(event)
+
+        acted_at = time.perf_counter()
+        self.last_latency_ms = (acted_at - event.heard_at) * 1000
+        metrics.observe("voice_recognition", (event.recognised_at - event.heard_at) * 1000)
+        metrics.observe("command_dispatch", (acted_at - event.recognised_at) * 1000)
+        metrics.observe("command_latency", self.last_latency_ms)
+        return name
+
+
+def tokenise(text):
+    return re.findall(r"[a-z']+", text.lower())
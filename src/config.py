@@ -5,6 +5,103 @@ CAMERA_FPS = 30
 FLIP_CAMERA = True
 
 # Hand Tracking Settings
-MAX_HANDS = 1
+MAX_HANDS = 1               # raise for shared drawing, every hand gets its own pen
+HAND_MATCH_DISTANCE = 200   # px a palm may move between frames and keep its pen
+HAND_MAX_MISSED = 10        # frames a hand may go undetected before its id is freed
 MIN_DETECTION_CONFIDENCE = 0.7
-MIN_TRACKING_CONFIDENCE = 0.7
\ No newline at end of file
+MIN_TRACKING_CONFIDENCE = 0.7
+LANDMARK_LOG_PATH = None  # set to a file path to record live landmarks for offline replay
+
+# Pipeline Settings
+CAPTURE_QUEUE_SIZE = 1  # frames waiting for inference, oldest dropped when full
+RESULT_QUEUE_SIZE = 1   # inferred frames waiting for render
+STAGE_TIMEOUT = 0.5     # seconds a stage waits on its input before re-checking shutdown
+SHUTDOWN_TIMEOUT = 2.0
+
+# Inference Settings
+INFERENCE_WIDTH = 640       # frames are downscaled to fit inside this box before MediaPipe
+INFERENCE_HEIGHT = 360
+USE_ROI = True              # crop around the previous frame's hand instead of the full frame
+ROI_PADDING = 0.5           # padding added on each side, as a fraction of the hand box size
+ROI_MIN_SIZE = 240          # smallest crop (px) so a hand entering the box isn't cut off
+ROI_REDETECT_INTERVAL = 30  # frames between full-frame passes looking for additional hands
+INFER_EVERY = 1             # run MediaPipe on every Nth frame, landmarks are predicted in between
+INFERENCE_PROCESS = False   # run MediaPipe in a worker process, fed through shared memory
+INFERENCE_TIMEOUT = 1.0     # seconds to wait on the worker before a frame goes without hands
+INFERENCE_START_TIMEOUT = 60.0  # seconds the worker may take to import and load MediaPipe
+
+# Motion Filter Settings (One-Euro filter over all landmarks)
+FILTER_MIN_CUTOFF = 1.0     # Hz, lower means smoother but laggier at slow speeds
+FILTER_BETA = 0.01          # how quickly smoothing backs off as the hand speeds up
+FILTER_D_CUTOFF = 1.0       # Hz, smoothing of the velocity estimate
+PREDICTION_LEAD = 0.015     # seconds the pen position is extrapolated ahead
+PREDICTION_HORIZON = 0.1    # seconds predictions may run past the last detection
+
+# Canvas Settings
+HISTORY_TILE_SIZE = 64  # undo history saves canvas tiles of this size (px)
+HISTORY_BUDGET_MB = 64  # undo/redo memory budget, oldest edits are evicted first
+STROKE_STEP = 4         # spacing of spline samples along a stroke (px)
+CANVAS_TILE_SIZE = 256  # the canvas is stored as sparse tiles of this size (px)
+CANVAS_CACHE_TILES = 256  # tiles kept in memory (256KB each), the rest spill to disk
+CANVAS_SPILL_DIR = None   # directory for the spill file, None for the system temp dir
+BRUSH_ALPHA = 255       # opacity of pen strokes (0-255), "soft brush" and "hard brush" switch it
+SOFT_BRUSH_ALPHA = 96
+MIN_ZOOM = 0.5
+MAX_ZOOM = 4.0
+
+# Streaming Settings
+STREAM_ENABLED = False       # mirror the canvas to viewers (python src/stream.py view)
+STREAM_HOST = "127.0.0.1"    # "0.0.0.0" to accept viewers from the LAN
+STREAM_PORT = 8765
+STREAM_FPS = 15              # most canvas updates sent per second, changes in between are merged
+STREAM_COMPRESSION = 1       # zlib level for tiles, 1 is fastest
+STREAM_WINDOW = 2            # updates sent to a viewer ahead of its acks, a slow one gets merged updates
+STREAM_KEYFRAME_TILES = 16   # tiles copied per update for viewers joining, so big drawings don't stall a frame
+
+# Autosave Settings
+AUTOSAVE_ENABLED = True
+AUTOSAVE_DIR = "autosave"            # snapshot and operation log, restored on startup
+AUTOSAVE_BUFFER_BYTES = 64 * 1024    # write buffer of the operation log
+AUTOSAVE_FLUSH_INTERVAL = 0.5        # seconds between flushes of the log to the OS
+AUTOSAVE_FSYNC_INTERVAL = 5.0        # seconds between fsyncs, None to leave it to the OS
+AUTOSAVE_SNAPSHOT_INTERVAL = 120.0   # seconds between snapshots while drawing
+AUTOSAVE_SNAPSHOT_RECORDS = 5000     # or after this many logged operations
+
+# Session Recording Settings (press 'r' or say "start recording" / "stop recording")
+RECORD_DIR = "recordings"
+RECORD_SOURCE = "composite"   # "composite" records the screen, "canvas" only the drawing
+RECORD_SIZE = (1280, 720)     # output (width, height), None keeps the frame size
+RECORD_CODEC = "mp4v"
+RECORD_FPS = CAMERA_FPS
+RECORD_QUEUE_SIZE = 8         # frames waiting for the encoder, more are dropped rather than waited on
+
+# Metrics Settings
+METRICS_ENABLED = False          # per-stage latency histograms, near zero cost when off
+METRICS_EXPORT_PATH = None       # e.g. "metrics.json", or "metrics.prom" for Prometheus text
+METRICS_EXPORT_INTERVAL = 5.0    # seconds between snapshot exports
+SHOW_HUD = False                 # on-screen FPS/latency readout, needs METRICS_ENABLED
+LOG_LEVEL = "INFO"               # "DEBUG" shows the per-frame gesture debug output
+DEBUG_LOG_INTERVAL = 1.0         # seconds between repeats of the same debug message
+
+# Quality Governor Settings
+GOVERNOR_ENABLED = True
+TARGET_FPS = CAMERA_FPS
+GOVERNOR_SMOOTHING = 0.1         # weight of the newest frame time in the moving average
+GOVERNOR_DEGRADE_RATIO = 1.15    # step quality down above this fraction of the target frame time
+GOVERNOR_RECOVER_RATIO = 0.7     # and back up below this one
+GOVERNOR_DEGRADE_FRAMES = 15     # consecutive frames over budget before stepping down
+GOVERNOR_RECOVER_FRAMES = 90     # consecutive frames under budget before stepping up
+GOVERNOR_COOLDOWN_FRAMES = 60    # frames to let a change settle before judging again
+
+# Benchmark Settings (python src/microbench.py)
+BENCH_ITERATIONS = 200               # timed calls per benchmark
+BENCH_WARMUP = 20                    # untimed calls first, while caches and buffers warm up
+BENCH_BASELINE_PATH = "benchmarks/baseline.json"
+BENCH_REGRESSION_THRESHOLD = 0.15    # allowed slowdown against the baseline, as a fraction
+BENCH_MIN_DELTA_MS = 0.05            # smaller slowdowns are noise and never fail a comparison
+
+# Voice Command Settings
+VOICE_BACKEND = "keywords"       # "keywords" (offline, pocketsphinx) or "google" (online)
+KEYWORD_SENSITIVITY = 0.8        # 0-1, higher spots keywords more eagerly
+VOICE_LISTEN_TIMEOUT = 5         # seconds to wait for speech to start
+VOICE_PHRASE_TIME_LIMIT = 3      # longest phrase recorded, commands are short
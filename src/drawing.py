@@ -1,7 +1,16 @@
+import math
+
 import cv2
 import numpy as np
 from enum import Enum
 from colours import Colours
+from config import (
+    HISTORY_TILE_SIZE, HISTORY_BUDGET_MB, STROKE_STEP,
+    CANVAS_TILE_SIZE, CANVAS_CACHE_TILES, CANVAS_SPILL_DIR, MIN_ZOOM, MAX_ZOOM, BRUSH_ALPHA,
+)
+from history import CanvasHistory
+from layers import LayerStack, over
+from stroke import spline_path, path_chunks
 
 
 class Tools(Enum):
@@ -9,56 +18,467 @@ class Tools(Enum):
     ERASER = 2
 
 
+class Pen:
+    # drawing state for one hand
+    def __init__(self, colour_name=Colours.RED.name, tool=Tools.PEN):
+        self.colour_name = colour_name
+        self.colour = Colours[colour_name]
+        self.tool = tool
+        self.drawing = False
+        # tail of the current stroke's control points, in canvas coordinates. the
+        # segment between the last two hasn't been drawn yet, it waits for the next point
+        self.points = []
+        # (layer, tile key) -> coverage of the current stroke, for every tile it
+        # has touched. only the coverage a path adds is blended onto the tile,
+        # so where a stroke crosses itself it doesn't build up, translucent
+        # strokes look the same however they were split, and ink other hands
+        # put down meanwhile is kept
+        self.stroke = {}
+
+
 class DrawingCanvas:
+    # an unbounded canvas seen through a width x height viewport that can be
+    # panned and zoomed. ink lives in a stack of layers of sparse tiles (see
+    # LayerStack), drawing goes onto the active one. points coming in from the
+    # camera are in screen pixels and mapped onto the canvas here. rects in
+    # ink_bounds and the history are canvas coordinates
     def __init__(self, width, height):
         self.height = height
         self.width = width
-        self.canvas = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        self.layers = LayerStack(CANVAS_TILE_SIZE, CANVAS_CACHE_TILES, CANVAS_SPILL_DIR)
 
-        # Current drawing settings
-        self.current_colour_name = Colours.RED.name
-        self.current_colour = Colours.RED
+        # canvas position of the top-left corner of the screen, and screen
+        # pixels per canvas pixel
+        self.view_x = 0.0
+        self.view_y = 0.0
+        self.zoom = 1.0
+        # scratch for compositing while zoomed, kept between frames
+        self.view_buffers = None
+        # scratch for blending strokes and tiles, one tile each
+        size = CANVAS_TILE_SIZE
+        self.stroke_colour = np.zeros((size, size, 3), dtype=np.uint8)
+        self.previous_coverage = np.zeros((size, size), dtype=np.uint8)
+        self.added_coverage = np.zeros((size, size), dtype=np.uint8)
+        self.inverse = np.zeros((size, size), dtype=np.uint8)
+        self.inverse3 = np.zeros((size, size, 3), dtype=np.uint8)
+
+        # bounding box (x0, y0, x1, y1) of all ink, None while the canvas is blank
+        self.ink_bounds = None
+        # keys of tiles changed since each consumer - the stream, the session
+        # recording, autosave snapshots - last called pop_dirty_tiles(), sets so
+        # they stay bounded by the size of the drawing even if nobody collects them
+        self.dirty_tiles = {"stream": set(), "recording": set(), "autosave": set()}
+
+        # Current drawing settings, one pen per hand id. new pens start with
+        # the default colour, which voice commands also change
         self.thickness = 15
         self.eraser_thickness = 125
-        self.current_tool = Tools.PEN
-        self.drawing = False
-        self.start_point = None
+        # opacity of pen strokes, 0-255
+        self.brush_alpha = BRUSH_ALPHA
+        self.default_colour_name = Colours.RED.name
+        self.pens = {0: Pen(self.default_colour_name)}
+
+        # tiled undo/redo history
+        self.history = CanvasHistory(
+            self, tile_size=HISTORY_TILE_SIZE, budget_bytes=HISTORY_BUDGET_MB * 1024 * 1024
+        )
+        # optional Autosave that every change to the drawing is logged to
+        self.journal = None
+
+    def pen(self, hand_id=0):
+        pen = self.pens.get(hand_id)
+        if pen is None:
+            pen = self.pens[hand_id] = Pen(self.default_colour_name)
+        return pen
+
+    # the primary hand's pen, for callers that only deal with one hand
+    @property
+    def current_colour_name(self):
+        return self.pen(0).colour_name
+
+    @property
+    def current_colour(self):
+        return self.pen(0).colour
+
+    @property
+    def current_tool(self):
+        return self.pen(0).tool
+
+    @property
+    def drawing(self):
+        return self.pen(0).drawing
+
+    def to_canvas(self, points):
+        # screen pixels -> canvas pixels, for an (N, 2) array
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        return points / self.zoom + np.array([self.view_x, self.view_y], dtype=np.float32)
+
+    def view_rect(self):
+        # the canvas rectangle currently on screen
+        x0, y0 = math.floor(self.view_x), math.floor(self.view_y)
+        return (
+            x0,
+            y0,
+            x0 + math.ceil(self.width / self.zoom),
+            y0 + math.ceil(self.height / self.zoom),
+        )
 
-    def draw(self, point):
-        if not self.drawing or self.start_point is None:
+    def pan(self, dx, dy):
+        # move the drawing by (dx, dy) screen pixels
+        self.view_x -= dx / self.zoom
+        self.view_y -= dy / self.zoom
+
+    def zoom_by(self, factor, centre):
+        # zoom about a screen point, which stays over the same bit of drawing
+        zoom = min(max(self.zoom * factor, MIN_ZOOM), MAX_ZOOM)
+        cx, cy = self.to_canvas(centre)[0]
+        self.view_x = cx - centre[0] / zoom
+        self.view_y = cy - centre[1] / zoom
+        self.zoom = zoom
+
+    def reset_view(self):
+        self.view_x = 0.0
+        self.view_y = 0.0
+        self.zoom = 1.0
+
+    def draw(self, point, hand_id=0):
+        self.draw_points([point], hand_id)
+
+    def draw_points(self, points, hand_id=0):
+        # extend a pen's stroke by any number of screen points, e.g. a whole
+        # recorded stroke during replay. everything that's ready is drawn in one go
+        pen = self.pen(hand_id)
+        if not pen.drawing or not pen.points:
             return
 
-        if self.current_tool == Tools.PEN:
-            # Get the actual BGR color to use
-            bgr_colour = self.current_colour.value
-            # print(f"Drawing with colour: {self.current_colour_name}, BGR: {bgr_colour}")
-            cv2.line(self.canvas, self.start_point, point, bgr_colour, self.thickness)
-            self.start_point = point
+        # repeats add nothing to the curve, and would make zero-length segments
+        points = np.rint(self.to_canvas(points)).astype(np.int32)
+        moved = np.any(np.diff(np.vstack([pen.points[-1:], points]), axis=0) != 0, axis=1)
+        points = points[moved]
+        if len(points) == 0:
             return
 
-        if self.current_tool == Tools.ERASER:
-            cv2.line(self.canvas, self.start_point, point, (0, 0, 0), self.eraser_thickness)
-            self.start_point = point
+        first = max(len(pen.points) - 2, 0)
+        control = pen.points + [tuple(point) for point in points.tolist()]
+        # a segment is drawn once the point after it is known, so its end
+        # tangent matches the start of the next one
+        last = len(control) - 2
+        if last > first:
+            self._rasterise(pen, hand_id, control, first, last)
+        pen.points = control[-3:]
 
-    def start_drawing(self, point):
-        self.drawing = True
-        self.start_point = point
-        print(f"Started drawing with: {self.current_colour_name}")
+    def _finish_segment(self, pen, hand_id):
+        # the last segment has no point after it yet, draw it with a mirrored one
+        if pen.drawing and len(pen.points) >= 2:
+            self._rasterise(pen, hand_id, pen.points, len(pen.points) - 2, len(pen.points) - 1)
+            pen.points = pen.points[-1:]
 
-    def stop_drawing(self):
-        self.drawing = False
-        self.start_point = None
+    def _rasterise(self, pen, hand_id, control, first, last):
+        # the spline through the control points, drawn and journaled as one path
+        if pen.tool == Tools.PEN:
+            thickness, colour, alpha = self.thickness, pen.colour.value, self.brush_alpha
+        else:
+            thickness, colour, alpha = self.eraser_thickness, (0, 0, 0), 255
+        erase = pen.tool == Tools.ERASER
+
+        path = spline_path(control, first, last, STROKE_STEP)
+        self.draw_path(path, thickness, colour, alpha, erase, hand_id)
+        if self.journal is not None:
+            self.journal.log_stroke(path, pen.tool, colour, thickness, alpha, self.layers.active, hand_id)
+
+    def draw_path(self, path, thickness, colour, alpha=255, erase=False, hand_id=None, layer=None):
+        # draw an (N, 2) canvas-space polyline into each tile of a layer it
+        # crosses, by default the active one. the path's coverage is drawn
+        # anti-aliased with one call per tile, then blended onto the tile as
+        # colour at alpha, or as an eraser. paths drawn for the same hand belong
+        # to that pen's current stroke
+        if layer is None:
+            layer = self.layers.active
+        tiles = self.layers[layer].tiles
+        stroke = self.pen(hand_id).stroke if hand_id is not None else {}
+
+        chunks = path_chunks(path, thickness)
+        parts_by_tile = {}
+        for rect, part in chunks:
+            self.history.touch(rect, hand_id, layer)
+            for key in tiles.keys_in(rect):
+                parts_by_tile.setdefault(key, []).append(part)
+
+        for key, parts in parts_by_tile.items():
+            # erasing never creates tiles, and drops the ones it empties
+            tile = tiles.get(key, create=not erase)
+            if tile is None:
+                continue
+            coverage = stroke.get((layer, key))
+            if coverage is None:
+                size = tiles.tile_size
+                coverage = stroke[(layer, key)] = np.zeros((size, size), dtype=np.uint8)
+
+            x0, y0, _, _ = tiles.tile_rect(key)
+            parts = [part - (x0, y0) for part in parts]
+            previous = self.previous_coverage
+            previous[:] = coverage
+            cv2.polylines(coverage, parts, False, alpha, thickness, cv2.LINE_AA)
+
+            # the tile already has the stroke over it at the previous coverage.
+            # blending (new - previous) / (1 - previous) more on top comes to
+            # the stroke at the new coverage over the tile as it was before
+            added = self.added_coverage
+            cv2.subtract(coverage, previous, dst=added)
+            cv2.bitwise_not(previous, dst=previous)
+            cv2.divide(added, previous, dst=added, scale=255)
+            if erase:
+                over(None, added, tile.colour, tile.mask, self.inverse, self.inverse3)
+            else:
+                cv2.cvtColor(added, cv2.COLOR_GRAY2BGR, dst=self.stroke_colour)
+                cv2.multiply(self.stroke_colour, colour + (0,), dst=self.stroke_colour, scale=1 / 255)
+                over(self.stroke_colour, added, tile.colour, tile.mask, self.inverse, self.inverse3)
+            tile.dirty = True
+            if erase and not tile.mask.any():
+                tiles.drop(key)
+
+        for rect, _ in chunks:
+            self._mark_dirty(rect, ink=not erase)
+
+    def end_stroke(self, hand_id=0):
+        # later paths from this pen start a new stroke, blended over what's there then
+        pen = self.pens.get(hand_id)
+        if pen is None or not pen.stroke:
+            return
+        pen.stroke = {}
+        if self.journal is not None:
+            self.journal.log_end(hand_id)
+
+    def _end_strokes(self):
+        for hand_id in self.pens:
+            self.end_stroke(hand_id)
 
-    def set_colour(self, colour: str):
-        self.current_colour_name = colour
-        self.current_colour = Colours[colour]
-        print(f"Canvas colour set to: {colour}, BGR: {self.current_colour}")
+    def _mark_dirty(self, rect, ink):
+        if rect is None:
+            return
+
+        keys = self.layers.flat.keys_in(rect)
+        self._touch_tiles(keys)
+        self.layers.stale.update(keys)
+        if not ink:
+            return
+
+        x0, y0, x1, y1 = rect
+        if self.ink_bounds is None:
+            self.ink_bounds = rect
+        else:
+            bx0, by0, bx1, by1 = self.ink_bounds
+            self.ink_bounds = (min(bx0, x0), min(by0, y0), max(bx1, x1), max(by1, y1))
+
+    def read(self, rect, layer=None):
+        # dense (pixels, mask) copy of a rectangle of a layer, by default the active one
+        layer = self.layers.active if layer is None else layer
+        return self.layers[layer].tiles.read(rect)
+
+    def restore(self, rect, pixels, mask, layer=None):
+        # called by the history to write saved contents back
+        layer = self.layers.active if layer is None else layer
+        self.layers[layer].tiles.write(rect, pixels, mask)
+        self._mark_dirty(rect, ink=bool(mask.any()))
+        if self.journal is not None:
+            self.journal.log_restore(rect, pixels, mask, layer)
+
+    def _touch_tiles(self, keys):
+        for dirty in self.dirty_tiles.values():
+            dirty.update(keys)
+
+    def pop_dirty_tiles(self, consumer="stream"):
+        keys = self.dirty_tiles[consumer]
+        self.dirty_tiles[consumer] = set()
+        return keys
+
+    def start_drawing(self, point, hand_id=0):
+        pen = self.pen(hand_id)
+        self.end_stroke(hand_id)
+        pen.drawing = True
+        x, y = np.rint(self.to_canvas(point)[0]).astype(int)
+        pen.points = [(int(x), int(y))]
+        # everything drawn until stop_drawing is one undo step
+        self.history.begin(hand_id)
+        print(f"Started drawing with: {pen.colour_name}")
+
+    def stop_drawing(self, hand_id=0):
+        pen = self.pens.get(hand_id)
+        if pen is None:
+            return
+        self._finish_segment(pen, hand_id)
+        self.end_stroke(hand_id)
+        pen.drawing = False
+        pen.points = []
+        self.history.commit(hand_id)
+
+    def stop_all(self, keep=()):
+        # stop every pen whose hand isn't in keep, e.g. hands that left the frame
+        for hand_id in self.pens:
+            if hand_id not in keep:
+                self.stop_drawing(hand_id)
+
+    def undo(self):
+        self.stop_all()
+        return self.history.undo()
+
+    def redo(self):
+        self.stop_all()
+        return self.history.redo()
+
+    def set_colour(self, colour: str, hand_id=None):
+        # hand_id None changes every pen and the default for new ones
+        if hand_id is None:
+            self.default_colour_name = colour
+            pens = list(self.pens.items())
+        else:
+            pens = [(hand_id, self.pen(hand_id))]
 
-    def set_tool(self, tool: Tools):
-        self.current_tool = tool
+        for pen_id, pen in pens:
+            # the stroke so far keeps its old colour
+            self.end_stroke(pen_id)
+            pen.colour_name = colour
+            pen.colour = Colours[colour]
+        if self.journal is not None:
+            self.journal.log_colour(colour, hand_id)
+        print(f"Canvas colour set to: {colour}, BGR: {Colours[colour]}")
+
+    def set_tool(self, tool: Tools, hand_id=0):
+        pen = self.pen(hand_id)
+        if tool != pen.tool:
+            # what's been drawn so far belongs to the old tool
+            self._finish_segment(pen, hand_id)
+            self.end_stroke(hand_id)
+            if self.journal is not None:
+                self.journal.log_tool(tool, hand_id)
+        pen.tool = tool
+
+    def set_brush_alpha(self, alpha):
+        # every stroke records its own alpha, so there's nothing to journal
+        self.brush_alpha = alpha
+        print(f"Brush opacity set to: {alpha}")
+
+    def add_layer(self, name=None):
+        # a new empty layer on top of the others, which is drawn on from now
+        self._end_strokes()
+        layer = self.layers.add(name)
+        if self.journal is not None:
+            self.journal.log_layer(self.layers.active, layer)
+            self.journal.log_active(self.layers.active)
+        print(f"Added {layer.name}")
+        return self.layers.active
+
+    def select_layer(self, index):
+        self._end_strokes()
+        self.layers.select(index)
+        if self.journal is not None:
+            self.journal.log_active(self.layers.active)
+        print(f"Drawing on {self.layers.current.name}")
+
+    def set_layer_opacity(self, opacity, index=None):
+        index = self.layers.active if index is None else index
+        self._touch_tiles(self.layers.set_opacity(index, opacity))
+        if self.journal is not None:
+            self.journal.log_layer(index, self.layers[index])
+
+    def set_layer_visible(self, visible, index=None):
+        index = self.layers.active if index is None else index
+        self._touch_tiles(self.layers.set_visible(index, visible))
+        if self.journal is not None:
+            self.journal.log_layer(index, self.layers[index])
+
+    def render(self, rect=None):
+        # the flattened drawing as a BGR image, over black. by default the area
+        # the canvas starts out showing, grown to take in any ink drawn outside it
+        if rect is None:
+            rect = (0, 0, self.width, self.height)
+            if self.ink_bounds is not None:
+                x0, y0, x1, y1 = self.ink_bounds
+                rect = (min(x0, 0), min(y0, 0), max(x1, self.width), max(y1, self.height))
+        return self.layers.read(rect)[0]
 
     def get_display(self):
-        return self.canvas.copy()
+        frame = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        return self.composite(frame)
+
+    def composite(self, frame):
+        # blend the flattened layers onto the frame in place, fetching only the
+        # tiles on screen. tiles are only flattened again where a layer changed
+        if self.layers.is_blank():
+            return frame
+
+        rect = self.view_rect()
+        if self.zoom == 1.0:
+            self._composite_tiles(frame, rect)
+            return frame
+
+        # zoomed: gather the visible canvas at full resolution, then scale it
+        # to the screen. the buffers are made once, the canvas ones big enough
+        # for the furthest zoom out, so a pinch-zoom allocates nothing per frame
+        if self.view_buffers is None:
+            largest = (math.ceil(self.height / MIN_ZOOM), math.ceil(self.width / MIN_ZOOM))
+            screen = (self.height, self.width)
+            self.view_buffers = (
+                np.zeros(largest + (3,), dtype=np.uint8),
+                np.zeros(largest, dtype=np.uint8),
+                np.zeros(screen + (3,), dtype=np.uint8),
+                np.zeros(screen, dtype=np.uint8),
+                np.zeros(screen, dtype=np.uint8),
+                np.zeros(screen + (3,), dtype=np.uint8),
+            )
+        pixels, mask, screen_pixels, screen_mask, inverse, inverse3 = self.view_buffers
+        x0, y0, x1, y1 = rect
+        pixels, mask = pixels[:y1 - y0, :x1 - x0], mask[:y1 - y0, :x1 - x0]
+        self.layers.read(rect, pixels, mask)
+
+        # the viewport starts part way into its first canvas pixel, and covers
+        # slightly more than the screen because of the rounding in view_rect().
+        # premultiplied colour and alpha can be interpolated alike
+        fx, fy = self.view_x - x0, self.view_y - y0
+        transform = np.array([[self.zoom, 0, -fx * self.zoom], [0, self.zoom, -fy * self.zoom]], dtype=np.float32)
+        screen = (self.width, self.height)
+        interpolation = cv2.INTER_AREA if self.zoom < 1.0 else cv2.INTER_LINEAR
+        cv2.warpAffine(pixels, transform, screen, dst=screen_pixels, flags=interpolation)
+        cv2.warpAffine(mask, transform, screen, dst=screen_mask, flags=interpolation)
+        over(screen_pixels, screen_mask, frame, None, inverse, inverse3)
+        return frame
+
+    def _composite_tiles(self, frame, rect):
+        # unzoomed, each visible flattened tile is blended straight onto its part of the frame
+        flat = self.layers.flat
+        for key in flat.keys_in(rect):
+            tile = self.layers.tile(key)
+            if tile is None:
+                continue
+            (sx, sy, dx, dy), (w, h) = flat.overlap(key, rect)
+            over(
+                tile.colour[sy:sy + h, sx:sx + w],
+                tile.mask[sy:sy + h, sx:sx + w],
+                frame[dy:dy + h, dx:dx + w],
+                None,
+                self.inverse[:h, :w],
+                self.inverse3[:h, :w],
+            )
 
     def clear(self):
-        self.canvas = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        if self.layers.is_blank():
+            return
+
+        # clearing is its own undo step, strokes in progress carry on as new ones.
+        # only tiles that exist can hold ink, so only those are saved
+        self._end_strokes()
+        self.history.commit()
+        self.history.begin("clear")
+        for index, layer in enumerate(self.layers):
+            for key in layer.tiles.keys():
+                self.history.touch(layer.tiles.tile_rect(key), "clear", index)
+        self.history.commit("clear")
+        for hand_id, pen in self.pens.items():
+            if pen.drawing:
+                self.history.begin(hand_id)
+
+        self._touch_tiles(self.layers.keys())
+        self.layers.clear()
+        self.ink_bounds = None
+        if self.journal is not None:
+            self.journal.log_clear()
@@ -0,0 +1,48 @@
+import threading
+
+import numpy as np
+from metrics import metrics
+
+
+class FramePool:
+    # reusable full-size frame buffers. the camera reads straight into one, and
+    # it comes back here once its frame is dropped by a queue or has been shown,
+    # so after warm-up no frame-sized arrays are allocated. running dry allocates
+    # a fresh buffer rather than stalling capture
+    def __init__(self, size=4):
+        self.size = size
+        self.free = []
+        self.shape = None
+        self.allocated = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, shape=None):
+        # a free buffer of this shape, or None while the frame size isn't known yet
+        if shape is None:
+            return None
+
+        with self.lock:
+            if shape != self.shape:
+                # first frame, or the camera changed resolution
+                self.shape = shape
+                self.free.clear()
+            if self.free:
+                return self.free.pop()
+            self.allocated += 1
+
+        metrics.count("frame_buffers_allocated")
+        return np.empty(shape, dtype=np.uint8)
+
+    def release(self, buffer):
+        if buffer is None:
+            return
+        with self.lock:
+            if buffer.shape != self.shape or len(self.free) >= self.size:
+                return
+            # a buffer handed back twice would end up behind two frames at once
+            if not any(free is buffer for free in self.free):
+                self.free.append(buffer)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.free)
@@ -1,6 +1,9 @@
 from enum import Enum
-import math
+import logging
 import time
+import numpy as np
+from config import DEBUG_LOG_INTERVAL
+from metrics import RateLimitedLog
 
 class GestureType(Enum):
     NONE = "none"
@@ -8,6 +11,20 @@ class GestureType(Enum):
     ERASE = "erase"     # open palm 
     SELECT = "select"   # index pointing
     CLEAR = "clear"     # fist with thumb out 
+    PAN = "pan"         # index + middle up, two hands to zoom
+
+
+# batch classification returns indices into this list
+GESTURE_CODES = [GestureType.NONE, GestureType.DRAW, GestureType.ERASE, GestureType.SELECT, GestureType.PAN]
+NONE_CODE, DRAW_CODE, ERASE_CODE, SELECT_CODE, PAN_CODE = range(len(GESTURE_CODES))
+
+# landmark indices, index finger to pinky
+FINGER_TIPS = [8, 12, 16, 20]
+FINGER_MIDS = [6, 10, 14, 18]
+FINGER_BASES = [5, 9, 13, 17]
+OTHER_TIPS = [12, 16, 20]   # middle, ring, pinky
+PALM_POINTS = [0, 5, 9, 13, 17]
+
 
 class GestureRecogniser:
     def __init__(self):
@@ -17,41 +34,24 @@ class GestureRecogniser:
         self.clear_gesture_start = 0
         self.clear_hold_time = 3.0
         self.is_clear_gesture = False
+        # per-frame debug output, only shown at DEBUG level and rate limited
+        self.debug_log = RateLimitedLog(logging.getLogger(__name__), DEBUG_LOG_INTERVAL)
 
-    def recognise_gesture(self, landmark_list):
-        if not landmark_list:
+    def recognise_gesture(self, landmarks):
+        if landmarks is None or len(landmarks) == 0:
             # reset clear gesture state when no hand detected
             self.is_clear_gesture = False
             self.clear_gesture_start = 0
             return GestureType.NONE
-        
-        landmarks = dict([(id, (x, y)) for id, x, y in landmark_list])
 
-        fingers_extended = self._check_fingers_extended(landmarks)
-
-        # calculate pinch distance
-        pinch_distance = self._calculate_distance(
-            landmarks[4],
-            landmarks[8]
-        )
+        batch = np.asarray(landmarks, dtype=np.float32)[None, :, :2]
+        fingers_extended = self._check_fingers_extended(batch)
+        pinch_distance = self._pinch_distance(batch)
 
         # debug info
-        print(f"Pinch distance: {pinch_distance}")
-        print(f"Fingers extended: {fingers_extended}")
-        
-        # check for draw gesture
-        if pinch_distance < self.pinch_threshold:
-            return GestureType.DRAW
-        
-        # check for erase gesture
-        fingers_extended = self._check_fingers_extended(landmarks)
-        if all(fingers_extended):
-            return GestureType.ERASE
-        
-        # check for select gesture 
-        if self._is_select_gesture(landmarks, fingers_extended):
-            return GestureType.SELECT
-        
+        self.debug_log.debug("pinch", "Pinch distance: %s", pinch_distance[0])
+        self.debug_log.debug("fingers", "Fingers extended: %s", fingers_extended[0])
+
         # # check for clear gesture
         # if fingers_extended[0] and not any(fingers_extended[1:]):
         #     # Start timing if we just entered clear gesture
@@ -66,60 +66,68 @@ class GestureRecogniser:
         #     # Reset clear gesture state if hand position changes
         #     self.is_clear_gesture = False
         #     self.clear_gesture_start = 0
-        
-        return GestureType.NONE
-    
-    def _is_select_gesture(self, landmarks, fingers_extended):
-        index_extended = fingers_extended[1]
 
-        other_fingers_curled = not any([fingers_extended[2], fingers_extended[3], fingers_extended[4]])
+        code = self._classify(batch, fingers_extended, pinch_distance)[0]
+        return GESTURE_CODES[code]
+
+    def classify_batch(self, landmarks):
+        # classify an (N, 21, 2) or (N, 21, 3) array of hands in one pass,
+        # returns an array of indices into GESTURE_CODES
+        batch = np.asarray(landmarks, dtype=np.float32)[:, :, :2]
+        if len(batch) == 0:
+            return np.zeros(0, dtype=np.int8)
+        return self._classify(
+            batch, self._check_fingers_extended(batch), self._pinch_distance(batch)
+        )
+
+    def _classify(self, landmarks, fingers_extended, pinch_distance):
+        # earlier conditions take priority: draw, then erase, then select, then pan
+        return np.select(
+            [
+                pinch_distance < self.pinch_threshold,
+                fingers_extended.all(axis=1),
+                self._is_select_gesture(landmarks, fingers_extended),
+                self._is_pan_gesture(fingers_extended),
+            ],
+            [DRAW_CODE, ERASE_CODE, SELECT_CODE, PAN_CODE],
+            NONE_CODE,
+        ).astype(np.int8)
+
+    def _pinch_distance(self, landmarks):
+        return np.linalg.norm(landmarks[:, 4] - landmarks[:, 8], axis=1)
+
+    def _is_select_gesture(self, landmarks, fingers_extended):
+        index_extended = fingers_extended[:, 1]
+        other_fingers_curled = ~fingers_extended[:, 2:].any(axis=1)
 
-        # Check index finger angle (should be pointing upward)
-        index_tip = landmarks[8]    # Index tip
-        index_pip = landmarks[6]    # Index PIP (middle joint)
-        
-        # Calculate angle between index finger and vertical
-        dx = index_tip[0] - index_pip[0]
-        dy = index_tip[1] - index_pip[1]
-        angle = abs(math.degrees(math.atan2(dx, -dy)))  # Negative dy because y increases downward
+        # Calculate angle between index finger (PIP -> tip) and vertical
+        direction = landmarks[:, 8] - landmarks[:, 6]
+        angle = np.abs(np.degrees(np.arctan2(direction[:, 0], -direction[:, 1])))  # Negative dy because y increases downward
 
         # Check if index is relatively straight and vertical
         is_vertical = angle < 30  # Allow 30 degrees deviation from vertical
 
-        # Check if index is above other fingers
-        index_tip_y = landmarks[8][1]
-        other_tips_y = [landmarks[i][1] for i in [12, 16, 20]]  # Middle, Ring, Pinky tips
-        is_highest = all(index_tip_y < y for y in other_tips_y)
-                         
-        # Combined conditions for SELECT gesture
-        return (index_extended and 
-                other_fingers_curled and 
-                is_vertical and 
-                is_highest)
-
-    def _calculate_distance(self, point1, point2):
-        return math.sqrt((point1[0] - point2[0]) ** 2 + (point1[1] - point2[1]) ** 2)
-    
-    def _check_fingers_extended(self, landmarks):
-        # get palm center 
-        palm_x = sum(landmarks[i][0] for i in [0, 5, 9, 13, 17]) / 5
+        # Check if index tip is above the middle, ring and pinky tips
+        is_highest = (landmarks[:, 8:9, 1] < landmarks[:, OTHER_TIPS, 1]).all(axis=1)
 
-        thumb_extended = landmarks[4][0] < palm_x
+        # Combined conditions for SELECT gesture
+        return index_extended & other_fingers_curled & is_vertical & is_highest
 
-        # Other fingers - compare y positions
-        fingers = []
-        for tip, mid, base in [(8,6,5), (12,10,9), (16,14,13), (20,18,17)]:  # Index to Pinky
-            finger_tip_y = landmarks[tip][1]
-            finger_base_y = landmarks[base][1]
-            finger_mid_y = landmarks[mid][1]
+    def _is_pan_gesture(self, fingers_extended):
+        # index and middle up in a V, ring and pinky curled
+        return fingers_extended[:, 1] & fingers_extended[:, 2] & ~fingers_extended[:, 3:].any(axis=1)
 
-            # A finger is extended if its tip is higher (smaller y) than both its mid and base points
-            finger_extended = finger_tip_y < finger_mid_y < finger_base_y
-            fingers.append(finger_extended)
+    def _check_fingers_extended(self, landmarks):
+        # get palm center
+        palm_x = landmarks[:, PALM_POINTS, 0].mean(axis=1)
 
-        return [thumb_extended] + fingers
-    
+        thumb_extended = landmarks[:, 4, 0] < palm_x
 
+        # Other fingers - a finger is extended if its tip is higher (smaller y)
+        # than its mid point, which is higher than its base
+        tip_y = landmarks[:, FINGER_TIPS, 1]
+        mid_y = landmarks[:, FINGER_MIDS, 1]
+        base_y = landmarks[:, FINGER_BASES, 1]
+        fingers = (tip_y < mid_y) & (mid_y < base_y)
 
-        
-        
\ No newline at end of file
+        return np.concatenate([thumb_extended[:, None], fingers], axis=1)
@@ -0,0 +1,84 @@
+from dataclasses import dataclass
+
+from config import *
+
+
+@dataclass(frozen=True)
+class QualityLevel:
+    inference_width: int
+    inference_height: int
+    infer_every: int        # run MediaPipe on every Nth frame
+    landmark_detail: int    # 2 = joints and connections, 1 = connections only, 0 = none
+    display_scale: float
+
+
+# best quality first, each step gives up a little more work
+QUALITY_LEVELS = [
+    QualityLevel(INFERENCE_WIDTH, INFERENCE_HEIGHT, INFER_EVERY, 2, 1.0),
+    QualityLevel(480, 270, INFER_EVERY, 2, 1.0),
+    QualityLevel(480, 270, max(INFER_EVERY, 2), 1, 1.0),
+    QualityLevel(320, 180, max(INFER_EVERY, 2), 1, 0.75),
+    QualityLevel(320, 180, max(INFER_EVERY, 3), 0, 0.5),
+]
+
+
+class QualityGovernor:
+    # steps quality down when the smoothed frame time runs over the target and back
+    # up when there's plenty of headroom. the gap between the two thresholds, the
+    # number of consecutive frames required and a cooldown keep it from oscillating
+    def __init__(self, target_fps=TARGET_FPS, levels=QUALITY_LEVELS):
+        self.levels = levels
+        self.level = 0
+        self.target_ms = 1000.0 / target_fps
+        self.smoothed_ms = self.target_ms
+        self.over = 0
+        self.under = 0
+        self.cooldown = 0
+
+    @property
+    def current(self):
+        return self.levels[self.level]
+
+    def update(self, frame_ms):
+        # returns True when the level changed and the knobs need applying
+        self.smoothed_ms += GOVERNOR_SMOOTHING * (frame_ms - self.smoothed_ms)
+
+        if self.cooldown > 0:
+            self.cooldown -= 1
+            return False
+
+        if self.smoothed_ms > self.target_ms * GOVERNOR_DEGRADE_RATIO:
+            self.over += 1
+            self.under = 0
+        elif self.smoothed_ms < self.target_ms * GOVERNOR_RECOVER_RATIO:
+            self.under += 1
+            self.over = 0
+        else:
+            self.over = self.under = 0
+
+        if self.over >= GOVERNOR_DEGRADE_FRAMES and self.level < len(self.levels) - 1:
+            return self._set_level(self.level + 1)
+        if self.under >= GOVERNOR_RECOVER_FRAMES and self.level > 0:
+            return self._set_level(self.level - 1)
+        return False
+
+    def _set_level(self, level):
+        self.level = level
+        self.over = self.under = 0
+        self.cooldown = GOVERNOR_COOLDOWN_FRAMES
+        return True
+
+    def apply(self, tracker, inference_stage):
+        level = self.current
+        tracker.inference_width = level.inference_width
+        tracker.inference_height = level.inference_height
+        tracker.landmark_detail = level.landmark_detail
+        inference_stage.infer_every = level.infer_every
+
+    def describe(self):
+        level = self.current
+        return (
+            f"Quality {self.level + 1}/{len(self.levels)}: "
+            f"infer {level.inference_width}x{level.inference_height} every {level.infer_every}, "
+            f"display {int(level.display_scale * 100)}%"
+        )
@@ -0,0 +1,66 @@
+import numpy as np
+
+
+class HandAssigner:
+    # gives each detected hand a stable id across frames. detections are matched to
+    # known hands of the same handedness by palm-centre distance, closest pairs first.
+    # ids are the smallest free integers, so the first hand seen is always 0
+    def __init__(self, max_distance=200, max_missed=10):
+        self.max_distance = max_distance
+        self.max_missed = max_missed
+        self.tracks = {}  # id -> [centre, handedness, frames missed]
+
+    def assign(self, hands, handedness=()):
+        if not hands:
+            self._age(set())
+            return []
+
+        # wrist and middle-finger base give a steady palm centre
+        centres = np.stack([hand[[0, 9], :2].mean(axis=0) for hand in hands])
+        labels = [handedness[i] if i < len(handedness) else None for i in range(len(hands))]
+        track_ids = list(self.tracks)
+
+        ids = [None] * len(hands)
+        if track_ids:
+            track_centres = np.stack([self.tracks[i][0] for i in track_ids])
+            distances = np.linalg.norm(centres[:, None] - track_centres[None], axis=2)
+
+            # a left hand never takes over a right hand's pen and vice versa
+            for t, track_id in enumerate(track_ids):
+                track_label = self.tracks[track_id][1]
+                for d, label in enumerate(labels):
+                    if label is not None and track_label is not None and label != track_label:
+                        distances[d, t] = np.inf
+            distances[distances > self.max_distance] = np.inf
+
+            taken = set()
+            for flat in np.argsort(distances, axis=None):
+                d, t = divmod(int(flat), len(track_ids))
+                if not np.isfinite(distances[d, t]):
+                    break
+                if ids[d] is not None or t in taken:
+                    continue
+                ids[d] = track_ids[t]
+                taken.add(t)
+
+        for d in range(len(hands)):
+            if ids[d] is None:
+                ids[d] = self._free_id(ids)
+            self.tracks[ids[d]] = [centres[d], labels[d], 0]
+
+        self._age(set(ids))
+        return ids
+
+    def _age(self, seen):
+        for track_id in list(self.tracks):
+            if track_id in seen:
+                continue
+            self.tracks[track_id][2] += 1
+            if self.tracks[track_id][2] > self.max_missed:
+                del self.tracks[track_id]
+
+    def _free_id(self, claimed):
+        hand_id = 0
+        while hand_id in self.tracks or hand_id in claimed:
+            hand_id += 1
+        return hand_id
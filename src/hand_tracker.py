@@ -1,117 +1,269 @@
-import mediapipe as mp 
+import time
 import cv2
+import numpy as np
 from config import *
+from metrics import metrics
+from hand_assigner import HandAssigner
+from motion import LandmarkFilter
 
-class HandTracker:
-    def __init__(self):
-        # initialise mediapipe hands
-        self.mp_hands = mp.solutions.hands
-        self.hands = self.mp_hands.Hands(
-            max_num_hands = MAX_HANDS,
+# landmark pairs joined when a hand is drawn, mediapipe's HAND_CONNECTIONS
+HAND_CONNECTIONS = [
+    (0, 1), (0, 5), (0, 17), (1, 2), (2, 3), (3, 4), (5, 6), (5, 9), (6, 7), (7, 8), (9, 10),
+    (9, 13), (10, 11), (11, 12), (13, 14), (13, 17), (14, 15), (15, 16), (17, 18), (18, 19), (19, 20),
+]
+
+
+class MediaPipeHands:
+    # mediapipe hand detection in this process. process() takes an RGB image
+    # and returns (landmarks, handedness, scores): an (N, 21, 3) array
+    # normalised to the image, plus a label and a score per hand. an
+    # InferenceClient does the same in a worker process
+    def __init__(self, max_hands=MAX_HANDS):
+        # imported here so processes that run inference elsewhere never load mediapipe
+        import mediapipe as mp
+
+        self.hands = mp.solutions.hands.Hands(
+            max_num_hands = max_hands,
             min_detection_confidence = MIN_DETECTION_CONFIDENCE,
             min_tracking_confidence = MIN_TRACKING_CONFIDENCE
         )
-        self.mp_draw = mp.solutions.drawing_utils
+        # reused for the downscaled RGB copy handed to mediapipe, grown only
+        # when a crop needs more room
+        self.rgb_buffer = np.empty(0, dtype=np.uint8)
+
+    def frame_buffer(self, shape):
+        # a contiguous view of the reused buffer, mediapipe copies out of it
+        # during process() so it's free again straight after
+        size = shape[0] * shape[1] * shape[2]
+        if self.rgb_buffer.size < size:
+            self.rgb_buffer = np.empty(size, dtype=np.uint8)
+        return self.rgb_buffer[:size].reshape(shape)
+
+    def process(self, rgb_frame):
+        results = self.hands.process(rgb_frame)
+        if not results.multi_hand_landmarks:
+            return np.zeros((0, 21, 3), dtype=np.float32), [], []
+
+        # one (N, 21, 3) array for all hands
+        points = np.array(
+            [
+                [(landmark.x, landmark.y, landmark.z) for landmark in hand.landmark]
+                for hand in results.multi_hand_landmarks
+            ],
+            dtype=np.float32,
+        )
+        handedness = []
+        scores = []
+        for hand in results.multi_handedness or []:
+            classification = hand.classification[0]
+            handedness.append(classification.label)
+            scores.append(classification.score)
+        return points, handedness, scores
+
+    def reset(self):
+        self.hands.reset()
+
+    def close(self):
+        self.hands.close()
+
+
+class HandTracker:
+    def __init__(self, with_depth=False, recorder=None, detector=None):
+        # mediapipe in this process unless another detector, e.g. an
+        # InferenceClient for a worker process, is handed in
+        self.detector = MediaPipeHands() if detector is None else detector
+        self.connections = np.array(HAND_CONNECTIONS, dtype=np.int32)
+
+        # stable per-hand ids, and a motion filter per id that smooths detections
+        # and predicts skipped frames
+        self.assigner = HandAssigner(HAND_MATCH_DISTANCE, HAND_MAX_MISSED)
+        self.hand_ids = []
+        self.filters = {}
+        self.filtered = []
 
-        # track previous postiions for smoothing
-        self.prev_positions = {}
+        # region of the full frame the last inference ran on, as (x, y, w, h)
+        self.inference_region = (0, 0, 0, 0)
+        self.roi = None
+        self.frames_since_full = 0
+
+        # one (21, 2) - or (21, 3) with depth - full-frame pixel array per detected hand
+        self.with_depth = with_depth
+        self.landmarks = []
+        self.handedness = []
+        self.scores = []
+
+        # runtime knobs, adjusted by the quality governor
+        self.inference_width = INFERENCE_WIDTH
+        self.inference_height = INFERENCE_HEIGHT
+        self.landmark_detail = 2
+
+        # optional LandmarkRecorder that every processed frame is appended to
+        self.recorder = recorder
+        self.frame_count = 0
+
+    def reset(self):
+        # forget all tracking state, e.g. before starting on a different video
+        self.detector.reset()
+        self.assigner = HandAssigner(HAND_MATCH_DISTANCE, HAND_MAX_MISSED)
+        self.hand_ids = []
+        self.filters = {}
+        self.filtered = []
+        self.roi = None
+        self.frames_since_full = 0
+        self.landmarks = []
+        self.handedness = []
+        self.scores = []
+        self.frame_count = 0
+
+    def find_hands(self, frame, draw=True, timestamp=None):
+        height, width = frame.shape[:2]
+        timestamp = time.perf_counter() if timestamp is None else timestamp
+
+        # crop around last frame's hand, or fall back to the full frame when tracking is lost
+        if self.roi is not None:
+            x0, y0, x1, y1 = self.roi
+            self.frames_since_full += 1
+        else:
+            x0, y0, x1, y1 = 0, 0, width, height
+            self.frames_since_full = 0
+        crop = frame[y0:y1, x0:x1]
+        self.inference_region = (x0, y0, x1 - x0, y1 - y0)
+
+        # Downscale before converting to RGB so both run on the small image
+        with metrics.timer("colour_conversion"):
+            scale = min(self.inference_width / (x1 - x0), self.inference_height / (y1 - y0), 1.0)
+            if scale < 1.0:
+                size = (max(1, int((x1 - x0) * scale)), max(1, int((y1 - y0) * scale)))
+                rgb_frame = self.detector.frame_buffer((size[1], size[0], 3))
+                cv2.resize(crop, size, dst=rgb_frame, interpolation=cv2.INTER_LINEAR)
+                cv2.cvtColor(rgb_frame, cv2.COLOR_BGR2RGB, dst=rgb_frame)
+            else:
+                rgb_frame = self.detector.frame_buffer(crop.shape)
+                cv2.cvtColor(crop, cv2.COLOR_BGR2RGB, dst=rgb_frame)
 
-    def find_hands(self, frame, draw=True):
-        # Convert BGR to RGB
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    
         # Process the frame
-        self.results = self.hands.process(rgb_frame)
-    
-        if self.results.multi_hand_landmarks:
-            for hand_landmarks in self.results.multi_hand_landmarks:
-                if draw:
-                    landmarks_style = self.mp_draw.DrawingSpec(
-                        color=(255, 255, 255),  # White
-                        thickness=2,
-                        circle_radius=6
-                    )
-                    connections_style = self.mp_draw.DrawingSpec(
-                        color=(255, 255, 255),  # White
-                        thickness=1,
-                        circle_radius=2
-                    )
-
-                    self.mp_draw.draw_landmarks(
-                        frame,
-                        hand_landmarks,
-                        self.mp_hands.HAND_CONNECTIONS,
-                        landmarks_style,
-                        connections_style
-                    )
-                    
+        with metrics.timer("mediapipe"):
+            points, self.handedness, self.scores = self.detector.process(rgb_frame)
+
+        self.landmarks = self._extract_landmarks(points)
+        self.hand_ids = self.assigner.assign(self.landmarks, self.handedness)
+        self._correct_filters(timestamp)
+        self.roi = self._next_roi(width, height) if USE_ROI else None
+
+        if self.recorder is not None:
+            self.recorder.write(self.frame_count, time.time(), self.landmarks, self.handedness, self.scores)
+        self.frame_count += 1
+
+        if draw:
+            self.draw_hands(frame)
+
         return frame
-    
+
+    def skip_frame(self, frame, draw=True, timestamp=None):
+        # no inference this frame, move the last landmarks on with the motion model
+        timestamp = time.perf_counter() if timestamp is None else timestamp
+        self.landmarks = [self.filters[i].predict(timestamp) for i in self.hand_ids]
+        self.filtered = [self._lead(self.filters[i], timestamp) for i in self.hand_ids]
+        if draw:
+            self.draw_hands(frame)
+        return frame
+
+    def _correct_filters(self, timestamp):
+        # a hand that's gone this frame drops its filter
+        for hand_id in list(self.filters):
+            if hand_id not in self.hand_ids:
+                del self.filters[hand_id]
+
+        for hand_id, landmarks in zip(self.hand_ids, self.landmarks):
+            if hand_id not in self.filters:
+                self.filters[hand_id] = LandmarkFilter(
+                    FILTER_MIN_CUTOFF, FILTER_BETA, FILTER_D_CUTOFF, PREDICTION_HORIZON
+                )
+            self.filters[hand_id].correct(landmarks, timestamp)
+        self.filtered = [self._lead(self.filters[i], timestamp) for i in self.hand_ids]
+
+    def _lead(self, landmark_filter, timestamp):
+        # aim slightly ahead of the last sample to hide some of the pipeline latency
+        return landmark_filter.predict(timestamp + PREDICTION_LEAD)
+
+    def draw_hands(self, frame):
+        if self.landmark_detail <= 0:
+            return
+        for landmarks in self.landmarks:
+            self._draw_landmarks(frame, landmarks)
+
+    def _extract_landmarks(self, points):
+        if len(points) == 0:
+            return []
+
+        # map landmarks from the inference crop back to full-frame pixels, all
+        # hands in a single operation
+        x0, y0, width, height = self.inference_region
+        dims = 3 if self.with_depth else 2
+        scale = np.array([width, height, width][:dims], dtype=np.float32)
+        offset = np.array([x0, y0, 0][:dims], dtype=np.float32)
+        return list(points[:, :, :dims] * scale + offset)
+
+    def _next_roi(self, width, height):
+        if not self.landmarks:
+            return None
+
+        # go back to a full-frame pass now and then so extra hands can be picked up
+        if len(self.landmarks) < MAX_HANDS and self.frames_since_full >= ROI_REDETECT_INTERVAL:
+            return None
+
+        points = np.concatenate(self.landmarks)[:, :2]
+        (min_x, min_y), (max_x, max_y) = points.min(axis=0), points.max(axis=0)
+        box_size = max(max_x - min_x, max_y - min_y)
+        half = int(max(box_size / 2 + box_size * ROI_PADDING, ROI_MIN_SIZE / 2))
+        cx, cy = int((max_x + min_x) / 2), int((max_y + min_y) / 2)
+
+        x0, y0 = max(0, cx - half), max(0, cy - half)
+        x1, y1 = min(width, cx + half), min(height, cy + half)
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            return None
+        return (x0, y0, x1, y1)
+
+    def _draw_landmarks(self, frame, landmarks):
+        # landmarks are in full-frame pixels, so draw them directly rather than
+        # through mediapipe's drawing utils which expect coordinates normalised to the frame
+        points = landmarks[:, :2].astype(np.int32)
+        cv2.polylines(frame, list(points[self.connections]), False, (255, 255, 255), 1)  # White
+        if self.landmark_detail < 2:
+            return
+        for point in points:
+            cv2.circle(frame, (int(point[0]), int(point[1])), 6, (255, 255, 255), 2)
+
     def get_hand_position(self, frame, hand_number=0):
-        landmark_list = []
-
-        if self.results.multi_hand_landmarks:
-            if len(self.results.multi_hand_landmarks) > hand_number:
-                hand = self.results.multi_hand_landmarks[hand_number]
-                for id, landmark in enumerate(hand.landmark):
-                    height, width, _ = frame.shape
-                    cx, cy = int(landmark.x * width), int(landmark.y * height)
-                    landmark_list.append((id, cx, cy))
-
-        return landmark_list
-    
+        # landmark array for one hand, None if that hand wasn't detected
+        if hand_number < len(self.landmarks):
+            return self.landmarks[hand_number]
+        return None
+
+    def get_tracked_hands(self, finger_id=8):
+        # (hand id, landmarks, filtered finger position) for every hand this frame
+        return [
+            (hand_id, landmarks, (int(filtered[finger_id, 0]), int(filtered[finger_id, 1])))
+            for hand_id, landmarks, filtered in zip(self.hand_ids, self.landmarks, self.filtered)
+        ]
+
     def get_finger_position(self, frame, finger_id, hand_number=0):
-        positions = self.get_hand_position(frame, hand_number)
-        if not positions:
-            return None
-        
-        finger_pos = None
-        for id, x, y in positions:
-            if id == finger_id:
-                finger_pos = (x, y)
-                break
-
-        if finger_pos is None:
+        # filtered (and slightly predicted) position, None if that hand wasn't detected
+        if hand_number >= len(self.filtered):
             return None
-        
-        # apply smoothing 
-        if finger_id in self.prev_positions:
-            # simple exponential smoothing
-            alpha = 0.5
-            smooth_x = int(alpha * finger_pos[0] + (1 - alpha) * self.prev_positions[finger_id][0])
-            smooth_y = int(alpha * finger_pos[1] + (1 - alpha) * self.prev_positions[finger_id][1])
-            finger_pos = (smooth_x, smooth_y)
-
-        self.prev_positions[finger_id] = finger_pos
-        return finger_pos
-    
+
+        position = self.filtered[hand_number][finger_id]
+        return (int(position[0]), int(position[1]))
+
     def get_finger_up_status(self, frame, hand_number=0):
-        positions = self.get_hand_position(frame, hand_number)
-        if not positions:
+        landmarks = self.get_hand_position(frame, hand_number)
+        if landmarks is None:
             return [False] * 5 # Return all fingers down if no hand detected
-        
-        landmarks = dict([(id, (x, y)) for id, x, y in positions])
-
-        # Finger MCP (base) joints
-        finger_bases = [5, 9, 13, 17]  # Index, Middle, Ring, Pinky
-        # Finger PIP joints
-        finger_pips = [6, 10, 14, 18]  # Index, Middle, Ring, Pinky
-        # Finger tip positions
-        finger_tips = [8, 12, 16, 20]  # Index, Middle, Ring, Pinky
-        
-        fingers_up = []
-        
-        # Thumb (special case)
-        if landmarks[4][0] > landmarks[3][0]:  # For right hand
-            fingers_up.append(True)
-        else:
-            fingers_up.append(False)
-            
-        # Other fingers
-        for tip, pip in zip(finger_tips, finger_pips):
-            if landmarks[tip][1] < landmarks[pip][1]:  # Check if tip is above PIP
-                fingers_up.append(True)
-            else:
-                fingers_up.append(False)
-                
-        return fingers_up
\ No newline at end of file
+
+        # Thumb (special case) - for right hand
+        thumb_up = landmarks[4, 0] > landmarks[3, 0]
+
+        # Other fingers - tip above PIP joint, index to pinky
+        fingers_up = landmarks[[8, 12, 16, 20], 1] < landmarks[[6, 10, 14, 18], 1]
+
+        return [bool(thumb_up)] + fingers_up.tolist()
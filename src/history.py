@@ -0,0 +1,86 @@
+from collections import deque
+
+
+class CanvasHistory:
+    # undo/redo over fixed-size tiles of the canvas. an edit stores copies of only
+    # the tiles it touched, taken the first time each is written (copy-on-write),
+    # and the whole history is kept inside a byte budget, oldest edits evicted first
+    def __init__(self, canvas, tile_size=64, budget_bytes=64 * 1024 * 1024):
+        self.canvas = canvas
+        self.tile_size = tile_size
+        self.budget_bytes = budget_bytes
+
+        self.undo_stack = deque()
+        self.redo_stack = deque()
+        # edits in progress, one per pen so simultaneous strokes undo separately
+        self.pending = {}
+        self.bytes_used = 0
+
+    def begin(self, key=0):
+        self.pending.setdefault(key, {})
+
+    def touch(self, rect, key=0, layer=0):
+        # save the pre-edit contents of every tile of a layer under rect not already saved
+        edit = self.pending.get(key)
+        if edit is None or rect is None:
+            return
+
+        x0, y0, x1, y1 = rect
+        size = self.tile_size
+        for ty in range(y0 // size, (y1 - 1) // size + 1):
+            for tx in range(x0 // size, (x1 - 1) // size + 1):
+                if (layer, ty, tx) not in edit:
+                    edit[(layer, ty, tx)] = self._copy_tile(layer, ty, tx)
+
+    def commit(self, key=None):
+        # commit one pen's edit, or every pending edit when key is None
+        keys = list(self.pending) if key is None else [key]
+        for key in keys:
+            edit = self.pending.pop(key, None)
+            if not edit:
+                continue
+
+            self.undo_stack.append(edit)
+            self.bytes_used += self._edit_bytes(edit)
+
+            # a new edit invalidates anything that was undone
+            while self.redo_stack:
+                self.bytes_used -= self._edit_bytes(self.redo_stack.pop())
+        self._evict()
+
+    def undo(self):
+        self.commit()
+        if not self.undo_stack:
+            return False
+        self.redo_stack.append(self._swap(self.undo_stack.pop()))
+        return True
+
+    def redo(self):
+        self.commit()
+        if not self.redo_stack:
+            return False
+        self.undo_stack.append(self._swap(self.redo_stack.pop()))
+        return True
+
+    def _swap(self, edit):
+        # put the saved tiles back, returning the current ones so the edit can be reversed
+        reverse = {}
+        for (layer, ty, tx), (pixels, mask) in edit.items():
+            reverse[(layer, ty, tx)] = self._copy_tile(layer, ty, tx)
+            self.canvas.restore(self._tile_rect(ty, tx), pixels, mask, layer)
+        return reverse
+
+    def _evict(self):
+        while self.bytes_used > self.budget_bytes and self.undo_stack:
+            self.bytes_used -= self._edit_bytes(self.undo_stack.popleft())
+
+    def _tile_rect(self, ty, tx):
+        # the canvas is unbounded, so tiles are never clipped and may be at negative positions
+        size = self.tile_size
+        return (tx * size, ty * size, (tx + 1) * size, (ty + 1) * size)
+
+    def _copy_tile(self, layer, ty, tx):
+        return self.canvas.read(self._tile_rect(ty, tx), layer)
+
+    def _edit_bytes(self, edit):
+        return sum(pixels.nbytes + mask.nbytes for pixels, mask in edit.values())
@@ -0,0 +1,224 @@
+import multiprocessing
+import signal
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+import numpy as np
+from config import *
+from landmark_log import HANDEDNESS_CODES, HANDEDNESS_NAMES, NO_HAND, record_dtype
+from metrics import metrics
+
+
+# frames and landmarks only ever pass through shared memory, the pipe of each
+# stream carries these small fixed-size messages
+REQUEST = struct.Struct("<BBIHH")  # kind, ring slot, sequence number, height, width
+REPLY = struct.Struct("<IB")  # sequence number (0 once the worker is ready), hands found
+FRAME, RESET, STOP = range(3)
+# frame slots per stream, used in turn. a frame is written into the next slot
+# while a worker that timed out may still be reading the previous one
+RING_SLOTS = 2
+# workers are spawned, never forked: the camera, render and inference threads
+# are all running by then, and a forked child can inherit one of their locks held
+CONTEXT = multiprocessing.get_context("spawn")
+
+
+def serve(frame_name, result_name, frame_bytes, max_hands, conns, detector_factory=None):
+    # worker process: conns maps stream -> pipe end. every stream gets its own
+    # detector, since mediapipe tracks hands from one frame of a stream to the next
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent stops workers on Ctrl+C
+    if detector_factory is None:
+        from hand_tracker import MediaPipeHands
+        detector_factory = MediaPipeHands
+
+    frame_memory = shared_memory.SharedMemory(name=frame_name)
+    result_memory = shared_memory.SharedMemory(name=result_name)
+    detectors = {stream: detector_factory(max_hands) for stream in conns}
+    try:
+        _serve_streams(frame_memory, result_memory, frame_bytes, max_hands, conns, detectors)
+    finally:
+        for detector in detectors.values():
+            detector.close()
+        frame_memory.close()
+        result_memory.close()
+
+
+def _serve_streams(frame_memory, result_memory, frame_bytes, max_hands, conns, detectors):
+    slots = (max(conns) + 1) * RING_SLOTS
+    results = np.ndarray(slots, dtype=record_dtype(max_hands, 3), buffer=result_memory.buf)
+    streams = {conn: stream for stream, conn in conns.items()}
+    for conn in streams:
+        conn.send_bytes(REPLY.pack(0, 0))
+
+    while streams:
+        for conn in wait(list(streams)):
+            try:
+                kind, slot, seq, height, width = REQUEST.unpack(conn.recv_bytes())
+            except (EOFError, OSError):
+                del streams[conn]
+                continue
+
+            stream = streams[conn]
+            if kind == STOP:
+                return
+            if kind == RESET:
+                detectors[stream].reset()
+                continue
+
+            index = stream * RING_SLOTS + slot
+            frame = np.ndarray((height, width, 3), dtype=np.uint8, buffer=frame_memory.buf, offset=index * frame_bytes)
+            points, handedness, scores = detectors[stream].process(frame)
+            count = min(len(points), max_hands)
+            record = results[index]
+            record["hand_count"] = count
+            record["landmarks"][:count] = points[:count]
+            record["handedness"][:count] = [HANDEDNESS_CODES.get(label, NO_HAND) for label in handedness[:count]]
+            record["score"][:count] = scores[:count]
+            conn.send_bytes(REPLY.pack(seq, count))
+
+
+class InferencePool:
+    # hand detection in worker processes, so mediapipe never holds this
+    # process's GIL while it runs. each stream - a camera or a video - is
+    # served by one worker, streams are spread over the workers. frames are
+    # written straight into a ring of shared memory slots per stream and
+    # landmarks come back in fixed-layout records beside them, so no pixel data
+    # is pickled or copied. a worker that dies is started again
+    def __init__(self, streams=1, workers=1, max_hands=MAX_HANDS,
+                 frame_bytes=INFERENCE_WIDTH * INFERENCE_HEIGHT * 3, detector_factory=None):
+        self.streams = streams
+        self.workers = max(1, min(workers, streams))
+        self.max_hands = max_hands
+        self.frame_bytes = frame_bytes
+        self.detector_factory = detector_factory
+
+        slots = streams * RING_SLOTS
+        self.result_dtype = record_dtype(max_hands, 3)
+        self.frame_memory = shared_memory.SharedMemory(create=True, size=slots * frame_bytes)
+        self.result_memory = shared_memory.SharedMemory(create=True, size=slots * self.result_dtype.itemsize)
+        self.results = np.ndarray(slots, dtype=self.result_dtype, buffer=self.result_memory.buf)
+
+        # (this end, worker end) per stream, the worker end is handed to every
+        # process that serves the stream, restarts included
+        self.pipes = [CONTEXT.Pipe() for _ in range(streams)]
+        self.lock = threading.Lock()
+        self.processes = [None] * self.workers
+        self.restarts = 0
+        for worker in range(self.workers):
+            self._start_worker(worker)
+
+    def _start_worker(self, worker):
+        conns = {stream: self.pipes[stream][1] for stream in range(worker, self.streams, self.workers)}
+        process = CONTEXT.Process(
+            target=serve,
+            args=(self.frame_memory.name, self.result_memory.name, self.frame_bytes, self.max_hands,
+                  conns, self.detector_factory),
+            name=f"inference-{worker}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[worker] = process
+
+    def wait_ready(self, timeout=None):
+        # block until every worker has loaded its detectors and said so
+        for stream, (conn, _) in enumerate(self.pipes):
+            if not conn.poll(timeout):
+                raise TimeoutError(f"inference worker for stream {stream} didn't start")
+            conn.recv_bytes()
+
+    def client(self, stream=0):
+        return InferenceClient(self, stream)
+
+    def restart_if_dead(self, stream):
+        # called for a request that went unanswered, True if its worker had died
+        worker = stream % self.workers
+        with self.lock:
+            process = self.processes[worker]
+            if process.is_alive():
+                return False
+            process.join()
+            print(f"Inference worker {worker} exited ({process.exitcode}), restarting it")
+            metrics.count("inference_worker_restarts")
+            self.restarts += 1
+            process.close()
+            self._start_worker(worker)
+            return True
+
+    def close(self):
+        for conn, _ in self.pipes:
+            try:
+                conn.send_bytes(REQUEST.pack(STOP, 0, 0, 0, 0))
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(timeout=SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+
+        self.results = None
+        for memory in (self.frame_memory, self.result_memory):
+            try:
+                memory.close()
+            except BufferError:
+                # a client still holds a view, the mapping goes when it does
+                pass
+            memory.unlink()
+
+
+class InferenceClient:
+    # one stream's use of an InferencePool. it stands in for MediaPipeHands in
+    # a HandTracker: frame_buffer() hands out the next shared memory slot, which
+    # the tracker scales and converts the frame into, and process() waits for
+    # the worker's landmarks without holding the GIL
+    def __init__(self, pool, stream, timeout=INFERENCE_TIMEOUT):
+        self.pool = pool
+        self.stream = stream
+        self.timeout = timeout
+        self.conn = pool.pipes[stream][0]
+        self.slots = [
+            np.ndarray(pool.frame_bytes, dtype=np.uint8, buffer=pool.frame_memory.buf,
+                       offset=(stream * RING_SLOTS + slot) * pool.frame_bytes)
+            for slot in range(RING_SLOTS)
+        ]
+        self.slot = 0
+        self.seq = 0
+
+    def frame_buffer(self, shape):
+        size = shape[0] * shape[1] * shape[2]
+        if size > self.pool.frame_bytes:
+            raise ValueError(f"a {shape} frame doesn't fit the {self.pool.frame_bytes} byte inference slots")
+        return self.slots[self.slot][:size].reshape(shape)
+
+    def process(self, rgb_frame):
+        # rgb_frame is the view frame_buffer() returned, already in shared memory
+        slot = self.slot
+        self.slot = (slot + 1) % RING_SLOTS
+        self.seq = self.seq % 0xFFFFFFFF + 1
+        height, width = rgb_frame.shape[:2]
+        self.conn.send_bytes(REQUEST.pack(FRAME, slot, self.seq, height, width))
+
+        # replies to earlier requests that timed out may still be queued
+        deadline = time.perf_counter() + self.timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or not self.conn.poll(remaining):
+                # this frame goes without hands, and a dead worker is replaced
+                metrics.count("inference_timeouts")
+                self.pool.restart_if_dead(self.stream)
+                return np.zeros((0, 21, 3), dtype=np.float32), [], []
+            seq, count = REPLY.unpack(self.conn.recv_bytes())
+            if seq == self.seq:
+                break
+
+        record = self.pool.results[self.stream * RING_SLOTS + slot]
+        points = record["landmarks"][:count].copy()
+        handedness = [HANDEDNESS_NAMES.get(code, "Right") for code in record["handedness"][:count]]
+        return points, handedness, record["score"][:count].tolist()
+
+    def reset(self):
+        self.conn.send_bytes(REQUEST.pack(RESET, 0, 0, 0, 0))
+
+    def close(self):
+        self.slots = []
@@ -0,0 +1,120 @@
+import os
+import struct
+
+import numpy as np
+
+
+# file layout: one fixed-size header followed by fixed-size records, so a
+# reader can memory-map the whole file and index frames directly
+MAGIC = b"ACLM"
+VERSION = 1
+HEADER = struct.Struct("<4sHBBII16x")  # magic, version, max hands, dims, width, height
+HEADER_SIZE = HEADER.size
+NUM_LANDMARKS = 21
+
+HANDEDNESS_CODES = {"Left": 0, "Right": 1}
+HANDEDNESS_NAMES = {code: name for name, code in HANDEDNESS_CODES.items()}
+NO_HAND = 255
+
+
+def record_dtype(max_hands, dims):
+    return np.dtype([
+        ("timestamp", "<f8"),
+        ("frame_id", "<u4"),
+        ("hand_count", "u1"),
+        ("handedness", "u1", (max_hands,)),
+        ("score", "<f4", (max_hands,)),
+        ("landmarks", "<f4", (max_hands, NUM_LANDMARKS, dims)),
+    ])
+
+
+class LandmarkRecorder:
+    # append-only writer, reopening an existing log with the same layout keeps appending
+    def __init__(self, path, width, height, max_hands=2, dims=2):
+        self.path = path
+        self.max_hands = max_hands
+        self.dims = dims
+        self.dtype = record_dtype(max_hands, dims)
+        self.record = np.zeros(1, dtype=self.dtype)
+
+        header = HEADER.pack(MAGIC, VERSION, max_hands, dims, width, height)
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE:
+            with open(path, "rb") as f:
+                if f.read(HEADER_SIZE) != header:
+                    raise ValueError(f"{path} was recorded with a different layout")
+            # drop a partial record left behind by a crash
+            body = os.path.getsize(path) - HEADER_SIZE
+            with open(path, "r+b") as f:
+                f.truncate(HEADER_SIZE + body - body % self.dtype.itemsize)
+            self.file = open(path, "ab")
+        else:
+            self.file = open(path, "wb")
+            self.file.write(header)
+
+    def write(self, frame_id, timestamp, hands, handedness=(), scores=()):
+        record = self.record[0]
+        count = min(len(hands), self.max_hands)
+        record["timestamp"] = timestamp
+        record["frame_id"] = frame_id
+        record["hand_count"] = count
+        record["handedness"] = NO_HAND
+        record["score"] = 0
+        record["landmarks"] = 0
+
+        for i in range(count):
+            record["landmarks"][i] = hands[i][:, :self.dims]
+            if i < len(handedness):
+                record["handedness"][i] = HANDEDNESS_CODES.get(handedness[i], NO_HAND)
+            if i < len(scores):
+                record["score"][i] = scores[i]
+
+        self.file.write(self.record.tobytes())
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class LandmarkLog:
+    # memory-mapped reader, nothing is loaded until a frame is touched
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            magic, version, max_hands, dims, width, height = HEADER.unpack(f.read(HEADER_SIZE))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a landmark log")
+
+        self.path = path
+        self.max_hands = max_hands
+        self.dims = dims
+        self.width = width
+        self.height = height
+        self.dtype = record_dtype(max_hands, dims)
+
+        # a trailing partial record (e.g. after a crash) is ignored
+        count = (os.path.getsize(path) - HEADER_SIZE) // self.dtype.itemsize
+        if count:
+            self.records = np.memmap(path, dtype=self.dtype, mode="r", offset=HEADER_SIZE, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    def hands(self, index):
+        record = self.records[index]
+        return [record["landmarks"][i] for i in range(record["hand_count"])]
+
+    def handedness(self, index):
+        record = self.records[index]
+        return [HANDEDNESS_NAMES.get(int(code)) for code in record["handedness"][:record["hand_count"]]]
+
+    def batch(self, hand_number=0):
+        # (N, 21, dims) landmarks for one hand slot plus a mask of frames it was present in
+        present = self.records["hand_count"] > hand_number
+        return self.records["landmarks"][:, hand_number], present
+
+    @property
+    def timestamps(self):
+        return self.records["timestamp"]
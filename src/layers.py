@@ -0,0 +1,167 @@
+import cv2
+import numpy as np
+from tiles import TileStore
+
+
+def over(colour, alpha, dst_colour, dst_alpha, inverse, inverse3):
+    # Porter-Duff "over" for premultiplied colour, in place:
+    # dst = src + dst * (1 - src alpha). colour None erases by alpha instead,
+    # dst_alpha may be None for an opaque destination such as a camera frame.
+    # inverse and inverse3 are scratch the size of dst, 1 and 3 channels
+    cv2.bitwise_not(alpha, dst=inverse)
+    cv2.cvtColor(inverse, cv2.COLOR_GRAY2BGR, dst=inverse3)
+    cv2.multiply(dst_colour, inverse3, dst=dst_colour, scale=1 / 255)
+    if dst_alpha is not None:
+        cv2.multiply(dst_alpha, inverse, dst=dst_alpha, scale=1 / 255)
+    if colour is None:
+        return
+    cv2.add(dst_colour, colour, dst=dst_colour)
+    if dst_alpha is not None:
+        cv2.add(dst_alpha, alpha, dst=dst_alpha)
+
+
+class Layer:
+    # one sheet of the drawing. its tiles hold premultiplied BGRA, the colour
+    # already scaled by the alpha kept in the tile mask, so layers stack with a
+    # multiply and an add and blank tiles are all zeros
+    def __init__(self, name, tile_size, cache_tiles, spill_dir):
+        self.name = name
+        self.tiles = TileStore(tile_size, cache_tiles, spill_dir)
+        self.opacity = 1.0
+        self.visible = True
+
+
+class LayerStack:
+    # the layers of a canvas, bottom first, and a cache of them flattened into a
+    # single premultiplied image, kept in a TileStore of its own. only tiles
+    # marked stale are flattened again, and only when something looks at them,
+    # so layers nobody is drawing on add nothing to the cost of a frame
+    def __init__(self, tile_size=256, cache_tiles=256, spill_dir=None):
+        self.tile_size = tile_size
+        self.cache_tiles = cache_tiles
+        self.spill_dir = spill_dir
+
+        self.layers = []
+        self.active = 0
+        self.flat = TileStore(tile_size, cache_tiles, spill_dir)
+        self.stale = set()
+
+        # scratch for blending one tile
+        self.scaled = (
+            np.zeros((tile_size, tile_size, 3), dtype=np.uint8),
+            np.zeros((tile_size, tile_size), dtype=np.uint8),
+        )
+        self.inverse = np.zeros((tile_size, tile_size), dtype=np.uint8)
+        self.inverse3 = np.zeros((tile_size, tile_size, 3), dtype=np.uint8)
+
+        self.add()
+
+    def __len__(self):
+        return len(self.layers)
+
+    def __getitem__(self, index):
+        return self.layers[index]
+
+    def __iter__(self):
+        return iter(self.layers)
+
+    @property
+    def current(self):
+        return self.layers[self.active]
+
+    def add(self, name=None):
+        # a new empty layer on top, which becomes the one drawn on
+        layer = Layer(name or f"Layer {len(self.layers) + 1}", self.tile_size, self.cache_tiles, self.spill_dir)
+        self.layers.append(layer)
+        self.active = len(self.layers) - 1
+        return layer
+
+    def select(self, index):
+        self.active = min(max(index, 0), len(self.layers) - 1)
+
+    def set_opacity(self, index, opacity):
+        # returns the tiles whose flattened look changed. opacity is kept in
+        # steps of 1/255 so a saved and restored layer looks exactly the same
+        layer = self.layers[index]
+        opacity = round(min(max(opacity, 0.0), 1.0) * 255) / 255
+        if opacity == layer.opacity:
+            return set()
+        layer.opacity = opacity
+        return self._invalidate(layer)
+
+    def set_visible(self, index, visible):
+        layer = self.layers[index]
+        if visible == layer.visible:
+            return set()
+        layer.visible = visible
+        return self._invalidate(layer)
+
+    def _invalidate(self, layer):
+        keys = set(layer.tiles.keys())
+        self.stale.update(keys)
+        return keys
+
+    def keys(self):
+        # every tile position with ink on any layer
+        keys = set()
+        for layer in self.layers:
+            keys.update(layer.tiles.keys())
+        return keys
+
+    def is_blank(self):
+        return not any(len(layer.tiles) for layer in self.layers)
+
+    def clear(self):
+        for layer in self.layers:
+            layer.tiles.clear()
+        self.flat.clear()
+        self.stale.clear()
+
+    def tile(self, key):
+        # the flattened tile at key, None where nothing visible is drawn
+        if key in self.stale:
+            self._flatten(key)
+        return self.flat.get(key)
+
+    def export(self):
+        # copies of every flattened tile, for viewers joining a stream
+        for key in list(self.stale):
+            self._flatten(key)
+        return self.flat.export()
+
+    def read(self, rect, pixels=None, mask=None):
+        # dense premultiplied (colour, alpha) copy of the flattened canvas
+        for key in self.flat.keys_in(rect):
+            if key in self.stale:
+                self._flatten(key)
+        return self.flat.read(rect, pixels, mask)
+
+    def _flatten(self, key):
+        self.stale.discard(key)
+        sources = [
+            layer for layer in self.layers
+            if layer.visible and layer.opacity > 0 and key in layer.tiles
+        ]
+        if not sources:
+            self.flat.drop(key)
+            return
+
+        flat = self.flat.get(key, create=True)
+        flat.dirty = True
+        for i, layer in enumerate(sources):
+            tile = layer.tiles.get(key)
+            colour, alpha = tile.colour, tile.mask
+            if layer.opacity < 1.0:
+                colour, alpha = self.scaled
+                cv2.convertScaleAbs(tile.colour, dst=colour, alpha=layer.opacity)
+                cv2.convertScaleAbs(tile.mask, dst=alpha, alpha=layer.opacity)
+            if i == 0:
+                flat.colour[:] = colour
+                flat.mask[:] = alpha
+            else:
+                over(colour, alpha, flat.colour, flat.mask, self.inverse, self.inverse3)
+
+    def close(self):
+        for layer in self.layers:
+            layer.tiles.close()
+        self.flat.close()
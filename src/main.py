@@ -1,22 +1,28 @@
+import time
+
+PROCESS_START = time.perf_counter()
+
+import importlib
 import cv2
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from config import *
-from hand_tracker import HandTracker
-from gesture import GestureRecogniser, GestureType
-from drawing import DrawingCanvas, Tools
-from ui import UIManager
-import time
+from landmark_log import LandmarkRecorder
+from autosave import Autosave
+from metrics import metrics, MetricsExporter, HudStats
+from governor import QualityGovernor
+from pipeline import Pipeline
+from processor import FrameProcessor
 from colours import Colours
-import threading
-import speech_recognition as sr
+import logging
+from commands import CommandBus, CommandRegistry
+from startup import StartupTimings
+from stream import StreamServer
+from session_recorder import SessionRecorder
 
 
-last_recognized_word = None
-working_recognizer = False
-
-
-def initialise_camera():
-    cap = cv2.VideoCapture(0)
+def initialise_camera(source=0):
+    cap = cv2.VideoCapture(source)
     cap.set(cv2.CAP_PROP_FRAME_WIDTH, CAMERA_WIDTH)
     cap.set(cv2.CAP_PROP_FRAME_HEIGHT, CAMERA_HEIGHT)
     cap.set(cv2.CAP_PROP_FPS, CAMERA_FPS)
@@ -30,194 +36,244 @@ def initialise_camera():
     return cap, actual_width, actual_height
 
 
-def audio_recognition():
-    global last_recognized_word, working_recognizer
-
-    recognizer = sr.Recognizer()
-
-    microphone = sr.Microphone()
-
-    if not isinstance(recognizer, sr.Recognizer):
-        raise TypeError("`recognizer` must be `Recognizer` instance")
-
-    if not isinstance(microphone, sr.Microphone):
-        raise TypeError("`microphone` must be `Microphone` instance")
-
-    with microphone as source:
-        print(f"Energy threshold: {recognizer.energy_threshold}")
-        recognizer.adjust_for_ambient_noise(source)
-
-        while True:
+def load_tracker(startup):
+    # mediapipe is the slowest import by far, so it loads off the main thread
+    if INFERENCE_PROCESS:
+        with startup.phase("inference worker"):
+            from inference_pool import InferencePool
+            pool = InferencePool()
             try:
-                print("Waiting audio command ...")
-                audio = recognizer.listen(source, timeout=5, phrase_time_limit=5)
-
-                working_recognizer = True
-                time.sleep(0.5)
-                text = recognizer.recognize_google(audio, language="en-US")
-
-                print(f"You said: {text}")
-                last_recognized_word = text.lower()
-            except sr.UnknownValueError:
-                print("It was not possible to understand what you said.")
-            except sr.RequestError as e:
-                print(f"Error recognizing what was said: {e}")
-            except sr.WaitTimeoutError:
-                pass  # Timeout without audio
-            finally:
-                working_recognizer = False
+                pool.wait_ready(INFERENCE_START_TIMEOUT)
+            except BaseException:
+                pool.close()
+                raise
+        from hand_tracker import HandTracker
+        return HandTracker(detector=pool.client())
+    # the tracker's detector imports mediapipe as it's made, so one phase
+    # covers the import and loading the model
+    with startup.phase("mediapipe hand tracker"):
+        from hand_tracker import HandTracker
+        return HandTracker()
+
+
+def import_voice(startup):
+    with startup.phase("import speech"):
+        return importlib.import_module("voice")
+
+
+def start_voice(startup, voice_future, bus, registry):
+    voice = voice_future.result()
+    listener = voice.VoiceListener(bus, voice.create_backend(VOICE_BACKEND, registry.phrases()), startup=startup)
+    listener.start()
+    return listener
+
+
+def startup_finished(tracker_future, voice_future):
+    # once hands are tracked and the microphone is listening, or either has failed to
+    if not tracker_future.done() or not voice_future.done():
+        return False
+    return voice_future.exception() is not None or voice_future.result().settled.is_set()
+
+
+def register_commands(registry, processor, pipeline, session_recorder):
+    canvas = processor.canvas
+
+    def remember(action):
+        # show the phrase that triggered an action in the status line
+        def run(event):
+            action()
+            processor.last_audio_command = event.text.lower()
+        return run
+
+    registry.register("clear", remember(canvas.clear))
+    registry.register("exit", lambda event: pipeline.stop())
+    registry.register("undo", remember(canvas.undo))
+    registry.register("redo", remember(canvas.redo))
+    for colour in Colours:
+        registry.register(colour.name.lower(), remember(lambda name=colour.name: processor.set_colour(name)))
+    registry.register("new layer", remember(canvas.add_layer))
+    registry.register("next layer", remember(lambda: canvas.select_layer(canvas.layers.active + 1)))
+    registry.register("previous layer", remember(lambda: canvas.select_layer(canvas.layers.active - 1)))
+    registry.register("hide layer", remember(lambda: canvas.set_layer_visible(False)))
+    registry.register("show layer", remember(lambda: canvas.set_layer_visible(True)))
+    registry.register("soft brush", remember(lambda: canvas.set_brush_alpha(SOFT_BRUSH_ALPHA)))
+    registry.register("hard brush", remember(lambda: canvas.set_brush_alpha(BRUSH_ALPHA)))
+    registry.register("start recording", remember(session_recorder.start))
+    registry.register("stop recording", remember(session_recorder.stop))
 
 
 def main():
-    last_audio_command = None
-    global last_recognized_word, working_recognizer
-    cap, cam_width, cam_height = initialise_camera()
-    tracker = HandTracker()
-    gesture_recogniser = GestureRecogniser()
-    canvas = DrawingCanvas(cam_width, cam_height)
-    ui_manager = UIManager(cam_width, cam_height)
-    center = (cam_width // 2, cam_height // 2)
-
-    # Set initial colour
-    canvas.set_colour(ui_manager.selected_colour)
-
-    # Inicia a thread de reconhecimento de áudio
-    audio_thread = threading.Thread(target=audio_recognition, daemon=True)
-    audio_thread.start()
-
-    while True:
-        success, frame = cap.read()
-        if not success:
-            print("Failed to get frame from camera")
-            break
-
-        # flip frame if enabled because i look ugly mirrored
-        if FLIP_CAMERA:
-            frame = cv2.flip(frame, 1)
-
-        # find and draw hands
-        frame = tracker.find_hands(frame, draw=True)
-        landmark_list = tracker.get_hand_position(frame)
-
-        # recognise gesture
-        gesture = gesture_recogniser.recognise_gesture(landmark_list)
-        index_finger = tracker.get_finger_position(frame, 8) if landmark_list else None
-
-        # Handle drawing actions
-        if index_finger:
-            if gesture == GestureType.SELECT:
-                # Reset to pen when selecting
-                canvas.set_tool(Tools.PEN)
-
-                # Handle colour selection
-                colour_selected, colour_name = ui_manager.handle_selection(index_finger)
-                if colour_selected:
-                    canvas.set_colour(colour_name)
-                    print(f"Selected colour: {colour_name}")
-
-                canvas.stop_drawing()
-
-            elif gesture == GestureType.DRAW:
-                # Ensure we're using pen tool
-                canvas.set_tool(Tools.PEN)
-
-                if not canvas.drawing:
-                    canvas.start_drawing(index_finger)
-                else:
-                    canvas.draw(index_finger)
-
-            elif gesture == GestureType.ERASE:
-                # Switch to eraser tool
-                canvas.set_tool(Tools.ERASER)
-
-                # Draw eraser circle preview around finger
-                cv2.circle(
-                    frame,
-                    index_finger,
-                    canvas.eraser_thickness // 2,  # Radius is half the thickness
-                    (255, 0, 0),  # Blue circle
-                    2,
-                )  # Line thickness
-
-                if not canvas.drawing:
-                    canvas.start_drawing(index_finger)
+    logging.basicConfig(level=LOG_LEVEL, format="%(message)s")
+    startup = StartupTimings(PROCESS_START)
+    startup.record("core imports", PROCESS_START, time.perf_counter())
+
+    # the camera, the hand tracker and the microphone all take a while to come
+    # up and don't depend on each other, so they start together. frames are
+    # shown as soon as the camera is ready, hands once the tracker is
+    loader = ThreadPoolExecutor(max_workers=3, thread_name_prefix="startup")
+    tracker_future = loader.submit(load_tracker, startup)
+    voice_module_future = loader.submit(import_voice, startup)
+
+    with startup.phase("camera"):
+        cap, cam_width, cam_height = initialise_camera()
+    recorder = None
+    if LANDMARK_LOG_PATH:
+        recorder = LandmarkRecorder(LANDMARK_LOG_PATH, cam_width, cam_height, max_hands=MAX_HANDS)
+    processor = FrameProcessor(cam_width, cam_height)
+    canvas = processor.canvas
+
+    # pick up the drawing where the last session left off, then journal every change
+    autosave = None
+    if AUTOSAVE_ENABLED:
+        with startup.phase("restore canvas"):
+            autosave = Autosave()
+            replayed = autosave.restore(canvas)
+        processor.ui_manager.set_colour(canvas.default_colour_name)
+        print(f"Restored canvas from {AUTOSAVE_DIR} ({replayed} logged operations)")
+        canvas.journal = autosave
+        autosave.start()
+
+    # capture and hand inference run on their own threads, this loop is the render stage
+    pipeline = Pipeline(cap)
+
+    # started and stopped from the keyboard or by voice
+    session_recorder = SessionRecorder(canvas)
+
+    # voice commands arrive on the bus from the listener thread and are drained each frame
+    bus = CommandBus()
+    registry = CommandRegistry()
+    register_commands(registry, processor, pipeline, session_recorder)
+    voice_future = loader.submit(start_voice, startup, voice_module_future, bus, registry)
+
+    exporter = None
+    if METRICS_ENABLED and METRICS_EXPORT_PATH:
+        exporter = MetricsExporter(metrics, METRICS_EXPORT_PATH, METRICS_EXPORT_INTERVAL)
+        exporter.start()
+    stream_server = None
+    if STREAM_ENABLED:
+        stream_server = StreamServer(canvas)
+        stream_server.start()
+    hud = HudStats() if METRICS_ENABLED and SHOW_HUD else None
+    governor = QualityGovernor() if GOVERNOR_ENABLED else None
+
+    # a resizable window keeps its size and HighGUI scales what's shown to fit,
+    # so the governor's smaller display frames don't shrink it
+    cv2.namedWindow('AirCanvas', cv2.WINDOW_NORMAL)
+    cv2.resizeWindow('AirCanvas', cam_width, cam_height)
+    scaled_frame = None
+    first_frame = True
+    startup_reported = False
+    tracker_failed = False
+    # everything after the loop runs however it ends, so the journal, the
+    # recording and the worker processes are always closed properly
+    pipeline.start()
+    try:
+        while pipeline.running:
+            packet = pipeline.next_result()
+            if packet is None:
+                # keep the window responsive, and 'q' working, while no frames come
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    pipeline.stop()
+                continue
+            render_start = time.perf_counter()
+
+            frame = packet.frame
+            hands = packet.hands
+
+            # recognise gestures for every hand at once and handle drawing actions
+            with metrics.timer("gesture"):
+                gestures = processor.recognise_hands(hands)
+            with metrics.timer("canvas_draw"):
+                processor.apply_hands(frame, hands, gestures)
+
+            for event in bus.drain():
+                registry.dispatch(event)
+
+            with metrics.timer("composite"):
+                frame = processor.composite(frame)
+            with metrics.timer("ui"):
+                processor.draw_ui(frame, hands, gestures, recognising=bus.recognising.is_set())
+                if hud is not None:
+                    processor.ui_manager.draw_hud(frame, hud.update(packet.timestamp))
+                if governor is not None:
+                    processor.ui_manager.draw_quality(frame, governor.describe())
+
+            session_recorder.record(frame, packet.timestamp)
+
+            with metrics.timer("display"):
+                if governor is not None and governor.current.display_scale != 1.0:
+                    scale = governor.current.display_scale
+                    size = (int(frame.shape[1] * scale), int(frame.shape[0] * scale))
+                    if scaled_frame is None or scaled_frame.shape[:2] != (size[1], size[0]):
+                        scaled_frame = np.empty((size[1], size[0], 3), dtype=np.uint8)
+                    frame = cv2.resize(frame, size, dst=scaled_frame, interpolation=cv2.INTER_AREA)
+                cv2.imshow('AirCanvas', frame)
+                key = cv2.waitKey(1) & 0xFF
+            if first_frame:
+                startup.mark("first frame")
+                first_frame = False
+            # imshow has its own copy, so the capture stage can reuse this buffer
+            pipeline.release(packet)
+            metrics.observe("end_to_end", (time.perf_counter() - packet.timestamp) * 1000)
+
+            # pipelined stages overlap, so the slowest one sets the frame time
+            if governor is not None:
+                render_ms = (time.perf_counter() - render_start) * 1000
+                if governor.update(max(packet.inference_ms, render_ms)) and pipeline.tracker is not None:
+                    governor.apply(pipeline.tracker, pipeline.inference_stage)
+
+            if pipeline.tracker is None and not tracker_failed and tracker_future.done():
+                error = tracker_future.exception()
+                if error is not None:
+                    # frames carry on through without hands, voice and keys still work
+                    tracker_failed = True
+                    startup.mark("hand tracking failed")
+                    print(f"Hand tracking unavailable: {error!r}")
                 else:
-                    canvas.draw(index_finger)
-            else:
-                # Stop drawing for any other gesture
-                canvas.stop_drawing()
-        else:
-            # No hand detected, stop drawing
-            canvas.stop_drawing()
-
-        if last_recognized_word:
-            if "clear" in last_recognized_word:
-                canvas.clear()
-                last_audio_command = last_recognized_word
-            elif "exit" in last_recognized_word:
-                break
-            elif "blue" in last_recognized_word:
-                canvas.set_colour(Colours.BLUE.name)
-                ui_manager.set_colour(Colours.BLUE.name)
-                last_audio_command = last_recognized_word
-            elif "red" in last_recognized_word:
-                canvas.set_colour(Colours.RED.name)
-                ui_manager.set_colour(Colours.RED.name)
-                last_audio_command = last_recognized_word
-            elif "green" in last_recognized_word:
-                canvas.set_colour(Colours.GREEN.name)
-                ui_manager.set_colour(Colours.GREEN.name)
-                last_audio_command = last_recognized_word
-            elif "yellow" in last_recognized_word:
-                canvas.set_colour(Colours.YELLOW.name)
-                ui_manager.set_colour(Colours.YELLOW.name)
-                last_audio_command = last_recognized_word
-            elif "white" in last_recognized_word:
-                canvas.set_colour(Colours.WHITE.name)
-                ui_manager.set_colour(Colours.WHITE.name)
-                last_audio_command = last_recognized_word
-
-            last_recognized_word = None
-
-        # Combine canvas with camera feed
-        # Draw canvas content
-        drawing_display = canvas.get_display()
-        # Only show camera feed where there is no drawing
-        mask = cv2.cvtColor(drawing_display, cv2.COLOR_BGR2GRAY)
-        mask = cv2.threshold(mask, 1, 255, cv2.THRESH_BINARY)[1]
-
-        # Ensure mask is uint8
-        if mask.dtype != np.uint8:
-            mask = mask.astype(np.uint8)
-
-        # Ensure mask is the same size as the frame
-        if mask.shape != frame.shape[:2]:
-            mask = cv2.resize(mask, (frame.shape[1], frame.shape[0]))
-
-        # Combine the camera feed and drawing
-        frame_bg = cv2.bitwise_and(frame, frame, mask=cv2.bitwise_not(mask))
-        drawing_fg = cv2.bitwise_and(drawing_display, drawing_display, mask=mask)
-        frame = cv2.add(frame_bg, drawing_fg)
-
-        if working_recognizer:
-            ui_manager.draw_text(frame, "Recognizing...", x=center[0] - 15, y=center[1])
-
-        # Add UI elements
-        ui_manager.draw(frame, last_audio_command)
-
-        if landmark_list:
-            cv2.putText(frame, f"Gesture: {gesture.value}", (10, CAMERA_HEIGHT - 60),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-            cv2.putText(frame, f"Tool: {canvas.current_tool}", (10, CAMERA_HEIGHT - 30),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-
-        cv2.imshow('AirCanvas', frame)
-
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-
-    cap.release()
-    cv2.destroyAllWindows()
+                    tracker = tracker_future.result()
+                    tracker.recorder = recorder
+                    if governor is not None:
+                        governor.apply(tracker, pipeline.inference_stage)
+                    pipeline.set_tracker(tracker)
+                    startup.mark("tracking online")
+            if not startup_reported and startup_finished(tracker_future, voice_future):
+                print(startup.report())
+                startup_reported = True
+
+            if key == ord('q'):
+                pipeline.stop()
+            elif key == ord('z'):
+                canvas.undo()
+            elif key == ord('y'):
+                canvas.redo()
+            elif key == ord('h'):
+                canvas.reset_view()
+            elif key == ord('r'):
+                session_recorder.toggle()
+
+            if autosave is not None:
+                autosave.maybe_snapshot(canvas)
+            if stream_server is not None:
+                stream_server.publish()
+    finally:
+        pipeline.stop()
+        session_recorder.stop()
+        loader.shutdown(wait=False)
+        if voice_future.done() and voice_future.exception() is None:
+            voice_future.result().stop()
+        if autosave is not None:
+            canvas.stop_all()
+            autosave.close()
+        if recorder is not None:
+            recorder.close()
+        if exporter is not None:
+            exporter.stop()
+        if stream_server is not None:
+            print(stream_server.report())
+            stream_server.stop()
+        if INFERENCE_PROCESS and tracker_future.done() and tracker_future.exception() is None:
+            tracker_future.result().detector.pool.close()
+        cv2.destroyAllWindows()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,206 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+from config import *
+
+
+# upper bounds of the latency buckets in milliseconds, the last bucket is +Inf
+LATENCY_BUCKETS_MS = (0.25, 0.5, 1, 2, 4, 8, 16, 33, 50, 100, 250, 500, 1000)
+
+NULL_TIMER = nullcontext()
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def percentile(self, q):
+        # upper bound of the bucket holding the q-th percentile
+        if self.count == 0:
+            return 0.0
+        target = q / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def snapshot(self):
+        return {
+            "buckets_ms": list(self.buckets),
+            "counts": list(self.counts),
+            "sum_ms": self.total,
+            "count": self.count,
+            "mean_ms": self.total / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+        }
+
+
+class Timer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, (time.perf_counter() - self.start) * 1000)
+        return False
+
+
+class Metrics:
+    # per-stage latency histograms, counters and gauges. every call is a no-op
+    # returning straight away while disabled, so instrumentation can stay in place
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def timer(self, name):
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, name)
+
+    def observe(self, name, value_ms):
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value_ms)
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name, value):
+        if not self.enabled:
+            return
+        self.gauges[name] = value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "timestamp": time.time(),
+                "stages": {name: h.snapshot() for name, h in self.histograms.items()},
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+            }
+
+    def export(self, path):
+        # written to a temp file first so readers never see a half-written snapshot
+        snapshot = self.snapshot()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            if path.endswith(".json"):
+                json.dump(snapshot, f, indent=2)
+            else:
+                f.write(prometheus_text(snapshot))
+        os.replace(tmp_path, path)
+
+
+def prometheus_text(snapshot):
+    lines = ["# TYPE aircanvas_stage_latency_ms histogram"]
+    for stage, histogram in snapshot["stages"].items():
+        cumulative = 0
+        for bound, count in zip(histogram["buckets_ms"], histogram["counts"]):
+            cumulative += count
+            lines.append(f'aircanvas_stage_latency_ms_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'aircanvas_stage_latency_ms_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+        lines.append(f'aircanvas_stage_latency_ms_sum{{stage="{stage}"}} {histogram["sum_ms"]}')
+        lines.append(f'aircanvas_stage_latency_ms_count{{stage="{stage}"}} {histogram["count"]}')
+
+    for name, value in snapshot["counters"].items():
+        lines.append(f"# TYPE aircanvas_{name}_total counter")
+        lines.append(f"aircanvas_{name}_total {value}")
+    for name, value in snapshot["gauges"].items():
+        lines.append(f"# TYPE aircanvas_{name} gauge")
+        lines.append(f"aircanvas_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsExporter(threading.Thread):
+    def __init__(self, metrics, path, interval=5.0):
+        super().__init__(name="metrics-exporter", daemon=True)
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.metrics.export(self.path)
+
+    def stop(self):
+        self.stop_event.set()
+        self.metrics.export(self.path)
+
+
+class HudStats:
+    # frame rate and capture-to-display latency for the on-screen readout, the
+    # text only changes every refresh seconds so the cached UI text stays cached
+    def __init__(self, refresh=0.5):
+        self.refresh = refresh
+        self.frames = 0
+        self.latency_total = 0.0
+        self.last_refresh = time.perf_counter()
+        self.text = "FPS: --  Latency: -- ms"
+
+    def update(self, capture_timestamp):
+        now = time.perf_counter()
+        self.frames += 1
+        self.latency_total += now - capture_timestamp
+
+        elapsed = now - self.last_refresh
+        if elapsed >= self.refresh:
+            fps = self.frames / elapsed
+            latency_ms = self.latency_total / self.frames * 1000
+            self.text = f"FPS: {fps:.0f}  Latency: {latency_ms:.0f} ms"
+            self.frames = 0
+            self.latency_total = 0.0
+            self.last_refresh = now
+        return self.text
+
+
+class RateLimitedLog:
+    # drops repeats of the same message key logged more often than interval seconds
+    def __init__(self, logger, interval=1.0):
+        self.logger = logger
+        self.interval = interval
+        self.last_logged = {}
+
+    def debug(self, key, message, *args):
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        now = time.monotonic()
+        if now - self.last_logged.get(key, 0.0) < self.interval:
+            return
+        self.last_logged[key] = now
+        self.logger.debug(message, *args)
+
+
+# shared instance the stages report into
+metrics = Metrics(enabled=METRICS_ENABLED)
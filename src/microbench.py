@@ -0,0 +1,318 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+from config import *
+from gesture import GestureRecogniser
+from motion import LandmarkFilter
+from processor import FrameProcessor
+from replay import StageTimings
+
+
+RESOLUTIONS = {"720p": (1280, 720), "1080p": (1920, 1080), "4k": (3840, 2160)}
+MOTIONS = ["pinch", "palm", "point", "scribble"]
+# frames in one synthetic stroke before the pen lifts and starts another
+STROKE_FRAMES = 90
+
+# hand landmarks in units of hand length, wrist at the origin and fingers up
+# (negative y). finger bases, index to pinky
+FINGER_BASES = np.array([[-0.25, -0.9], [-0.05, -0.95], [0.15, -0.9], [0.32, -0.8]], dtype=np.float32)
+FINGER_EXTENDED = np.array([[0.0, -0.35], [0.0, -0.6], [0.0, -0.8]], dtype=np.float32)  # pip, dip, tip
+FINGER_CURLED = np.array([[0.0, -0.25], [0.0, -0.1], [0.0, 0.05]], dtype=np.float32)
+THUMB_EXTENDED = np.array([[-0.3, -0.2], [-0.5, -0.4], [-0.65, -0.55], [-0.8, -0.65]], dtype=np.float32)
+THUMB_CURLED = np.array([[-0.2, -0.2], [-0.2, -0.4], [-0.05, -0.55], [0.1, -0.6]], dtype=np.float32)
+
+
+def hand_pose(motion):
+    # (21, 2) landmarks of the hand shape used by each motion: a pinch for
+    # drawing and scribbling, an open palm, and a pointing index finger
+    extended = {
+        "pinch": [True, False, False, False],
+        "palm": [True, True, True, True],
+        "point": [True, False, False, False],
+        "scribble": [True, False, False, False],
+    }[motion]
+    points = [np.zeros((1, 2), dtype=np.float32)]
+    points.append(THUMB_EXTENDED if motion == "palm" else THUMB_CURLED)
+    for base, up in zip(FINGER_BASES, extended):
+        points.append(base[None])
+        points.append(base + (FINGER_EXTENDED if up else FINGER_CURLED))
+    pose = np.concatenate(points)
+    if motion in ("pinch", "scribble"):
+        # thumb tip touching the index tip
+        pose[4] = pose[8] + (0.03, 0.02)
+    return pose
+
+
+def hand_trajectory(motion, width, height, frames, fps=CAMERA_FPS, seed=0):
+    # (timestamps, (frames, 21, 2) landmarks) of one synthetic hand moving the
+    # way each gesture tends to: slow drift for a palm, a figure of eight for
+    # pointing, smooth curves for drawing and fast jerky zigzags for scribbles.
+    # detection noise of a couple of pixels is added to every landmark
+    rng = np.random.default_rng(seed)
+    timestamps = np.arange(frames) / fps
+    t = timestamps[:, None]
+    centre = np.array([width / 2, height / 2])
+    reach = np.array([width, height]) * 0.3
+
+    if motion == "palm":
+        path = centre + reach * 0.3 * np.hstack([np.sin(0.5 * t), np.cos(0.4 * t)])
+    elif motion == "point":
+        path = centre + reach * np.hstack([np.sin(t), np.sin(2 * t) / 2])
+    elif motion == "pinch":
+        radius = 0.5 + 0.5 * np.sin(0.3 * t)
+        path = centre + reach * radius * np.hstack([np.cos(1.5 * t), np.sin(1.5 * t)])
+    else:
+        # a new random waypoint every few frames, crossed at high speed
+        waypoints = centre + reach * rng.uniform(-1, 1, size=(frames // 4 + 2, 2))
+        position = np.arange(frames) / 4
+        index = position.astype(int)
+        blend = (position - index)[:, None]
+        path = waypoints[index] * (1 - blend) + waypoints[index + 1] * blend
+
+    size = height * 0.2
+    pose = hand_pose(motion) * size
+    # the hand hangs below the fingertip being tracked, so the tip follows the path
+    landmarks = path[:, None, :] + (pose - pose[8])
+    landmarks += rng.normal(0.0, 1.5, size=landmarks.shape)
+    np.clip(landmarks, 0, [width - 1, height - 1], out=landmarks)
+    return timestamps, landmarks.astype(np.float32)
+
+
+# benchmarks. each factory builds its fixtures and returns (step, setup), both
+# called with the iteration number. only step is timed, setup may be None
+
+def gesture_bench(motion):
+    def factory(iterations):
+        recogniser = GestureRecogniser()
+        _, hands = hand_trajectory(motion, CAMERA_WIDTH, CAMERA_HEIGHT, iterations)
+        return lambda i: recogniser.recognise_gesture(hands[i]), None
+    return factory
+
+
+def smoothing_bench(motion):
+    # what HandTracker does per hand and frame before get_finger_position()
+    # reads the result: correct the filter with the detection, then predict a
+    # little ahead. HandTracker itself needs MediaPipe, so its filter is run directly
+    def factory(iterations):
+        timestamps, hands = hand_trajectory(motion, CAMERA_WIDTH, CAMERA_HEIGHT, iterations)
+        landmark_filter = LandmarkFilter(FILTER_MIN_CUTOFF, FILTER_BETA, FILTER_D_CUTOFF, PREDICTION_HORIZON)
+
+        def step(i):
+            landmark_filter.correct(hands[i], timestamps[i])
+            position = landmark_filter.predict(timestamps[i] + PREDICTION_LEAD)[8]
+            return int(position[0]), int(position[1])
+        return step, None
+    return factory
+
+
+def draw_bench(motion, width, height):
+    def factory(iterations):
+        canvas = FrameProcessor(width, height).canvas
+        _, hands = hand_trajectory(motion, width, height, iterations)
+        tips = hands[:, 8].astype(int)
+
+        def step(i):
+            if i % STROKE_FRAMES == 0:
+                canvas.stop_drawing()
+                canvas.start_drawing(tips[i])
+            else:
+                canvas.draw(tips[i])
+        return step, None
+    return factory
+
+
+def clear_bench(width, height):
+    def factory(iterations):
+        canvas = FrameProcessor(width, height).canvas
+        _, hands = hand_trajectory("scribble", width, height, STROKE_FRAMES)
+        tips = hands[:, 8].astype(int)
+
+        def setup(i):
+            canvas.start_drawing(tips[0])
+            for tip in tips[1:]:
+                canvas.draw(tip)
+            canvas.stop_drawing()
+        return lambda i: canvas.clear(), setup
+    return factory
+
+
+def scribbled_processor(width, height, frames=STROKE_FRAMES * 4):
+    # a processor whose canvas has ink across most of the screen
+    processor = FrameProcessor(width, height)
+    canvas = processor.canvas
+    for stroke, motion in enumerate(["scribble", "pinch", "scribble", "pinch"]):
+        _, hands = hand_trajectory(motion, width, height, frames // 4, seed=stroke)
+        tips = hands[:, 8].astype(int)
+        canvas.start_drawing(tips[0])
+        for tip in tips[1:]:
+            canvas.draw(tip)
+        canvas.stop_drawing()
+    return processor
+
+
+def composite_bench(width, height):
+    # the compositing step of the render loop, over a noisy camera frame
+    def factory(iterations):
+        processor = scribbled_processor(width, height)
+        background = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+        frame = background.copy()
+        return lambda i: processor.composite(frame), lambda i: np.copyto(frame, background)
+    return factory
+
+
+def ui_bench(width, height):
+    def factory(iterations):
+        ui_manager = FrameProcessor(width, height).ui_manager
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        return lambda i: ui_manager.draw(frame, "red"), None
+    return factory
+
+
+BENCHMARKS = {}
+for motion in MOTIONS:
+    BENCHMARKS[f"gesture/{motion}"] = gesture_bench(motion)
+    BENCHMARKS[f"smoothing/{motion}"] = smoothing_bench(motion)
+for resolution, (width, height) in RESOLUTIONS.items():
+    for motion in ("pinch", "scribble"):
+        BENCHMARKS[f"canvas_draw/{motion}/{resolution}"] = draw_bench(motion, width, height)
+    BENCHMARKS[f"canvas_clear/{resolution}"] = clear_bench(width, height)
+    BENCHMARKS[f"composite/{resolution}"] = composite_bench(width, height)
+    BENCHMARKS[f"ui_draw/{resolution}"] = ui_bench(width, height)
+
+
+def run_benchmark(factory, iterations, warmup):
+    # timing summary of one benchmark, see StageTimings.summary()
+    timings = StageTimings(["step"])
+    # the canvas reports every stroke it starts, which would drown the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        step, setup = factory(warmup + iterations)
+        for i in range(warmup + iterations):
+            if setup is not None:
+                setup(i)
+            start = time.perf_counter()
+            step(i)
+            if i >= warmup:
+                timings.lap("step", start)
+    return timings.summary()["step"]
+
+
+def run(names=None, iterations=BENCH_ITERATIONS, warmup=BENCH_WARMUP):
+    results = {}
+    for name, factory in BENCHMARKS.items():
+        if names and not any(pattern in name for pattern in names):
+            continue
+        rounds, warm = iterations, warmup
+        if name.startswith("canvas_clear"):
+            # every round draws a fresh scribble first, fewer of them keep it quick
+            rounds, warm = max(iterations // 10, 5), 1
+        stats = results[name] = run_benchmark(factory, rounds, warm)
+        print(f"{name:<32}{stats['mean_ms']:>10.3f}{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}")
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+        },
+        "iterations": iterations,
+        "benchmarks": results,
+    }
+
+
+def compare(baseline, current, metric="p50_ms", threshold=BENCH_REGRESSION_THRESHOLD,
+            min_delta_ms=BENCH_MIN_DELTA_MS, limits=None):
+    # (rows, regressions). a benchmark regresses when it got slower by more than
+    # its threshold, a fraction of the baseline, and by more than min_delta_ms,
+    # so sub-microsecond noise in very fast benchmarks can't fail a build
+    limits = limits or {}
+    rows = []
+    regressions = []
+    for name, before in baseline["benchmarks"].items():
+        after = current["benchmarks"].get(name)
+        if after is None:
+            continue
+        old, new = before[metric], after[metric]
+        change = new / old - 1 if old > 0 else 0.0
+        limit = limits.get(name, threshold)
+        regressed = change > limit and new - old > min_delta_ms
+        rows.append((name, old, new, change, limit, regressed))
+        if regressed:
+            regressions.append(name)
+    return rows, regressions
+
+
+def print_comparison(rows, metric):
+    print(f"{'benchmark':<32}{'baseline':>10}{'current':>10}{'change':>9}{'limit':>8}  ({metric[:-3]} ms)")
+    for name, old, new, change, limit, regressed in rows:
+        flag = "  REGRESSED" if regressed else ""
+        print(f"{name:<32}{old:>10.3f}{new:>10.3f}{change:>+9.1%}{limit:>8.0%}{flag}")
+
+
+def parse_limits(values):
+    # NAME=FRACTION pairs, e.g. composite/4k=0.3
+    limits = {}
+    for value in values or []:
+        name, _, fraction = value.partition("=")
+        limits[name] = float(fraction)
+    return limits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time AirCanvas hot paths on synthetic hand motion, no camera needed")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and print their timings")
+    run_parser.add_argument("names", nargs="*", help="only run benchmarks whose name contains one of these")
+    run_parser.add_argument("--iterations", type=int, default=BENCH_ITERATIONS)
+    run_parser.add_argument("--json", dest="json_path", help="write the results to this file, e.g. a new baseline")
+
+    compare_parser = subparsers.add_parser("compare", help="compare against a baseline, exit 1 on a regression")
+    compare_parser.add_argument("baseline", nargs="?", default=BENCH_BASELINE_PATH)
+    compare_parser.add_argument("--current", help="results to check, by default the benchmarks are run now")
+    compare_parser.add_argument("--names", nargs="*", help="only run benchmarks whose name contains one of these")
+    compare_parser.add_argument("--iterations", type=int, default=BENCH_ITERATIONS)
+    compare_parser.add_argument("--metric", default="p50_ms", choices=["mean_ms", "p50_ms", "p95_ms", "p99_ms"])
+    compare_parser.add_argument("--threshold", type=float, default=BENCH_REGRESSION_THRESHOLD,
+                                help="allowed slowdown as a fraction of the baseline")
+    compare_parser.add_argument("--min-delta", type=float, default=BENCH_MIN_DELTA_MS,
+                                help="slowdowns smaller than this many ms never count")
+    compare_parser.add_argument("--limit", action="append", metavar="NAME=FRACTION",
+                                help="threshold for one benchmark, may be repeated")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        print(f"{'benchmark':<32}{'mean':>10}{'p50':>10}{'p95':>10}  (ms)")
+        results = run(args.names, args.iterations)
+        if args.json_path:
+            os.makedirs(os.path.dirname(args.json_path) or ".", exist_ok=True)
+            with open(args.json_path, "w") as f:
+                json.dump(results, f, indent=2)
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if args.current:
+        with open(args.current) as f:
+            current = json.load(f)
+    else:
+        with contextlib.redirect_stdout(io.StringIO()):
+            current = run(args.names or list(baseline["benchmarks"]), args.iterations)
+
+    rows, regressions = compare(baseline, current, args.metric, args.threshold, args.min_delta, parse_limits(args.limit))
+    print_comparison(rows, args.metric)
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import math
+
+import numpy as np
+
+
+def smoothing_factor(cutoff, dt):
+    tau = 1.0 / (2 * math.pi * cutoff)
+    return 1.0 / (1.0 + tau / dt)
+
+
+class LandmarkFilter:
+    # One-Euro filter over all landmarks of one hand at once. slow movement is
+    # smoothed hard to kill jitter, fast movement barely at all so it doesn't lag.
+    # the filtered velocity doubles as a constant-velocity model for predicting
+    # positions on frames where inference is skipped
+    def __init__(self, min_cutoff=1.0, beta=0.01, d_cutoff=1.0, max_horizon=0.1):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.max_horizon = max_horizon
+        self.position = None
+        self.velocity = None
+        self.timestamp = None
+
+    def correct(self, points, timestamp):
+        # feed a real detection, returns the filtered positions
+        points = np.asarray(points, dtype=np.float32)
+        if self.position is None:
+            self.position = points.copy()
+            self.velocity = np.zeros_like(points)
+            self.timestamp = timestamp
+            return self.position
+
+        dt = max(timestamp - self.timestamp, 1e-3)
+        self.timestamp = timestamp
+
+        raw_velocity = (points - self.position) / dt
+        self.velocity += smoothing_factor(self.d_cutoff, dt) * (raw_velocity - self.velocity)
+
+        # per-landmark cutoff rises with speed
+        speed = np.linalg.norm(self.velocity[:, :2], axis=1, keepdims=True)
+        cutoff = self.min_cutoff + self.beta * speed
+        tau = 1.0 / (2 * np.pi * cutoff)
+        alpha = 1.0 / (1.0 + tau / dt)
+        self.position += alpha * (points - self.position)
+        return self.position
+
+    def predict(self, timestamp):
+        # extrapolate from the last correction without changing the filter state
+        if self.position is None:
+            return None
+        # don't run away with a stale velocity if detections stop coming
+        horizon = min(timestamp - self.timestamp, self.max_horizon)
+        return self.position + self.velocity * horizon
+
+    def reset(self):
+        self.position = None
+        self.velocity = None
+        self.timestamp = None
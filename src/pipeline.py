@@ -0,0 +1,226 @@
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any
+
+import cv2
+from config import *
+from frame_pool import FramePool
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class FramePacket:
+    frame_id: int
+    timestamp: float
+    frame: Any
+    # (hand id, landmarks, index finger position) per tracked hand
+    hands: list = field(default_factory=list)
+    inference_ms: float = 0.0
+
+
+class LatestQueue:
+    # bounded queue where the newest item always wins - when full the oldest
+    # item is dropped so a slow consumer never sees stale frames. on_drop is
+    # called with each dropped item, e.g. to hand its frame buffer back
+    def __init__(self, maxsize=1, name="queue", on_drop=None):
+        self.maxsize = maxsize
+        self.name = name
+        self.on_drop = on_drop
+        self.dropped_metric = f"{name}_frames_dropped"
+        self.depth_metric = f"{name}_queue_depth"
+        self.items = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self.condition:
+            if self.closed:
+                return
+            while len(self.items) >= self.maxsize:
+                dropped = self.items.popleft()
+                if self.on_drop is not None:
+                    self.on_drop(dropped)
+                self.dropped += 1
+                metrics.count(self.dropped_metric)
+            self.items.append(item)
+            metrics.gauge(self.depth_metric, len(self.items))
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        # returns None on timeout or once the queue has been closed and drained
+        with self.condition:
+            if not self.items and not self.closed:
+                self.condition.wait(timeout)
+            if not self.items:
+                return None
+            return self.items.popleft()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __len__(self):
+        with self.condition:
+            return len(self.items)
+
+
+class CaptureStage(threading.Thread):
+    def __init__(self, cap, output: LatestQueue, stop_event: threading.Event, pool: FramePool):
+        super().__init__(name="capture", daemon=True)
+        self.cap = cap
+        self.output = output
+        self.stop_event = stop_event
+        self.pool = pool
+        self.frame_shape = None
+        self.frame_id = 0
+
+    def run(self):
+        while not self.stop_event.is_set():
+            # decode straight into a pooled buffer, the very first read allocates
+            # one so the pool learns the frame size
+            buffer = self.pool.acquire(self.frame_shape)
+            with metrics.timer("capture"):
+                success, frame = self.cap.read(buffer)
+            if not success:
+                self.pool.release(buffer)
+                print("Failed to get frame from camera")
+                self.stop_event.set()
+                break
+            self.frame_shape = frame.shape
+
+            # flip frame if enabled because i look ugly mirrored
+            if FLIP_CAMERA:
+                cv2.flip(frame, 1, dst=frame)
+
+            self.output.put(FramePacket(self.frame_id, time.perf_counter(), frame))
+            self.frame_id += 1
+
+        self.output.close()
+
+
+class InferenceStage(threading.Thread):
+    def __init__(self, tracker, input: LatestQueue, output: LatestQueue, stop_event: threading.Event):
+        super().__init__(name="inference", daemon=True)
+        self.tracker = tracker
+        self.input = input
+        self.output = output
+        self.stop_event = stop_event
+        # run the tracker on every Nth frame only, set by the quality governor
+        self.infer_every = INFER_EVERY
+        self.frames_seen = 0
+        self.errors = 0
+        self.last_error_log = float("-inf")
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                packet = self.input.get(timeout=STAGE_TIMEOUT)
+                if packet is None:
+                    if self.input.closed:
+                        break
+                    continue
+
+                # frames go straight through until the tracker has finished loading
+                tracker = self.tracker
+                if tracker is None:
+                    self.output.put(packet)
+                    continue
+
+                start = time.perf_counter()
+                try:
+                    self._infer(tracker, packet)
+                except Exception:
+                    # a frame the tracker chokes on goes through without hands
+                    # rather than taking the thread down
+                    packet.hands = []
+                    self._log_error()
+                packet.inference_ms = (time.perf_counter() - start) * 1000
+
+                self.output.put(packet)
+        finally:
+            # whatever ends this thread ends the pipeline, so the render loop
+            # doesn't wait on frames that will never come
+            self.stop_event.set()
+            self.output.close()
+
+    def _infer(self, tracker, packet):
+        # the tracker keeps per-frame state, so everything that reads it
+        # has to happen on this thread before the packet is handed on
+        if self.frames_seen % self.infer_every == 0:
+            packet.frame = tracker.find_hands(packet.frame, draw=True, timestamp=packet.timestamp)
+        else:
+            packet.frame = tracker.skip_frame(packet.frame, draw=True, timestamp=packet.timestamp)
+        self.frames_seen += 1
+        packet.hands = tracker.get_tracked_hands(8)
+
+    def _log_error(self):
+        # the traceback once a second at most, a failure that repeats every
+        # frame would drown everything else out
+        self.errors += 1
+        metrics.count("inference_errors")
+        now = time.perf_counter()
+        if now - self.last_error_log >= 1.0:
+            self.last_error_log = now
+            logger.exception("Hand tracking failed on frame (%d errors so far)", self.errors)
+
+
+class Pipeline:
+    # capture -> inference -> render, each stage joined by a latest-frame-wins
+    # queue. the render stage runs on the caller's thread (cv2.imshow needs it)
+    # and hands each packet back with release() once it's been shown. the
+    # tracker can be None to begin with and handed over later with set_tracker()
+    def __init__(self, cap, tracker=None):
+        self.cap = cap
+        self.stop_event = threading.Event()
+        # enough buffers for every frame that can be in flight: one per queue
+        # slot, plus the ones being captured, inferred on and rendered
+        self.pool = FramePool(CAPTURE_QUEUE_SIZE + RESULT_QUEUE_SIZE + 3)
+        self.frames = LatestQueue(CAPTURE_QUEUE_SIZE, name="capture", on_drop=self.release)
+        self.results = LatestQueue(RESULT_QUEUE_SIZE, name="result", on_drop=self.release)
+        self.capture_stage = CaptureStage(cap, self.frames, self.stop_event, self.pool)
+        self.inference_stage = InferenceStage(tracker, self.frames, self.results, self.stop_event)
+
+    @property
+    def running(self):
+        return not self.stop_event.is_set()
+
+    @property
+    def tracker(self):
+        return self.inference_stage.tracker
+
+    def set_tracker(self, tracker):
+        self.inference_stage.tracker = tracker
+
+    def start(self):
+        self.capture_stage.start()
+        self.inference_stage.start()
+
+    def next_result(self):
+        # blocks for at most STAGE_TIMEOUT, returns None if nothing arrived
+        return self.results.get(timeout=STAGE_TIMEOUT)
+
+    def release(self, packet: FramePacket):
+        # the packet's frame buffer is free to be captured into again
+        self.pool.release(packet.frame)
+
+    def stop(self):
+        self.stop_event.set()
+        self.frames.close()
+        self.results.close()
+
+        for stage in (self.capture_stage, self.inference_stage):
+            if stage.is_alive():
+                stage.join(timeout=SHUTDOWN_TIMEOUT)
+
+        # releasing the camera under a read still in progress can crash the backend
+        if self.capture_stage.is_alive():
+            print("Camera read didn't return, leaving the camera open")
+        else:
+            self.cap.release()
@@ -0,0 +1,147 @@
+import cv2
+import numpy as np
+from gesture import GestureRecogniser, GestureType, GESTURE_CODES
+from drawing import DrawingCanvas, Tools
+from ui import UIManager
+
+
+class FrameProcessor:
+    # gesture -> canvas -> composite -> ui, shared by the live app and headless replay
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.gesture_recogniser = GestureRecogniser()
+        self.canvas = DrawingCanvas(width, height)
+        self.ui_manager = UIManager(width, height)
+        self.last_audio_command = None
+        # last screen position of each hand holding the pan gesture
+        self.pan_points = {}
+
+        # Set initial colour
+        self.canvas.set_colour(self.ui_manager.selected_colour)
+
+    def recognise(self, landmarks):
+        return self.gesture_recogniser.recognise_gesture(landmarks)
+
+    def recognise_hands(self, hands):
+        # classify every hand in one batched pass
+        if not hands:
+            return []
+        codes = self.gesture_recogniser.classify_batch(np.stack([landmarks for _, landmarks, _ in hands]))
+        return [GESTURE_CODES[code] for code in codes]
+
+    def apply_hands(self, frame, hands, gestures):
+        # hands is a list of (hand id, landmarks, index finger) from the tracker
+        for (hand_id, _, index_finger), gesture in zip(hands, gestures):
+            self.apply_gesture(frame, gesture, index_finger, hand_id)
+
+        self.navigate({
+            hand_id: index_finger
+            for (hand_id, _, index_finger), gesture in zip(hands, gestures)
+            if gesture == GestureType.PAN and index_finger
+        })
+
+        # pens of hands that have left the frame stop drawing
+        self.canvas.stop_all(keep={hand_id for hand_id, _, _ in hands})
+
+    def apply_gesture(self, frame, gesture, index_finger, hand_id=0):
+        canvas = self.canvas
+
+        if not index_finger:
+            # No hand detected, stop drawing
+            canvas.stop_drawing(hand_id)
+            return
+
+        if gesture == GestureType.SELECT:
+            # Reset to pen when selecting
+            canvas.set_tool(Tools.PEN, hand_id)
+
+            # Handle colour selection
+            colour_selected, colour_name = self.ui_manager.handle_selection(index_finger, hand_id)
+            if colour_selected:
+                canvas.set_colour(colour_name, hand_id)
+                print(f"Selected colour: {colour_name}")
+
+            canvas.stop_drawing(hand_id)
+
+        elif gesture == GestureType.DRAW:
+            # Ensure we're using pen tool
+            canvas.set_tool(Tools.PEN, hand_id)
+
+            if not canvas.pen(hand_id).drawing:
+                canvas.start_drawing(index_finger, hand_id)
+            else:
+                canvas.draw(index_finger, hand_id)
+
+        elif gesture == GestureType.ERASE:
+            # Switch to eraser tool
+            canvas.set_tool(Tools.ERASER, hand_id)
+
+            # Draw eraser circle preview around finger (no frame when replaying landmarks)
+            if frame is not None:
+                cv2.circle(
+                    frame,
+                    index_finger,
+                    int(canvas.eraser_thickness * canvas.zoom) // 2,  # Radius is half the thickness, on screen
+                    (255, 0, 0),  # Blue circle
+                    2,
+                )  # Line thickness
+
+            if not canvas.pen(hand_id).drawing:
+                canvas.start_drawing(index_finger, hand_id)
+            else:
+                canvas.draw(index_finger, hand_id)
+        else:
+            # Stop drawing for any other gesture
+            canvas.stop_drawing(hand_id)
+
+    def navigate(self, points):
+        # one hand in the pan gesture drags the canvas, two pinch-zoom it about
+        # their midpoint. points maps hand id -> screen position this frame
+        previous = {hand_id: self.pan_points[hand_id] for hand_id in points if hand_id in self.pan_points}
+        self.pan_points = points
+
+        if len(previous) == 1:
+            (hand_id, (x0, y0)), = previous.items()
+            x1, y1 = points[hand_id]
+            self.canvas.pan(x1 - x0, y1 - y0)
+        elif len(previous) >= 2:
+            a, b = list(previous)[:2]
+            before = np.array([previous[a], previous[b]], dtype=np.float32)
+            after = np.array([points[a], points[b]], dtype=np.float32)
+            spread = np.linalg.norm(before[0] - before[1])
+            if spread > 0:
+                self.canvas.zoom_by(np.linalg.norm(after[0] - after[1]) / spread, before.mean(axis=0))
+            dx, dy = after.mean(axis=0) - before.mean(axis=0)
+            self.canvas.pan(dx, dy)
+
+    def set_colour(self, colour_name):
+        # voice commands change every hand's colour
+        self.canvas.set_colour(colour_name)
+        self.ui_manager.set_colour(colour_name)
+
+    def composite(self, frame):
+        # Combine canvas with camera feed, only where there is ink
+        return self.canvas.composite(frame)
+
+    def draw_ui(self, frame, hands, gestures, recognising=False):
+        if recognising:
+            center = (self.width // 2, self.height // 2)
+            self.ui_manager.draw_cached_text(
+                frame, "recognizing", "Recognizing...", x=center[0] - 15, y=center[1]
+            )
+
+        # Add UI elements
+        self.ui_manager.draw(frame, self.last_audio_command)
+
+        if hands:
+            gesture_text = ", ".join(gesture.value for gesture in gestures)
+            tool_text = ", ".join(str(self.canvas.pen(hand_id).tool) for hand_id, _, _ in hands)
+            self.ui_manager.draw_debug(frame, gesture_text, tool_text)
+
+    def process(self, frame, hands, recognising=False):
+        gestures = self.recognise_hands(hands)
+        self.apply_hands(frame, hands, gestures)
+        frame = self.composite(frame)
+        self.draw_ui(frame, hands, gestures, recognising)
+        return frame, gestures
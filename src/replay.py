@@ -0,0 +1,287 @@
+import argparse
+import json
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from config import *
+from gesture import GESTURE_CODES
+from hand_assigner import HandAssigner
+from landmark_log import LandmarkLog, LandmarkRecorder
+from motion import LandmarkFilter
+from processor import FrameProcessor
+
+
+STAGES = ["capture", "flip", "inference", "landmarks", "gesture", "canvas", "composite", "ui"]
+
+
+class StageTimings:
+    def __init__(self, stages=STAGES):
+        self.samples = {stage: [] for stage in stages}
+
+    def lap(self, stage, start):
+        # record time since start and return now, so laps can be chained
+        now = time.perf_counter()
+        self.samples[stage].append(now - start)
+        return now
+
+    def summary(self):
+        summary = {}
+        for stage, samples in self.samples.items():
+            if not samples:
+                continue
+            ms = np.array(samples) * 1000
+            summary[stage] = {
+                "mean_ms": float(ms.mean()),
+                "p50_ms": float(np.percentile(ms, 50)),
+                "p95_ms": float(np.percentile(ms, 95)),
+                "p99_ms": float(np.percentile(ms, 99)),
+            }
+        return summary
+
+
+class AllocationStats:
+    # bytes allocated within each frame, via tracemalloc. numpy and OpenCV output
+    # arrays are both traced, so any frame-sized temporary shows up here even if
+    # it's freed again before the frame ends. the first frames are skipped while
+    # buffers and caches warm up
+    def __init__(self, warmup=30):
+        self.warmup = warmup
+        self.frames = 0
+        self.samples = []
+        self.frame_start = 0
+
+    def start(self):
+        tracemalloc.start()
+
+    def begin_frame(self):
+        tracemalloc.reset_peak()
+        self.frame_start = tracemalloc.get_traced_memory()[0]
+
+    def end_frame(self):
+        current, peak = tracemalloc.get_traced_memory()
+        self.frames += 1
+        if self.frames > self.warmup:
+            self.samples.append((peak - self.frame_start, current - self.frame_start))
+
+    def stop(self):
+        tracemalloc.stop()
+
+    def summary(self):
+        if not self.samples:
+            return {}
+        peaks = np.array([peak for peak, _ in self.samples]) / 1024
+        retained = np.array([retained for _, retained in self.samples]) / 1024
+        return {
+            "frames": len(self.samples),
+            "mean_peak_kb": float(peaks.mean()),
+            "max_peak_kb": float(peaks.max()),
+            "mean_retained_kb": float(retained.mean()),
+        }
+
+
+def replay(path, max_speed=False, flip=FLIP_CAMERA, max_frames=None, record_path=None, trace_allocations=False):
+    # imported here so landmark-only replays never load mediapipe
+    from hand_tracker import HandTracker
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video: {path}")
+
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    video_fps = cap.get(cv2.CAP_PROP_FPS) or CAMERA_FPS
+    frame_interval = 1.0 / video_fps
+
+    recorder = LandmarkRecorder(record_path, width, height, max_hands=MAX_HANDS) if record_path else None
+    tracker = HandTracker(recorder=recorder)
+    processor = FrameProcessor(width, height)
+    timings = StageTimings()
+    frame_times = []
+    allocations = AllocationStats() if trace_allocations else None
+    if allocations is not None:
+        allocations.start()
+
+    # one frame in flight, so a single buffer is decoded into and flipped in place
+    buffer = None
+    frames = 0
+    start_time = time.perf_counter()
+    while max_frames is None or frames < max_frames:
+        # hold to the video's own clock unless we're benchmarking flat out
+        if not max_speed:
+            delay = start_time + frames * frame_interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        if allocations is not None:
+            allocations.begin_frame()
+        frame_start = t = time.perf_counter()
+        success, frame = cap.read(buffer)
+        if not success:
+            break
+        buffer = frame
+        t = timings.lap("capture", t)
+
+        if flip:
+            cv2.flip(frame, 1, dst=frame)
+        t = timings.lap("flip", t)
+
+        # video time, not the clock, so filtering and prediction come out the
+        # same whether the replay is paced or flat out
+        frame = tracker.find_hands(frame, draw=True, timestamp=frames * frame_interval)
+        t = timings.lap("inference", t)
+
+        hands = tracker.get_tracked_hands(8)
+        t = timings.lap("landmarks", t)
+
+        gestures = processor.recognise_hands(hands)
+        t = timings.lap("gesture", t)
+
+        processor.apply_hands(frame, hands, gestures)
+        t = timings.lap("canvas", t)
+
+        frame = processor.composite(frame)
+        t = timings.lap("composite", t)
+
+        processor.draw_ui(frame, hands, gestures)
+        t = timings.lap("ui", t)
+
+        frame_times.append(t - frame_start)
+        frames += 1
+        if allocations is not None:
+            allocations.end_frame()
+
+    elapsed = time.perf_counter() - start_time
+    if allocations is not None:
+        allocations.stop()
+    cap.release()
+    if recorder is not None:
+        recorder.close()
+
+    report = {
+        "video": path,
+        "resolution": [width, height],
+        "max_speed": max_speed,
+        "frames": frames,
+        "elapsed_s": elapsed,
+        "fps": frames / elapsed if elapsed > 0 else 0.0,
+        "stages": timings.summary(),
+    }
+    if frame_times:
+        total = StageTimings(["total"])
+        total.samples["total"] = frame_times
+        report["stages"].update(total.summary())
+    if allocations is not None:
+        report["allocations"] = allocations.summary()
+    return report
+
+
+def replay_landmarks(path, max_frames=None):
+    # gesture + canvas only, driven from a recorded landmark log with no vision stack
+    log = LandmarkLog(path)
+    count = len(log) if max_frames is None else min(len(log), max_frames)
+    processor = FrameProcessor(log.width, log.height)
+    assigner = HandAssigner(HAND_MATCH_DISTANCE, HAND_MAX_MISSED)
+    filters = {}
+    records = log.records[:count]
+    timings = StageTimings(["gesture", "canvas"])
+
+    # every hand slot of every frame classified in one call
+    start_time = t = time.perf_counter()
+    slots = np.asarray(records["landmarks"])
+    codes = processor.gesture_recogniser.classify_batch(
+        slots.reshape(-1, *slots.shape[2:])
+    ).reshape(slots.shape[:2])
+    t = timings.lap("gesture", t)
+
+    for i in range(count):
+        hand_count = int(records["hand_count"][i])
+        timestamp = float(records["timestamp"][i])
+        landmarks = list(slots[i, :hand_count])
+        hand_ids = assigner.assign(landmarks, log.handedness(i))
+
+        hands = []
+        for hand_id, hand in zip(hand_ids, landmarks):
+            if hand_id not in filters:
+                filters[hand_id] = LandmarkFilter(
+                    FILTER_MIN_CUTOFF, FILTER_BETA, FILTER_D_CUTOFF, PREDICTION_HORIZON
+                )
+            filters[hand_id].correct(hand, timestamp)
+            point = filters[hand_id].predict(timestamp + PREDICTION_LEAD)[8]
+            hands.append((hand_id, hand, (int(point[0]), int(point[1]))))
+        for hand_id in list(filters):
+            if hand_id not in hand_ids:
+                del filters[hand_id]
+
+        gestures = [GESTURE_CODES[code] for code in codes[i, :hand_count]]
+        processor.apply_hands(None, hands, gestures)
+        t = timings.lap("canvas", t)
+
+    elapsed = time.perf_counter() - start_time
+    return {
+        "video": path,
+        "resolution": [log.width, log.height],
+        "max_speed": True,
+        "frames": count,
+        "elapsed_s": elapsed,
+        "fps": count / elapsed if elapsed > 0 else 0.0,
+        "stages": timings.summary(),
+    }, processor.canvas
+
+
+def print_report(report):
+    width, height = report["resolution"]
+    print(f"Replayed {report['frames']} frames of {report['video']} ({width}x{height})")
+    print(f"{'stage':<12}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}  (ms)")
+    for stage, stats in report["stages"].items():
+        print(
+            f"{stage:<12}{stats['mean_ms']:>10.2f}{stats['p50_ms']:>10.2f}"
+            f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+        )
+    print(f"Throughput: {report['fps']:.1f} fps over {report['elapsed_s']:.2f}s")
+
+    allocations = report.get("allocations")
+    if allocations:
+        print(
+            f"Allocated per frame: {allocations['mean_peak_kb']:.1f} KB mean, "
+            f"{allocations['max_peak_kb']:.1f} KB max, {allocations['mean_retained_kb']:.1f} KB retained "
+            f"(over {allocations['frames']} frames)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded video through the AirCanvas pipeline headlessly")
+    parser.add_argument("video", help="path to the recorded video file (or landmark log with --landmarks)")
+    parser.add_argument("--landmarks", action="store_true", help="input is a landmark log, replay gesture and canvas only")
+    parser.add_argument("--record-landmarks", metavar="PATH", help="append tracked landmarks to this log while replaying")
+    parser.add_argument("--save-canvas", metavar="PATH", help="write the final canvas of a landmark replay to an image")
+    parser.add_argument("--max-speed", action="store_true", help="ignore the video's frame rate and run flat out")
+    parser.add_argument("--no-flip", action="store_true", help="don't mirror frames (e.g. already-flipped recordings)")
+    parser.add_argument("--trace-allocations", action="store_true", help="measure memory allocated per frame (slower)")
+    parser.add_argument("--frames", type=int, default=None, help="stop after this many frames")
+    parser.add_argument("--json", dest="json_path", help="also write the report to this file")
+    args = parser.parse_args()
+
+    if args.landmarks:
+        report, canvas = replay_landmarks(args.video, max_frames=args.frames)
+        if args.save_canvas:
+            cv2.imwrite(args.save_canvas, canvas.render())
+    else:
+        report = replay(
+            args.video,
+            max_speed=args.max_speed,
+            flip=FLIP_CAMERA and not args.no_flip,
+            max_frames=args.frames,
+            record_path=args.record_landmarks,
+            trace_allocations=args.trace_allocations,
+        )
+    print_report(report)
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+from config import *
+from frame_pool import FramePool
+from metrics import metrics
+
+
+class SessionRecorder:
+    # records the live session to video without holding up the render loop.
+    # record() runs on the render thread once a frame and only copies: the
+    # finished frame, scaled straight into a pooled buffer, or in canvas mode
+    # just the flattened tiles that changed. an encoder thread does the rest.
+    # when it falls behind and its queue is full, frames are dropped before
+    # anything is copied, and counted. the video keeps to real time, a frame
+    # is repeated to cover any gap after it
+    def __init__(self, canvas, directory=RECORD_DIR, source=RECORD_SOURCE, size=RECORD_SIZE,
+                 codec=RECORD_CODEC, fps=RECORD_FPS, queue_size=RECORD_QUEUE_SIZE):
+        if source not in ("composite", "canvas"):
+            raise ValueError(f"unknown recording source {source!r}")
+        self.canvas = canvas
+        self.directory = directory
+        self.source = source
+        self.size = size
+        self.codec = codec
+        self.fps = fps
+
+        self.queue_size = queue_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        # one buffer per queued frame, and one being encoded
+        self.pool = FramePool(size=queue_size + 1)
+        # canvas mode records the area the canvas starts out showing
+        self.rect = (0, 0, canvas.width, canvas.height)
+        self.thread = None
+        self.path = None
+        self._reset_stats()
+
+    @property
+    def recording(self):
+        return self.thread is not None
+
+    def _reset_stats(self):
+        self.started_at = None
+        self.frames = 0
+        self.dropped = 0
+        self.written = 0
+        self.record_ms = 0.0
+        self.encode_ms = 0.0
+
+    def toggle(self):
+        if self.recording:
+            self.stop()
+        else:
+            self.start()
+
+    def start(self):
+        if self.recording:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        stem = time.strftime("session-%Y%m%d-%H%M%S")
+        self.path = os.path.join(self.directory, f"{stem}_{self.source}.mp4")
+        self._reset_stats()
+        self.started_at = time.perf_counter()
+        # the first canvas frame carries every tile, later ones what changed
+        self.keyframe = True
+        # a fresh queue, an encoder that died or hung is left with its old one
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.thread = threading.Thread(target=self._encode_loop, args=(self.path + ".part.mp4", self.queue),
+                                       name="session-recorder", daemon=True)
+        self.thread.start()
+        print(f"Recording session to {self.path}")
+
+    def record(self, frame, timestamp):
+        # render thread: frame is the composited frame, timestamp when it was captured
+        if not self.recording:
+            return
+        if self.queue.full():
+            # changed canvas tiles stay marked, so a dropped canvas frame loses nothing
+            self.dropped += 1
+            metrics.count("recording_frames_dropped")
+            return
+
+        start = time.perf_counter()
+        with metrics.timer("record"):
+            if self.source == "canvas":
+                self.queue.put((timestamp, None, self._changed_tiles()))
+            else:
+                height, width = frame.shape[:2]
+                out_width, out_height = self.size or (width, height)
+                buffer = self.pool.acquire((out_height, out_width, 3))
+                if (out_width, out_height) == (width, height):
+                    np.copyto(buffer, frame)
+                else:
+                    cv2.resize(frame, (out_width, out_height), dst=buffer, interpolation=cv2.INTER_AREA)
+                self.queue.put((timestamp, buffer, None))
+        self.frames += 1
+        self.record_ms += (time.perf_counter() - start) * 1000
+
+    def _changed_tiles(self):
+        # copies of the flattened colour of tiles changed inside the recorded
+        # area, None for tiles now blank. premultiplied colour over black is
+        # the colour itself
+        canvas = self.canvas
+        keys = canvas.pop_dirty_tiles("recording")
+        inside = canvas.layers.flat.keys_in(self.rect)
+        if self.keyframe:
+            self.keyframe = False
+            keys = inside
+        else:
+            keys = keys.intersection(inside)
+
+        tiles = {}
+        for key in keys:
+            tile = canvas.layers.tile(key)
+            tiles[key] = None if tile is None else tile.colour.copy()
+        return tiles
+
+    def _encode_loop(self, path, frames):
+        writer = None
+        image = None
+        scaled = None
+        flat = self.canvas.layers.flat
+        while True:
+            item = frames.get()
+            if item is None:
+                break
+            timestamp, frame, tiles = item
+            start = time.perf_counter()
+
+            if tiles is not None:
+                # canvas mode, the changed tiles are painted onto the last image
+                if image is None:
+                    x0, y0, x1, y1 = self.rect
+                    image = np.zeros((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+                for key, colour in tiles.items():
+                    (sx, sy, dx, dy), (w, h) = flat.overlap(key, self.rect)
+                    if colour is None:
+                        image[dy:dy + h, dx:dx + w] = 0
+                    else:
+                        image[dy:dy + h, dx:dx + w] = colour[sy:sy + h, sx:sx + w]
+                frame = image
+                if self.size is not None and self.size != (image.shape[1], image.shape[0]):
+                    scaled = cv2.resize(image, self.size, dst=scaled, interpolation=cv2.INTER_AREA)
+                    frame = scaled
+
+            if writer is None:
+                height, width = frame.shape[:2]
+                writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*self.codec), self.fps, (width, height))
+
+            # the frame showing at timestamp, and up to the next one. frames
+            # coming faster than the video's fps are skipped
+            due = int((timestamp - self.started_at) * self.fps) + 1
+            while self.written < due:
+                writer.write(frame)
+                self.written += 1
+            if tiles is None:
+                self.pool.release(frame)
+            self.encode_ms += (time.perf_counter() - start) * 1000
+
+        if writer is not None:
+            writer.release()
+            os.replace(path, self.path)
+
+    def stop(self):
+        # waits for the queued frames to be written, for a while. an encoder
+        # that has died or hung is left behind rather than hanging the render loop
+        if not self.recording:
+            return
+        try:
+            self.queue.put(None, timeout=SHUTDOWN_TIMEOUT)
+        except queue.Full:
+            pass
+        self.thread.join(timeout=SHUTDOWN_TIMEOUT)
+        if self.thread.is_alive():
+            print(f"Session recorder didn't finish writing {self.path}")
+        self.thread = None
+        print(self.report())
+
+    def report(self):
+        seconds = time.perf_counter() - self.started_at if self.started_at is not None else 0.0
+        offered = self.frames + self.dropped
+        lines = [
+            f"Session recording: {self.path}",
+            f"  {seconds:.1f}s, {self.written} video frames from {self.frames} recorded,"
+            f" {self.dropped} dropped ({self.dropped / max(offered, 1):.1%})",
+            f"  render thread {self.record_ms / max(self.frames, 1):.2f} ms per frame,"
+            f" encoder {self.encode_ms / max(self.frames, 1):.2f} ms per frame",
+        ]
+        return "\n".join(lines)
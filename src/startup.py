@@ -0,0 +1,37 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupTimings:
+    # when each part of startup began and ended, relative to process start-up,
+    # and on which thread, so overlapping work shows up as overlapping rows
+    def __init__(self, origin=None):
+        self.origin = time.perf_counter() if origin is None else origin
+        self.lock = threading.Lock()
+        self.phases = []  # (name, start, end, thread name)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def mark(self, name):
+        # a moment rather than a span, e.g. the first frame on screen
+        now = time.perf_counter()
+        self.record(name, now, now)
+
+    def record(self, name, start, end):
+        with self.lock:
+            self.phases.append((name, start - self.origin, end - self.origin, threading.current_thread().name))
+
+    def report(self):
+        with self.lock:
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+        lines = [f"{'startup (ms)':<24}{'start':>9}{'took':>9}  thread"]
+        for name, start, end, thread in phases:
+            lines.append(f"{name:<24}{start * 1000:>9.0f}{(end - start) * 1000:>9.0f}  {thread}")
+        return "\n".join(lines)
@@ -0,0 +1,494 @@
+import argparse
+import queue
+import socket
+import struct
+import threading
+import time
+import zlib
+
+import cv2
+import numpy as np
+from config import *
+from metrics import Histogram, metrics
+
+
+# every message is a fixed header followed by its payload. the server sends
+# HELLO once, then per update an optional RESET, the changed tiles and an END
+# carrying the update's sequence number, which viewers echo back as an ACK
+MESSAGE = struct.Struct("<BII")  # type, sequence number, payload length
+HELLO = struct.Struct("<H")  # tile size
+TILE = struct.Struct("<ii")  # ty, tx, followed by the zlib-compressed tile, empty if it was removed
+MSG_HELLO, MSG_RESET, MSG_TILE, MSG_END, MSG_ACK = range(1, 6)
+
+# sent-at times kept per viewer for working out latency from its acks
+MAX_UNACKED = 256
+
+
+def recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return bytes(data)
+
+
+def recv_message(sock):
+    kind, seq, length = MESSAGE.unpack(recv_exactly(sock, MESSAGE.size))
+    return kind, seq, recv_exactly(sock, length) if length else b""
+
+
+def encode_message(kind, seq, payload=b""):
+    return MESSAGE.pack(kind, seq, len(payload)) + payload
+
+
+class ClientStats:
+    def __init__(self):
+        self.connected_at = time.perf_counter()
+        self.bytes_sent = 0
+        self.updates = 0
+        self.tiles = 0
+        # tile versions replaced by a newer one before they were sent
+        self.coalesced = 0
+        self.latency = Histogram()
+
+    def snapshot(self):
+        elapsed = max(time.perf_counter() - self.connected_at, 1e-6)
+        latency = self.latency.snapshot()
+        return {
+            "bytes_sent": self.bytes_sent,
+            "kbps": self.bytes_sent * 8 / 1000 / elapsed,
+            "updates": self.updates,
+            "tiles": self.tiles,
+            "coalesced": self.coalesced,
+            "latency_mean_ms": latency["mean_ms"],
+            "latency_p95_ms": latency["p95_ms"],
+        }
+
+
+class StreamClient:
+    # one connected viewer. updates are merged into a pending dict keyed by tile,
+    # so however far behind a slow viewer falls it only ever holds the newest
+    # version of each tile, and only its own sender thread waits on its socket.
+    # at most window updates are sent ahead of the viewer's acks, so socket
+    # buffers don't hide a slow viewer and let its backlog grow stale
+    def __init__(self, sock, address, tile_size, window=STREAM_WINDOW):
+        self.sock = sock
+        self.address = f"{address[0]}:{address[1]}"
+        self.stats = ClientStats()
+        self.condition = threading.Condition()
+        self.pending = {}  # key -> compressed tile
+        self.pending_seq = None
+        self.reset = False
+        self.sent_at = {}  # seq -> perf_counter when the update was taken
+        self.window = window
+        self.unacked = []  # seqs sent and not acked yet, oldest first
+        self.closed = False
+        # set until the render thread has queued this viewer a full keyframe
+        self.needs_keyframe = True
+
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.sendall(encode_message(MSG_HELLO, 0, HELLO.pack(tile_size)))
+        self.sender = threading.Thread(target=self._send_loop, name=f"stream-send-{self.address}", daemon=True)
+        self.receiver = threading.Thread(target=self._receive_loop, name=f"stream-ack-{self.address}", daemon=True)
+
+    def start(self):
+        self.sender.start()
+        self.receiver.start()
+
+    def offer(self, seq, taken_at, tiles, keyframe=False):
+        with self.condition:
+            if keyframe:
+                # a keyframe holds everything, so nothing queued before it matters
+                self.pending = {}
+                self.reset = True
+            for key, data in tiles.items():
+                if key in self.pending:
+                    self.stats.coalesced += 1
+                self.pending[key] = data
+            self.pending_seq = seq
+            self.sent_at[seq] = taken_at
+            while len(self.sent_at) > MAX_UNACKED:
+                del self.sent_at[next(iter(self.sent_at))]
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def _send_loop(self):
+        try:
+            while True:
+                with self.condition:
+                    while not self.closed and (self.pending_seq is None or len(self.unacked) >= self.window):
+                        self.condition.wait()
+                    if self.closed:
+                        return
+                    tiles, seq, reset = self.pending, self.pending_seq, self.reset
+                    self.pending, self.pending_seq, self.reset = {}, None, False
+                    self.unacked.append(seq)
+
+                messages = [encode_message(MSG_RESET, seq)] if reset else []
+                for (ty, tx), data in tiles.items():
+                    messages.append(encode_message(MSG_TILE, seq, TILE.pack(ty, tx) + data))
+                messages.append(encode_message(MSG_END, seq))
+                data = b"".join(messages)
+                self.sock.sendall(data)
+
+                self.stats.bytes_sent += len(data)
+                self.stats.tiles += len(tiles)
+                self.stats.updates += 1
+                metrics.count("stream_bytes_sent", len(data))
+        except OSError:
+            self.closed = True
+
+    def _receive_loop(self):
+        try:
+            while not self.closed:
+                kind, seq, _ = recv_message(self.sock)
+                if kind != MSG_ACK:
+                    continue
+                with self.condition:
+                    taken_at = self.sent_at.pop(seq, None)
+                    # acks arrive in order, this one covers everything up to seq
+                    self.unacked = [sent for sent in self.unacked if sent > seq]
+                    self.condition.notify()
+                if taken_at is not None:
+                    latency_ms = (time.perf_counter() - taken_at) * 1000
+                    self.stats.latency.observe(latency_ms)
+                    metrics.observe("stream_latency", latency_ms)
+        except (OSError, ConnectionError, struct.error):
+            with self.condition:
+                self.closed = True
+                self.condition.notify()
+
+
+class StreamServer:
+    # mirrors the canvas to viewers over TCP. publish() runs on the render thread
+    # once per frame, at most fps times a second it copies the tiles changed
+    # since last time and hands them to an encoder thread, which compresses them
+    # once and offers them to every viewer. the whole canvas for viewers joining
+    # is gathered keyframe_tiles at a time over several updates
+    def __init__(self, canvas, host=STREAM_HOST, port=STREAM_PORT, fps=STREAM_FPS, level=STREAM_COMPRESSION,
+                 keyframe_tiles=STREAM_KEYFRAME_TILES):
+        self.canvas = canvas
+        self.host = host
+        self.port = port
+        self.interval = 1.0 / fps
+        self.level = level
+        self.keyframe_tiles = keyframe_tiles
+
+        # the keyframe being gathered: key -> flattened tile copied so far, the
+        # keys still to copy, and the viewers waiting on it
+        self.keyframe = None
+        self.keyframe_keys = []
+        self.keyframe_clients = []
+
+        self.clients = []
+        self.lock = threading.Lock()
+        self.updates = queue.SimpleQueue()
+        self.seq = 0
+        self.last_publish = 0.0
+        self.stop_event = threading.Event()
+        self.sock = None
+
+    def start(self):
+        self.sock = socket.create_server((self.host, self.port))
+        # the real port when 0 asked for any free one
+        self.port = self.sock.getsockname()[1]
+        self.sock.settimeout(STAGE_TIMEOUT)
+        threading.Thread(target=self._accept_loop, name="stream-accept", daemon=True).start()
+        threading.Thread(target=self._encode_loop, name="stream-encode", daemon=True).start()
+        print(f"Streaming canvas on {self.host}:{self.port}")
+
+    def publish(self):
+        now = time.perf_counter()
+        if now - self.last_publish < self.interval:
+            return
+        self.last_publish = now
+
+        canvas = self.canvas
+        keys = canvas.pop_dirty_tiles("stream")
+        with self.lock:
+            self.clients = [client for client in self.clients if not client.closed]
+            clients = list(self.clients)
+        if not clients:
+            self.keyframe = None
+            self.keyframe_clients = []
+            return
+
+        joining = [client for client in clients if client.needs_keyframe and client not in self.keyframe_clients]
+        if joining:
+            if self.keyframe is None:
+                self.keyframe = {}
+                self.keyframe_keys = list(canvas.layers.keys())
+            self.keyframe_clients.extend(joining)
+        if not keys and self.keyframe is None:
+            return
+
+        # copies of the flattened layers, since the canvas carries on changing
+        # while these are encoded. a tile that's gone is sent empty so viewers drop it
+        tiles = {}
+        for key in keys:
+            tile = canvas.layers.tile(key)
+            tiles[key] = None if tile is None else tile.buffer.copy()
+
+        keyframe, ready = None, []
+        if self.keyframe is not None:
+            # tiles that change while the keyframe is gathered go in as they
+            # are now, so it's up to date when the last chunk is copied
+            self.keyframe.update(tiles)
+            copied = 0
+            while self.keyframe_keys and copied < self.keyframe_tiles:
+                key = self.keyframe_keys.pop()
+                if key in self.keyframe:
+                    continue
+                tile = canvas.layers.tile(key)
+                self.keyframe[key] = None if tile is None else tile.buffer.copy()
+                copied += 1
+            if not self.keyframe_keys:
+                keyframe = {key: buffer for key, buffer in self.keyframe.items() if buffer is not None}
+                ready = [client for client in self.keyframe_clients if not client.closed]
+                for client in ready:
+                    client.needs_keyframe = False
+                self.keyframe = None
+                self.keyframe_clients = []
+        if not tiles and keyframe is None:
+            return
+
+        self.seq += 1
+        self.updates.put((self.seq, now, tiles, keyframe, ready))
+
+    def _encode_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                seq, taken_at, tiles, keyframe, joining = self.updates.get(timeout=STAGE_TIMEOUT)
+            except queue.Empty:
+                continue
+
+            with metrics.timer("stream_encode"):
+                delta = self._compress(tiles)
+                full = self._compress(keyframe) if keyframe is not None else None
+            with self.lock:
+                clients = list(self.clients)
+            for client in clients:
+                if client in joining:
+                    client.offer(seq, taken_at, full, keyframe=True)
+                elif delta and not client.needs_keyframe:
+                    client.offer(seq, taken_at, delta)
+
+    def _compress(self, tiles):
+        return {
+            key: b"" if buffer is None else zlib.compress(buffer.tobytes(), self.level)
+            for key, buffer in tiles.items()
+        }
+
+    def _accept_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                sock, address = self.sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            try:
+                client = StreamClient(sock, address, self.canvas.layers.tile_size)
+            except OSError:
+                sock.close()
+                continue
+            client.start()
+            with self.lock:
+                self.clients.append(client)
+            print(f"Viewer connected: {client.address}")
+
+    def stats(self):
+        with self.lock:
+            return {client.address: client.stats.snapshot() for client in self.clients}
+
+    def report(self):
+        lines = [f"{'viewer':<22}{'kbps':>10}{'updates':>9}{'tiles':>8}{'merged':>8}{'mean ms':>9}{'p95 ms':>8}"]
+        for address, stats in self.stats().items():
+            lines.append(
+                f"{address:<22}{stats['kbps']:>10.1f}{stats['updates']:>9}{stats['tiles']:>8}"
+                f"{stats['coalesced']:>8}{stats['latency_mean_ms']:>9.1f}{stats['latency_p95_ms']:>8.0f}"
+            )
+        return "\n".join(lines)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.sock is not None:
+            self.sock.close()
+        with self.lock:
+            for client in self.clients:
+                client.close()
+
+
+class StreamViewer(threading.Thread):
+    # a viewer that rebuilds the canvas from the stream. used by the viewer
+    # window below, and as a stand-in client when testing the server. delay
+    # holds each update back to act like a slow connection
+    def __init__(self, host=STREAM_HOST, port=STREAM_PORT, delay=0.0, name="viewer"):
+        super().__init__(name=name, daemon=True)
+        self.sock = socket.create_connection((host, port))
+        self.delay = delay
+        self.tile_size = None
+        self.tiles = {}
+        self.lock = threading.Lock()
+        self.updates = 0
+        self.bytes_received = 0
+        self.closed = False
+
+    def run(self):
+        try:
+            while True:
+                kind, seq, payload = recv_message(self.sock)
+                self.bytes_received += MESSAGE.size + len(payload)
+                if kind == MSG_HELLO:
+                    self.tile_size, = HELLO.unpack(payload)
+                elif kind == MSG_RESET:
+                    with self.lock:
+                        self.tiles = {}
+                elif kind == MSG_TILE:
+                    self._apply_tile(payload)
+                elif kind == MSG_END:
+                    if self.delay:
+                        time.sleep(self.delay)
+                    self.sock.sendall(encode_message(MSG_ACK, seq))
+                    self.updates += 1
+        except (OSError, ConnectionError):
+            self.closed = True
+
+    def _apply_tile(self, payload):
+        ty, tx = TILE.unpack_from(payload)
+        data = payload[TILE.size:]
+        with self.lock:
+            if data:
+                self.tiles[(ty, tx)] = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+            else:
+                self.tiles.pop((ty, tx), None)
+
+    def render(self):
+        # the received tiles as one BGR image covering all of them. the colour is
+        # premultiplied, so on its own it is the drawing over black
+        with self.lock:
+            tiles = dict(self.tiles)
+        if not tiles or self.tile_size is None:
+            return None
+
+        size = self.tile_size
+        ty0 = min(ty for ty, _ in tiles)
+        tx0 = min(tx for _, tx in tiles)
+        ty1 = max(ty for ty, _ in tiles) + 1
+        tx1 = max(tx for _, tx in tiles) + 1
+        image = np.zeros(((ty1 - ty0) * size, (tx1 - tx0) * size, 3), dtype=np.uint8)
+        for (ty, tx), buffer in tiles.items():
+            y, x = (ty - ty0) * size, (tx - tx0) * size
+            image[y:y + size, x:x + size] = buffer[:size * size * 3].reshape(size, size, 3)
+        return image
+
+    def matches(self, canvas):
+        # True once the received tiles are exactly the canvas's flattened tiles
+        expected = {}
+        for key in canvas.layers.keys():
+            tile = canvas.layers.tile(key)
+            if tile is not None:
+                expected[key] = tile.buffer
+        with self.lock:
+            tiles = dict(self.tiles)
+        return tiles.keys() == expected.keys() and all(
+            np.array_equal(tiles[key], buffer) for key, buffer in expected.items()
+        )
+
+    def close(self):
+        self.sock.close()
+
+
+def view(host, port):
+    viewer = StreamViewer(host, port)
+    viewer.start()
+    while not viewer.closed:
+        image = viewer.render()
+        if image is not None:
+            cv2.imshow("AirCanvas viewer", image)
+        if cv2.waitKey(30) & 0xFF == ord("q"):
+            break
+    viewer.close()
+    cv2.destroyAllWindows()
+
+
+def demo(viewers, slow, delay, seconds):
+    # a synthetic drawing session streamed to local stand-in viewers, some of
+    # them slowed down, then the per-viewer report
+    from drawing import DrawingCanvas
+
+    canvas = DrawingCanvas(CAMERA_WIDTH, CAMERA_HEIGHT)
+    server = StreamServer(canvas, host="127.0.0.1", port=0)
+    server.start()
+    clients = [
+        StreamViewer("127.0.0.1", server.port, delay=delay if i < slow else 0.0, name=f"viewer-{i}")
+        for i in range(viewers)
+    ]
+    for client in clients:
+        client.start()
+
+    frame_interval = 1.0 / CAMERA_FPS
+    start = time.perf_counter()
+    frames = 0
+    while time.perf_counter() - start < seconds:
+        # a finger moving in a slowly growing spiral, restarting every second
+        t = frames * frame_interval
+        if frames % CAMERA_FPS == 0:
+            canvas.stop_drawing()
+            canvas.start_drawing((CAMERA_WIDTH // 2, CAMERA_HEIGHT // 2))
+        radius = 50 + 20 * t
+        canvas.draw((int(CAMERA_WIDTH / 2 + radius * np.cos(4 * t)), int(CAMERA_HEIGHT / 2 + radius * np.sin(4 * t))))
+        server.publish()
+        frames += 1
+        time.sleep(max(0.0, start + frames * frame_interval - time.perf_counter()))
+
+    # end the last stroke and publish it, past the rate limit, then give the
+    # viewers a while to catch up, slow ones with merged updates
+    canvas.stop_drawing()
+    time.sleep(server.interval)
+    server.publish()
+    deadline = time.perf_counter() + 1.0 + delay * STREAM_WINDOW
+    while time.perf_counter() < deadline and not all(client.matches(canvas) for client in clients):
+        time.sleep(0.05)
+
+    print(server.report())
+    for client in clients:
+        print(f"{client.name}: {client.updates} updates, {client.bytes_received / 1024:.0f} KB,"
+              f" canvas matches: {client.matches(canvas)}")
+    server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="View a streamed AirCanvas, or try the stream server locally")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    view_parser = subparsers.add_parser("view", help="open a window showing a streamed canvas")
+    view_parser.add_argument("--host", default=STREAM_HOST)
+    view_parser.add_argument("--port", type=int, default=STREAM_PORT)
+
+    demo_parser = subparsers.add_parser("demo", help="stream a synthetic drawing to local stand-in viewers")
+    demo_parser.add_argument("--viewers", type=int, default=3)
+    demo_parser.add_argument("--slow", type=int, default=1, help="how many of the viewers are slow")
+    demo_parser.add_argument("--delay", type=float, default=0.2, help="seconds a slow viewer takes per update")
+    demo_parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    if args.command == "view":
+        view(args.host, args.port)
+    else:
+        demo(args.viewers, args.slow, args.delay, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
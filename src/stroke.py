@@ -0,0 +1,65 @@
+import numpy as np
+
+
+def spline_path(points, first=0, last=None, step=4.0, max_samples=64):
+    # samples of a centripetal Catmull-Rom spline through (N, 2) control points,
+    # covering segments first..last-1 (segment i runs points[i] -> points[i + 1]).
+    # the centripetal form doesn't overshoot or loop when the spacing between
+    # points jumps, as it does when a hand speeds up. neighbours missing at either
+    # end are mirrored. returns (M, 2) int32 pixel coordinates
+    points = np.asarray(points, dtype=np.float32)
+    last = len(points) - 1 if last is None else last
+    segments = np.arange(first, last)
+    if len(segments) == 0:
+        return np.empty((0, 2), dtype=np.int32)
+
+    p1 = points[segments]
+    p2 = points[segments + 1]
+    p0 = np.where((segments > 0)[:, None], points[np.maximum(segments - 1, 0)], 2 * p1 - p2)
+    has_next = (segments + 2 < len(points))[:, None]
+    p3 = np.where(has_next, points[np.minimum(segments + 2, len(points) - 1)], 2 * p2 - p1)
+
+    # knot spacing is the square root of the chord length
+    eps = 1e-3
+    d01 = np.sqrt(np.linalg.norm(p1 - p0, axis=1)) + eps
+    d12 = np.sqrt(np.linalg.norm(p2 - p1, axis=1)) + eps
+    d23 = np.sqrt(np.linalg.norm(p3 - p2, axis=1)) + eps
+
+    # more samples on longer segments, so fast strokes stay round
+    counts = np.clip(np.ceil(np.linalg.norm(p2 - p1, axis=1) / step), 1, max_samples).astype(np.int64)
+    index = np.repeat(np.arange(len(segments)), counts)
+    starts = np.cumsum(counts) - counts
+    u = ((np.arange(len(index)) - starts[index]) / counts[index])[:, None].astype(np.float32)
+
+    p0, p1, p2, p3 = p0[index], p1[index], p2[index], p3[index]
+    t0 = np.zeros_like(u)
+    t1 = d01[index, None]
+    t2 = t1 + d12[index, None]
+    t3 = t2 + d23[index, None]
+    t = t1 + u * (t2 - t1)
+
+    # Barry-Goldman pyramid
+    a1 = ((t1 - t) * p0 + (t - t0) * p1) / (t1 - t0)
+    a2 = ((t2 - t) * p1 + (t - t1) * p2) / (t2 - t1)
+    a3 = ((t3 - t) * p2 + (t - t2) * p3) / (t3 - t2)
+    b1 = ((t2 - t) * a1 + (t - t0) * a2) / (t2 - t0)
+    b2 = ((t3 - t) * a2 + (t - t1) * a3) / (t3 - t1)
+    curve = ((t2 - t) * b1 + (t - t1) * b2) / (t2 - t1)
+
+    # finish exactly on the last control point
+    path = np.vstack([curve, points[last][None]])
+    return np.rint(path).astype(np.int32)
+
+
+def path_chunks(path, thickness, chunk=32):
+    # split a path into short overlapping runs, each with the bounding box of the
+    # pixels it covers, so only the tiles a long stroke actually crosses get
+    # drawn into and saved for undo
+    r = thickness // 2 + 2
+    chunks = []
+    for start in range(0, max(len(path) - 1, 1), chunk):
+        part = path[start:start + chunk + 1]
+        x0, y0 = part.min(axis=0)
+        x1, y1 = part.max(axis=0)
+        chunks.append(((int(x0) - r, int(y0) - r, int(x1) + r + 1, int(y1) + r + 1), part))
+    return chunks
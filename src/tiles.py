@@ -0,0 +1,190 @@
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+from metrics import metrics
+
+
+class Tile:
+    # one square of the canvas. colour and coverage mask are views into a single
+    # buffer, so a tile moves to and from the spill file as one block
+    def __init__(self, size, buffer=None):
+        self.buffer = np.zeros(size * size * 4, dtype=np.uint8) if buffer is None else buffer
+        self.colour = self.buffer[:size * size * 3].reshape(size, size, 3)
+        self.mask = self.buffer[size * size * 3:].reshape(size, size)
+        # slot in the spill file, and whether it has changed since written there
+        self.slot = None
+        self.dirty = True
+
+
+class TileStore:
+    # sparse, unbounded canvas storage. tiles only exist where there is ink, the
+    # most recently used ones stay in memory and the rest are spilled to a
+    # memory-mapped scratch file, so memory follows what's on screen rather than
+    # the size of the drawing. keys are (ty, tx) and may be negative
+    def __init__(self, tile_size=256, cache_tiles=256, spill_dir=None):
+        self.tile_size = tile_size
+        self.cache_tiles = cache_tiles
+        self.spill_dir = spill_dir
+
+        self.hot = OrderedDict()  # key -> Tile, least recently used first
+        self.cold = {}  # key -> slot in the spill file
+        self.free_slots = []
+
+        self.spill_file = None
+        self.spill = None
+        self.capacity = 0
+
+    def __contains__(self, key):
+        return key in self.hot or key in self.cold
+
+    def __len__(self):
+        return len(self.hot) + len(self.cold)
+
+    def keys(self):
+        return list(self.hot) + list(self.cold)
+
+    def get(self, key, create=False):
+        # the tile at key, loaded back from disk if it was spilled. None if
+        # there's no ink there, unless create is set
+        tile = self.hot.get(key)
+        if tile is not None:
+            self.hot.move_to_end(key)
+            return tile
+
+        slot = self.cold.pop(key, None)
+        if slot is not None:
+            tile = Tile(self.tile_size, np.array(self.spill[slot]))
+            tile.slot = slot
+            tile.dirty = False
+            metrics.count("canvas_tiles_loaded")
+        elif create:
+            tile = Tile(self.tile_size)
+        else:
+            return None
+
+        self.hot[key] = tile
+        self._evict()
+        return tile
+
+    def drop(self, key):
+        tile = self.hot.pop(key, None)
+        slot = tile.slot if tile is not None else self.cold.pop(key, None)
+        if slot is not None:
+            self.free_slots.append(slot)
+
+    def clear(self):
+        self.hot.clear()
+        self.cold.clear()
+        self.free_slots = list(range(self.capacity))
+
+    def export(self, keys=None):
+        # copies of every tile's buffer, or of those in keys that exist. spilled
+        # ones are read straight from the file so the in-memory set is left as it is
+        if keys is None:
+            tiles = {key: tile.buffer.copy() for key, tile in self.hot.items()}
+            tiles.update((key, np.array(self.spill[slot])) for key, slot in self.cold.items())
+            return tiles
+
+        tiles = {}
+        for key in keys:
+            if key in self.hot:
+                tiles[key] = self.hot[key].buffer.copy()
+            elif key in self.cold:
+                tiles[key] = np.array(self.spill[self.cold[key]])
+        return tiles
+
+    def load(self, key, buffer):
+        tile = self.get(key, create=True)
+        tile.buffer[:] = buffer
+        tile.dirty = True
+
+    def tile_rect(self, key):
+        ty, tx = key
+        size = self.tile_size
+        return (tx * size, ty * size, (tx + 1) * size, (ty + 1) * size)
+
+    def keys_in(self, rect):
+        # keys of every tile position overlapping rect, whether inked or not
+        x0, y0, x1, y1 = rect
+        size = self.tile_size
+        return [
+            (ty, tx)
+            for ty in range(y0 // size, (y1 - 1) // size + 1)
+            for tx in range(x0 // size, (x1 - 1) // size + 1)
+        ]
+
+    def read(self, rect, pixels=None, mask=None):
+        # dense copy of a canvas rectangle, blank where there are no tiles
+        x0, y0, x1, y1 = rect
+        if pixels is None:
+            pixels = np.zeros((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+            mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        else:
+            pixels[:] = 0
+            mask[:] = 0
+
+        for key in self.keys_in(rect):
+            if key not in self:
+                continue
+            tile = self.get(key)
+            (sx, sy, dx, dy), (w, h) = self.overlap(key, rect)
+            pixels[dy:dy + h, dx:dx + w] = tile.colour[sy:sy + h, sx:sx + w]
+            mask[dy:dy + h, dx:dx + w] = tile.mask[sy:sy + h, sx:sx + w]
+        return pixels, mask
+
+    def write(self, rect, pixels, mask):
+        # copy a dense rectangle back in, e.g. when undo restores it. tiles are
+        # created only for ink and dropped again once they're blank
+        for key in self.keys_in(rect):
+            (sx, sy, dx, dy), (w, h) = self.overlap(key, rect)
+            region = mask[dy:dy + h, dx:dx + w]
+            tile = self.get(key, create=bool(region.any()))
+            if tile is None:
+                continue
+            tile.colour[sy:sy + h, sx:sx + w] = pixels[dy:dy + h, dx:dx + w]
+            tile.mask[sy:sy + h, sx:sx + w] = region
+            tile.dirty = True
+            if not tile.mask.any():
+                self.drop(key)
+
+    def overlap(self, key, rect):
+        # offsets of the overlap of a tile and rect, inside each, and its size
+        tx0, ty0, tx1, ty1 = self.tile_rect(key)
+        x0, y0, x1, y1 = rect
+        ox0, oy0 = max(tx0, x0), max(ty0, y0)
+        ox1, oy1 = min(tx1, x1), min(ty1, y1)
+        return (ox0 - tx0, oy0 - ty0, ox0 - x0, oy0 - y0), (ox1 - ox0, oy1 - oy0)
+
+    def _evict(self):
+        while len(self.hot) > self.cache_tiles:
+            key, tile = self.hot.popitem(last=False)
+            if tile.slot is None:
+                tile.slot = self._allocate_slot()
+            if tile.dirty:
+                self.spill[tile.slot] = tile.buffer
+            self.cold[key] = tile.slot
+            metrics.count("canvas_tiles_spilled")
+
+    def _allocate_slot(self):
+        if not self.free_slots:
+            self._grow()
+        return self.free_slots.pop()
+
+    def _grow(self):
+        # double the spill file. the old mapping is simply replaced, nothing
+        # in memory holds a view into it
+        tile_bytes = self.tile_size * self.tile_size * 4
+        capacity = max(self.capacity * 2, self.cache_tiles)
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(prefix="aircanvas-tiles-", dir=self.spill_dir)
+        self.spill_file.truncate(capacity * tile_bytes)
+        self.spill = np.memmap(self.spill_file, dtype=np.uint8, mode="r+", shape=(capacity, tile_bytes))
+        self.free_slots.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+
+    def close(self):
+        self.spill = None
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
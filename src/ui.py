@@ -1,5 +1,50 @@
 import cv2
+import numpy as np
 from colours import Colours
+from layers import over
+
+
+class OverlayRegion:
+    # a pre-rendered BGRA patch of the overlay. drawing onto the cleared layer
+    # leaves its colour premultiplied, so anti-aliased edges are blended onto
+    # the frame. patches with only hard edges are blitted with one masked copy
+    def __init__(self, x, y, width, height):
+        self.x = x
+        self.y = y
+        self.layer = np.zeros((height, width, 4), dtype=np.uint8)
+        self.colour = None
+        self.mask = None
+        self.soft = False
+        # scratch for blending
+        self.inverse = np.zeros((height, width), dtype=np.uint8)
+        self.inverse3 = np.zeros((height, width, 3), dtype=np.uint8)
+
+    def begin(self):
+        self.layer[:] = 0
+        return self.layer
+
+    def finish(self):
+        # split once here so blit doesn't have to every frame
+        self.colour = np.ascontiguousarray(self.layer[:, :, :3])
+        self.mask = np.ascontiguousarray(self.layer[:, :, 3])
+        self.soft = bool(np.any((self.mask > 0) & (self.mask < 255)))
+
+    def blit(self, frame):
+        height, width = self.mask.shape
+        frame_height, frame_width = frame.shape[:2]
+        x0, y0 = max(self.x, 0), max(self.y, 0)
+        x1, y1 = min(self.x + width, frame_width), min(self.y + height, frame_height)
+        if x0 >= x1 or y0 >= y1:
+            return
+
+        sx, sy = x0 - self.x, y0 - self.y
+        w, h = x1 - x0, y1 - y0
+        colour = self.colour[sy:sy + h, sx:sx + w]
+        mask = self.mask[sy:sy + h, sx:sx + w]
+        if self.soft:
+            over(colour, mask, frame[y0:y1, x0:x1], None, self.inverse[:h, :w], self.inverse3[:h, :w])
+        else:
+            cv2.copyTo(colour, mask, frame[y0:y1, x0:x1])
 
 
 class UIManager:
@@ -9,7 +54,9 @@ class UIManager:
 
         self.box_size = 120
         self.margin = 20
-        self.selected_colour = Colours.RED.name
+        # selected colour per hand id, hands without one use the default
+        self.default_colour = Colours.RED.name
+        self.selected_colours = {}
 
         # Create colour boxes
         self.colour_boxes = {}
@@ -25,6 +72,18 @@ class UIManager:
             )
             y_pos += self.box_size + self.margin
 
+        # cached overlay, re-rendered only when the selected colour or a text value changes
+        outline = 5  # selection outline sits 3px outside a box and is 2px thick
+        self.palette_region = OverlayRegion(
+            x_pos - outline,
+            self.margin - outline,
+            self.box_size + 2 * outline,
+            y_pos - self.margin - self.margin + 2 * outline,
+        )
+        self.indicator_region = OverlayRegion(8, 8, 45, 45)
+        self.palette_dirty = True
+        self.text_cache = {}
+
     def draw_box(self, frame, colour_name, x, y, w, h):
         cv2.rectangle(frame, (x, y), (x + w, y + h), Colours[colour_name].value, -1)
 
@@ -47,26 +106,107 @@ class UIManager:
         (x, y, w, h) = box
         cv2.rectangle(frame, (x - 3, y - 3), (x + w + 3, y + h + 3), (255, 255, 255), 2)
 
-    def draw(self, frame, last_audio_command: str):
-        # Draw colour boxes
+    def draw_cached_text(
+        self, frame, key, text, x, y, font_scale=1, color=(255, 255, 255), thickness=2
+    ):
+        # text is only rasterised again when something about it changes
+        params = (text, x, y, font_scale, color, thickness)
+        cached = self.text_cache.get(key)
+        if cached is None or cached[0] != params:
+            cached = (params, self._render_text(*params))
+            self.text_cache[key] = cached
+        cached[1].blit(frame)
+
+    def _render_text(self, text, x, y, font_scale, color, thickness):
+        (text_w, text_h), baseline = cv2.getTextSize(
+            text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness
+        )
+        pad = thickness + 1
+        region = OverlayRegion(
+            x - pad, y - text_h - pad, text_w + 2 * pad, text_h + baseline + 2 * pad
+        )
+        cv2.putText(
+            region.begin(),
+            text,
+            (pad, text_h + pad),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            font_scale,
+            tuple(color) + (255,),
+            thickness,
+            cv2.LINE_AA,
+            False,
+        )
+        region.finish()
+        return region
+
+    def _render_palette(self):
+        region = self.palette_region
+        layer = region.begin()
         for colour_name, (x, y, w, h) in self.colour_boxes.items():
-            self.draw_box(frame, colour_name, x, y, w, h)
+            x, y = x - region.x, y - region.y
+            cv2.rectangle(layer, (x, y), (x + w, y + h), Colours[colour_name].value + (255,), -1)
 
-        self.draw_selected_colour(frame, self.colour_boxes[self.selected_colour])
+        # outline every colour some hand has selected
+        for colour_name in set(self.selected_colours.values()) | {self.selected_colour}:
+            (x, y, w, h) = self.colour_boxes[colour_name]
+            x, y = x - region.x, y - region.y
+            cv2.rectangle(layer, (x - 3, y - 3), (x + w + 3, y + h + 3), (255, 255, 255, 255), 2)
+        region.finish()
 
-        # Draw current colour indicator
+        # Current colour indicator
+        region = self.indicator_region
+        layer = region.begin()
+        x, y = 10 - region.x, 10 - region.y
         cv2.rectangle(
-            frame, (10, 10), (50, 50), Colours[self.selected_colour].value, -1
+            layer, (x, y), (x + 40, y + 40), Colours[self.selected_colour].value + (255,), -1
         )
-        cv2.rectangle(frame, (10, 10), (50, 50), (255, 255, 255), 2)
-        self.draw_text(frame, f"Last audio command: {last_audio_command}", x=60, y=40)
+        cv2.rectangle(layer, (x, y), (x + 40, y + 40), (255, 255, 255, 255), 2)
+        region.finish()
+
+        self.palette_dirty = False
+
+    def draw(self, frame, last_audio_command: str):
+        if self.palette_dirty:
+            self._render_palette()
+
+        self.palette_region.blit(frame)
+        self.indicator_region.blit(frame)
+        self.draw_cached_text(frame, "audio", f"Last audio command: {last_audio_command}", x=60, y=40)
+
+    def draw_debug(self, frame, gesture: str, tool):
+        self.draw_cached_text(frame, "gesture", f"Gesture: {gesture}", 10, self.height - 60, font_scale=0.6)
+        self.draw_cached_text(frame, "tool", f"Tool: {tool}", 10, self.height - 30, font_scale=0.6)
+
+    def draw_hud(self, frame, text):
+        self.draw_cached_text(frame, "hud", text, 10, 90, font_scale=0.6)
 
-    def handle_selection(self, point):
+    def draw_quality(self, frame, text):
+        self.draw_cached_text(frame, "quality", text, 10, self.height - 90, font_scale=0.6)
+
+    @property
+    def selected_colour(self):
+        # the primary hand's colour
+        return self.selected_colours.get(0, self.default_colour)
+
+    def handle_selection(self, point, hand_id=0):
         for colour_name, (x, y, w, h) in self.colour_boxes.items():
             if (x <= point[0] <= x + w) and (y <= point[1] <= y + h):
-                self.selected_colour = colour_name
+                self.set_colour(colour_name, hand_id)
                 return True, colour_name
         return False, None
 
-    def set_colour(self, colour_name):
-        self.selected_colour = colour_name
+    def set_colour(self, colour_name, hand_id=None):
+        # hand_id None sets every hand and the default
+        if hand_id is None:
+            changed = colour_name != self.default_colour or any(
+                c != colour_name for c in self.selected_colours.values()
+            )
+            self.default_colour = colour_name
+            for key in self.selected_colours:
+                self.selected_colours[key] = colour_name
+        else:
+            changed = colour_name != self.selected_colours.get(hand_id, self.default_colour)
+            self.selected_colours[hand_id] = colour_name
+
+        if changed:
+            self.palette_dirty = True
@@ -0,0 +1,122 @@
+import threading
+import time
+from contextlib import nullcontext
+
+import speech_recognition as sr
+from config import *
+from commands import CommandBus, CommandEvent
+
+
+class GoogleBackend:
+    # online, open vocabulary, needs a network round trip per phrase
+    name = "google"
+
+    def __init__(self, language="en-US"):
+        self.language = language
+
+    def recognise(self, recognizer, audio):
+        return recognizer.recognize_google(audio, language=self.language)
+
+
+class KeywordBackend:
+    # offline keyword spotter (pocketsphinx) constrained to the registered phrases
+    name = "keywords"
+
+    def __init__(self, phrases, sensitivity=KEYWORD_SENSITIVITY):
+        self.keyword_entries = [(phrase, sensitivity) for phrase in phrases]
+
+    def recognise(self, recognizer, audio):
+        return recognizer.recognize_sphinx(audio, keyword_entries=self.keyword_entries)
+
+
+def create_backend(name, phrases):
+    if name == "google":
+        return GoogleBackend()
+    if name == "keywords":
+        return KeywordBackend(phrases)
+    raise ValueError(f"Unknown voice backend: {name}")
+
+
+class VoiceListener(threading.Thread):
+    def __init__(self, bus: CommandBus, backend, source=None, startup=None):
+        super().__init__(name="voice", daemon=True)
+        self.bus = bus
+        self.backend = backend
+        self.source = source
+        # optional StartupTimings that the microphone calibration is reported to
+        self.startup = startup
+        # set once the microphone is calibrated and listening
+        self.ready = threading.Event()
+        # set once it's listening or has failed to, error says why it stopped
+        self.settled = threading.Event()
+        self.error = None
+        self.recognizer = sr.Recognizer()
+        self.stop_event = threading.Event()
+
+    def run(self):
+        try:
+            self._listen()
+        except Exception as e:
+            # no microphone or no PyAudio, drawing carries on without voice
+            self.error = e
+            print(f"Voice commands unavailable: {e}")
+        finally:
+            self.settled.set()
+
+    def _listen(self):
+        microphone = self.source or sr.Microphone()
+
+        with microphone as source:
+            print(f"Energy threshold: {self.recognizer.energy_threshold}")
+            with self.startup.phase("audio calibration") if self.startup else nullcontext():
+                self.recognizer.adjust_for_ambient_noise(source)
+            self.ready.set()
+            self.settled.set()
+
+            while not self.stop_event.is_set():
+                try:
+                    print("Waiting audio command ...")
+                    audio = self.recognizer.listen(
+                        source, timeout=VOICE_LISTEN_TIMEOUT, phrase_time_limit=VOICE_PHRASE_TIME_LIMIT
+                    )
+                    self.recognise(audio)
+                except sr.WaitTimeoutError:
+                    pass  # Timeout without audio
+
+    def recognise(self, audio, source="voice"):
+        heard_at = time.perf_counter()
+        self.bus.recognising.set()
+        try:
+            text = self.backend.recognise(self.recognizer, audio)
+        except sr.UnknownValueError:
+            print("It was not possible to understand what you said.")
+            return
+        except sr.RequestError as e:
+            print(f"Error recognizing what was said: {e}")
+            return
+        finally:
+            self.bus.recognising.clear()
+
+        print(f"You said: {text}")
+        self.bus.publish(CommandEvent(text, source, heard_at=heard_at, recognised_at=time.perf_counter()))
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class WavFileListener(VoiceListener):
+    # stand-in for the microphone: runs recorded WAV files through the backend,
+    # so commands can be exercised without audio hardware
+    def __init__(self, bus: CommandBus, backend, paths, interval=0.0):
+        super().__init__(bus, backend)
+        self.paths = list(paths)
+        self.interval = interval
+
+    def run(self):
+        for path in self.paths:
+            if self.stop_event.is_set():
+                break
+            with sr.AudioFile(path) as source:
+                audio = self.recognizer.record(source)
+            self.recognise(audio, source=path)
+            time.sleep(self.interval)
@@ -0,0 +1,101 @@
+import os
+
+import numpy as np
+from autosave import Autosave, read_log
+from drawing import DrawingCanvas, Tools
+
+RECT = (0, 0, 512, 512)
+
+
+def journaled_canvas(directory):
+    canvas = DrawingCanvas(512, 512)
+    autosave = Autosave(directory=directory)
+    autosave.restore(canvas)
+    canvas.journal = autosave
+    autosave.start()
+    return canvas, autosave
+
+
+def stroke(canvas, y, hand_id=0):
+    canvas.start_drawing((20, y), hand_id)
+    for x in range(20, 400, 20):
+        canvas.draw((x, y + x // 8), hand_id)
+    canvas.stop_drawing(hand_id)
+
+
+def restored(directory):
+    canvas = DrawingCanvas(512, 512)
+    replayed = Autosave(directory=directory).restore(canvas)
+    return canvas, replayed
+
+
+def assert_same_drawing(canvas, expected):
+    assert len(canvas.layers) == len(expected.layers)
+    assert canvas.layers.active == expected.layers.active
+    for index in range(len(expected.layers)):
+        pixels, mask = canvas.read(RECT, index)
+        expected_pixels, expected_mask = expected.read(RECT, index)
+        assert np.array_equal(pixels, expected_pixels)
+        assert np.array_equal(mask, expected_mask)
+
+
+def test_torn_record_at_the_end_of_the_log_is_dropped(tmp_path):
+    canvas, autosave = journaled_canvas(tmp_path)
+    stroke(canvas, 100)
+    autosave.close()
+
+    # a crash part way through writing the next record
+    log_path = os.path.join(tmp_path, "canvas.log")
+    _, _, records, _ = read_log(log_path)
+    with open(log_path, "ab") as f:
+        f.write(b"\x01\x40\x00\x00\x00torn")
+
+    canvas_after, replayed = restored(tmp_path)
+    assert replayed == len(records)
+    assert_same_drawing(canvas_after, canvas)
+
+    # the next session cuts the torn record off before appending to the log
+    canvas_next, autosave = journaled_canvas(tmp_path)
+    stroke(canvas_next, 300)
+    autosave.close()
+    _, _, records_next, _ = read_log(log_path)
+    assert len(records_next) > len(records)
+    assert_same_drawing(restored(tmp_path)[0], canvas_next)
+
+
+def test_log_written_after_the_last_snapshot_is_replayed(tmp_path):
+    canvas, autosave = journaled_canvas(tmp_path)
+    stroke(canvas, 100)
+    autosave.snapshot(canvas)
+    stroke(canvas, 250)
+    canvas.set_colour("BLUE")
+    stroke(canvas, 400)
+    autosave.close()
+
+    canvas_after, replayed = restored(tmp_path)
+    assert replayed > 0
+    assert canvas_after.default_colour_name == "BLUE"
+    assert_same_drawing(canvas_after, canvas)
+
+
+def test_layers_eraser_and_undo_are_restored(tmp_path):
+    canvas, autosave = journaled_canvas(tmp_path)
+    stroke(canvas, 100)
+    canvas.add_layer("sketch")
+    stroke(canvas, 120)
+    canvas.set_layer_opacity(0.5)
+    autosave.snapshot(canvas)
+
+    canvas.select_layer(0)
+    canvas.set_tool(Tools.ERASER)
+    stroke(canvas, 110)
+    canvas.set_tool(Tools.PEN)
+    stroke(canvas, 300)
+    canvas.undo()
+    autosave.close()
+
+    canvas_after, _ = restored(tmp_path)
+    assert_same_drawing(canvas_after, canvas)
+    assert canvas_after.layers[1].name == "sketch"
+    assert canvas_after.layers[1].opacity == canvas.layers[1].opacity
+    assert np.array_equal(canvas_after.render(), canvas.render())
@@ -0,0 +1,30 @@
+from commands import CommandBus, CommandEvent, CommandRegistry
+
+
+def registry_recording_calls():
+    registry = CommandRegistry()
+    calls = []
+    for phrase in ("red", "redo", "start", "start recording"):
+        registry.register(phrase, lambda event, phrase=phrase: calls.append((phrase, event.text)))
+    return registry, calls
+
+
+def test_phrase_on_the_bus_dispatches_its_action():
+    registry, calls = registry_recording_calls()
+    bus = CommandBus()
+    bus.publish(CommandEvent("please start recording now", source="text"))
+    bus.publish(CommandEvent("Redo", source="text"))
+
+    names = [registry.dispatch(event) for event in bus.drain()]
+
+    assert names == ["start recording", "redo"]
+    assert calls == [("start recording", "please start recording now"), ("redo", "Redo")]
+    assert bus.drain() == []
+    assert registry.last_latency_ms >= 0
+
+
+def test_unknown_phrase_dispatches_nothing():
+    registry, calls = registry_recording_calls()
+
+    assert registry.dispatch(CommandEvent("reddish", source="text")) is None
+    assert calls == []
@@ -0,0 +1,31 @@
+import numpy as np
+from drawing import DrawingCanvas
+
+
+def draw_lines(both_hands):
+    # two hands stroking side by side inside the same tile, a few points at a time
+    canvas = DrawingCanvas(512, 512)
+    for i in range(20):
+        x = 10 + i * 10
+        canvas.draw_path(np.array([(x, 50), (x + 10, 50)], np.int32), 6, (0, 0, 255), hand_id=0)
+        if both_hands:
+            canvas.draw_path(np.array([(x, 80), (x + 10, 80)], np.int32), 6, (255, 0, 0), hand_id=1)
+    return canvas.layers.read((0, 0, 256, 256))
+
+
+def test_hands_in_the_same_tile_keep_each_others_ink():
+    alone_pixels, alone_mask = draw_lines(both_hands=False)
+    pixels, mask = draw_lines(both_hands=True)
+
+    assert np.array_equal(pixels[40:60], alone_pixels[40:60])
+    assert np.array_equal(mask[40:60], alone_mask[40:60])
+    assert (mask[75:86] > 0).sum() == (alone_mask[45:56] > 0).sum()
+
+
+def test_translucent_stroke_does_not_build_up_over_itself():
+    canvas = DrawingCanvas(512, 512)
+    for _ in range(4):
+        canvas.draw_path(np.array([(10, 50), (200, 50)], np.int32), 6, (0, 0, 255), alpha=96, hand_id=0)
+    _, mask = canvas.layers.read((0, 0, 256, 256))
+
+    assert mask[50, 100] == 96
@@ -0,0 +1,60 @@
+import time
+
+from drawing import DrawingCanvas
+from stream import StreamServer, StreamViewer
+
+
+def publish_until_matched(server, canvas, viewers, timeout=5.0):
+    # the keyframe goes out over several publishes, keep publishing until
+    # every viewer has caught up or the time runs out
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        server.publish()
+        if all(viewer.matches(canvas) for viewer in viewers):
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def stroke(canvas, y):
+    canvas.start_drawing((20, y))
+    for x in range(20, 600, 15):
+        canvas.draw((x, y + x // 10))
+    canvas.stop_drawing()
+
+
+def test_viewers_end_up_with_the_canvas_tiles():
+    canvas = DrawingCanvas(640, 480)
+    server = StreamServer(canvas, host="127.0.0.1", port=0, fps=1000, keyframe_tiles=2)
+    server.start()
+    try:
+        # one viewer joins with ink already drawn and one is slow, so gets merged updates
+        stroke(canvas, 100)
+        viewers = [StreamViewer("127.0.0.1", server.port, name="fast"),
+                   StreamViewer("127.0.0.1", server.port, delay=0.05, name="slow")]
+        for viewer in viewers:
+            viewer.start()
+
+        assert publish_until_matched(server, canvas, viewers)
+        stroke(canvas, 300)
+        assert publish_until_matched(server, canvas, viewers)
+        assert viewers[0].tiles
+    finally:
+        server.stop()
+
+
+def test_cleared_tiles_are_dropped_by_viewers():
+    canvas = DrawingCanvas(640, 480)
+    server = StreamServer(canvas, host="127.0.0.1", port=0, fps=1000)
+    server.start()
+    try:
+        viewer = StreamViewer("127.0.0.1", server.port)
+        viewer.start()
+        stroke(canvas, 100)
+        assert publish_until_matched(server, canvas, [viewer])
+
+        canvas.clear()
+        assert publish_until_matched(server, canvas, [viewer])
+        assert viewer.tiles == {}
+    finally:
+        server.stop()